@@ -0,0 +1,96 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from marketplace.models import RbacUser, UserRoles, Customer, Technician, DeliveryGuy, Cashier
+
+# request.user is an instance of the model of the user's role (admins are plain RbacUsers)
+role_models = {
+    UserRoles.CUSTOMER: Customer,
+    UserRoles.TECHNICIAN: Technician,
+    UserRoles.DELIVERY_GUY: DeliveryGuy,
+    UserRoles.CASHIER: Cashier,
+}
+
+# fields not kept with the token, they are loaded from the database when read: the password hash, and state changed
+# by queryset updates that do not reach the cache (current_delivery is set to null when its order is deleted)
+uncached_fields = {'password', 'current_delivery_id'}
+
+
+def token_cache():
+    return caches[settings.AUTH_TOKEN_CACHE]
+
+
+def cache_key(key: str) -> str:
+    return f"auth:token:{key}"
+
+
+def token_expired(created) -> bool:
+    return settings.AUTH_TOKEN_EXPIRY is not None and \
+        created + timedelta(seconds=settings.AUTH_TOKEN_EXPIRY) <= timezone.now()
+
+
+def forget_token(key: str):
+    token_cache().delete(cache_key(key))
+
+
+def forget_user(user_id):
+    """Drops the cached claims of a user, e.g. after the user is approved, changed or deleted"""
+    for key in Token.objects.filter(user_id=user_id).values_list('key', flat=True):
+        forget_token(key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that loads the token with the row of the user's role model (Customer, Technician, ...) in
+    one query and keeps the row in the AUTH_TOKEN_CACHE for AUTH_TOKEN_CACHE_TTL seconds, so request.user is the
+    concrete user and an authenticated request does not query the database. Tokens older than AUTH_TOKEN_EXPIRY
+    seconds are rejected and deleted.
+    """
+
+    def authenticate_credentials(self, key):
+        claims = token_cache().get(cache_key(key))
+        if claims is None:
+            claims = self.load_claims(key)
+        if token_expired(claims['created']):
+            Token.objects.filter(key=key).delete()
+            raise exceptions.AuthenticationFailed('Token has expired.')
+        values = claims['values']
+        if not values['is_active']:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+        model = role_models.get(values['role'], RbacUser)
+        # from_db takes the values in the order of the model fields, the missing ones are deferred
+        field_names = [field.attname for field in model._meta.concrete_fields if field.attname in values]
+        user = model.from_db(model.objects.db, field_names, [values[name] for name in field_names])
+        return user, key
+
+    def load_claims(self, key) -> dict:
+        related = [f"user__{model._meta.model_name}" for model in role_models.values()]
+        try:
+            token = Token.objects.select_related(*related).get(key=key)
+        except Token.DoesNotExist:
+            raise exceptions.AuthenticationFailed('Invalid token.')
+
+        user = token.user
+        model = role_models.get(user.role)
+        if model is not None:
+            user = getattr(user, model._meta.model_name, None) or user
+        claims = {
+            'created': token.created,
+            'values': {field.attname: field.get_prep_value(getattr(user, field.attname))
+                       for field in type(user)._meta.concrete_fields if field.attname not in uncached_fields},
+        }
+        timeout = settings.AUTH_TOKEN_CACHE_TTL
+        if settings.AUTH_TOKEN_EXPIRY is not None:
+            # never outlives the token
+            remaining = token.created + timedelta(seconds=settings.AUTH_TOKEN_EXPIRY) - timezone.now()
+            timeout = max(0, min(timeout, int(remaining.total_seconds())))
+        if timeout:
+            token_cache().set(cache_key(key), claims, timeout)
+        return claims
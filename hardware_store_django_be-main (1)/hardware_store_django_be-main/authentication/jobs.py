@@ -0,0 +1,16 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from helpers.functions import delete_in_chunks
+from helpers.scheduler import register
+
+
+@register(interval=3600, jitter=300)
+def delete_expired_tokens() -> int:
+    if settings.AUTH_TOKEN_EXPIRY is None:
+        return 0
+    expired = Token.objects.filter(created__lt=timezone.now() - timedelta(seconds=settings.AUTH_TOKEN_EXPIRY))
+    return delete_in_chunks(expired, 'created')
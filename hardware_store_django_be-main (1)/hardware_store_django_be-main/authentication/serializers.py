@@ -1,5 +1,6 @@
 from rest_framework import serializers
 
+from marketplace.images import ThumbnailsField
 from marketplace.models import RbacUser, Technician, DeliveryGuy, Customer, Address
 
 
@@ -14,21 +15,23 @@ class RbacUserSerializer(serializers.ModelSerializer):
 class TechnicianSerializer(serializers.ModelSerializer):
     role = serializers.CharField(read_only=True)
     is_approved = serializers.BooleanField(read_only=True)
+    nic_image_thumbnails = ThumbnailsField(source='nic_image')
 
     class Meta:
         model = Technician
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 'role', 'phone',
-                  'nic_no', 'nic_image', 'rate_per_hour', 'is_approved', 'skill_category']
+                  'nic_no', 'nic_image', 'nic_image_thumbnails', 'rate_per_hour', 'is_approved', 'skill_category']
 
 
 class DeliveryGuySerializer(serializers.ModelSerializer):
     role = serializers.CharField(read_only=True)
     is_approved = serializers.BooleanField(read_only=True)
+    nic_image_thumbnails = ThumbnailsField(source='nic_image')
 
     class Meta:
         model = DeliveryGuy
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 'role', 'phone',
-                  'nic_no', 'nic_image', 'vehicle_type', 'is_approved', 'current_delivery']
+                  'nic_no', 'nic_image', 'nic_image_thumbnails', 'vehicle_type', 'is_approved', 'current_delivery']
 
 
 class AddressSerializer(serializers.ModelSerializer):
@@ -0,0 +1,33 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from marketplace.models import RbacUser, Customer, Technician, DeliveryGuy, Cashier
+from .backends import forget_token, forget_user, uncached_fields
+
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    # logout and account delete (the token is deleted with the user)
+    key = instance.key
+    forget_token(key)
+    transaction.on_commit(lambda: forget_token(key))
+
+
+@receiver(post_save, sender=RbacUser)
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=Technician)
+@receiver(post_save, sender=DeliveryGuy)
+@receiver(post_save, sender=Cashier)
+def forget_saved_user(sender, instance, update_fields=None, **kwargs):
+    # approvals, role or activation changes of any kind of user
+    if kwargs.get('created') or kwargs.get('raw'):
+        return
+    if update_fields is not None and \
+            {sender._meta.get_field(name).attname for name in update_fields} <= uncached_fields:
+        # only fields the claims don't keep, e.g. the current delivery of a delivery guy
+        return
+    user_id = instance.pk
+    forget_user(user_id)
+    transaction.on_commit(lambda: forget_user(user_id))
@@ -1,3 +1,92 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from marketplace.models import Customer, DeliveryGuy, RbacUser, Technician, UserRoles
+
+
+def token_client(user):
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=user).key}")
+    return client
+
+
+class CachedTokenAuthenticationTests(TestCase):
+
+    def setUp(self):
+        self.customer = Customer.objects.create_user('customer', 'customer@shop.aa', None)
+        self.client = token_client(self.customer)
+
+    def test_cached_token_costs_no_query(self):
+        self.assertEqual(self.client.get('/auth/health/').status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get('/auth/health/').status_code, 200)
+        self.assertEqual(len(queries), 0)
+
+    def test_logout_drops_cached_token(self):
+        self.assertEqual(self.client.get('/auth/health/').status_code, 200)
+        self.assertEqual(self.client.post('/account/logout/').status_code, 200)
+        self.assertEqual(self.client.get('/auth/health/').status_code, 401)
+
+    def test_account_delete_drops_cached_token(self):
+        self.assertEqual(self.client.get('/auth/health/').status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete('/account/').status_code, 204)
+        self.assertEqual(self.client.get('/auth/health/').status_code, 401)
+
+    def test_approval_is_seen_by_cached_token(self):
+        driver = DeliveryGuy.objects.create_user('driver', 'driver@shop.aa', None, nic_no='1', nic_image='nic.png',
+                                                 vehicle_type='bike')
+        driver_client = token_client(driver)
+        admin = RbacUser.objects.create_user('admin', 'admin@shop.aa', None, role=UserRoles.ADMIN)
+        # no such order, an approved delivery guy gets past the permission check
+        accept_order = '/delivery_guy/accept/order/0'
+        self.assertEqual(driver_client.put(accept_order).status_code, 403)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(token_client(admin).post(f"/admin_area/approve/delivery_guy/{driver.id}").status_code,
+                             200)
+        self.assertEqual(driver_client.put(accept_order).status_code, 400)
+
+    def test_saves_of_uncached_fields_keep_the_claims(self):
+        driver = DeliveryGuy.objects.create_user('driver', 'driver@shop.aa', None, nic_no='1', nic_image='nic.png',
+                                                 vehicle_type='bike')
+        driver_client = token_client(driver)
+        self.assertEqual(driver_client.get('/auth/health/').status_code, 200)
+
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            driver.current_delivery = None
+            driver.save(update_fields=['current_delivery'])
+        self.assertEqual(len(queries), 1)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(driver_client.get('/auth/health/').status_code, 200)
+        self.assertEqual(len(queries), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            driver.is_approved = True
+            driver.save(update_fields=['is_approved'])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(driver_client.get('/auth/health/').status_code, 200)
+        self.assertEqual(len(queries), 1)
+
+    def test_request_user_is_the_concrete_user(self):
+        technician = Technician.objects.create_user('technician', 'technician@shop.aa', None, nic_no='1',
+                                                    nic_image='nic.png', rate_per_hour=10, skill_category='mason')
+        client = token_client(technician)
+        self.assertEqual(client.get('/auth/health/').status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/account/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['skill_category'], 'mason')
+        self.assertEqual(len(queries), 0)
+
+    @override_settings(AUTH_TOKEN_EXPIRY=3600)
+    def test_expired_token_is_rejected(self):
+        Token.objects.filter(user=self.customer).update(created=timezone.now() - timedelta(hours=2))
+        self.assertEqual(self.client.get('/auth/health/').status_code, 401)
+        self.assertFalse(Token.objects.filter(user=self.customer).exists())
@@ -1,17 +1,18 @@
 from rest_framework import status
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.authtoken.models import Token
+from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from authentication.backends import CachedTokenAuthentication, token_expired
 from authentication.serializers import CustomerSerializer, TechnicianSerializer, DeliveryGuySerializer, \
     RbacUserSerializer, CashierSerializer
-from marketplace.models import Customer, UserRoles, Technician, DeliveryGuy, RbacUser, Cashier, Address
+from marketplace.models import Customer, UserRoles, Technician, DeliveryGuy, Address
 
 
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 def health_check(request):
     content = {
@@ -67,35 +68,47 @@ def signup(request, role=UserRoles.CUSTOMER):
             return Response({'error': str(err)}, status=status.HTTP_400_BAD_REQUEST)
 
 
+class Login(ObtainAuthToken):
+    """obtain_auth_token handing out a new token in place of an expired one"""
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data['user']
+        token, created = Token.objects.get_or_create(user=user)
+        if not created and token_expired(token.created):
+            token.delete()
+            token = Token.objects.create(user=user)
+        return Response({'token': token.key})
+
+
+login = Login.as_view()
+
+
 @api_view(['GET', 'PUT', 'DELETE'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 def account(request):
+    # request.user is already the Technician, Customer, ... of the role
     role = request.user.role
-    user_model_class = None
     serializer_class = None
     if role == UserRoles.TECHNICIAN:
         serializer_class = TechnicianSerializer
-        user_model_class = Technician
     elif role == UserRoles.CUSTOMER:
         serializer_class = CustomerSerializer
-        user_model_class = Customer
     elif role == UserRoles.DELIVERY_GUY:
         serializer_class = DeliveryGuySerializer
-        user_model_class = DeliveryGuy
     elif role == UserRoles.ADMIN:
         serializer_class = RbacUserSerializer
-        user_model_class = RbacUser
     elif role == UserRoles.CASHIER:
         serializer_class = CashierSerializer
-        user_model_class = Cashier
 
     if request.method == 'GET':
-        user = user_model_class.objects.get(id=request.user.id)
+        user = request.user
         serializer = serializer_class(user)
         return Response(serializer.data, status=200)
     elif request.method == 'PUT':
-        user = user_model_class.objects.get(id=request.user.id)
+        user = request.user
 
         serializer = serializer_class(user, request.data)
         if not serializer.is_valid():
@@ -120,7 +133,7 @@ def account(request):
 
 
 @api_view(['POST'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 def logout(request):
     # Get the current user
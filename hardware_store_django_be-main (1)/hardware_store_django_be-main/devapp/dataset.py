@@ -0,0 +1,311 @@
+import itertools
+import random
+import time
+from array import array
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.admin.models import LogEntry
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from marketplace import catalog_cache, search
+from marketplace.models import Item, Feedback, Cart, CartItem, Order, OrderItem, PosOrder, PosOrderItem, Address, \
+    TechnicianBooking, RbacUser, Customer, Technician, DeliveryGuy, Cashier, StockHold, StockMovement, StockSnapshot, \
+    StockShard, OrderStates, BookingStates, MovementKinds
+
+first_names = ['Nimal', 'Kamal', 'Sunil', 'Amara', 'Chathuri', 'Dilani', 'Saman', 'Ruwan', 'Nethmi', 'Kasun',
+               'Tharindu', 'Ishara', 'Madhavi', 'Pradeep', 'Lakmal', 'Sanduni', 'Hasini', 'Roshan', 'Anjali', 'Dinesh']
+last_names = ['Perera', 'Fernando', 'Silva', 'Jayasinghe', 'Bandara', 'Wickramasinghe', 'Gunawardena', 'Dissanayake',
+              'Rathnayake', 'Herath', 'Kumara', 'Rajapaksha', 'Weerasinghe', 'Senanayake', 'Karunaratne']
+cities = ['Colombo', 'Kandy', 'Galle', 'Matara', 'Kurunegala', 'Negombo', 'Jaffna', 'Anuradhapura', 'Ratnapura']
+words = ['copper', 'wire', 'cable', 'hammer', 'steel', 'pipe', 'valve', 'cement', 'brick', 'tile', 'paint', 'brush',
+         'drill', 'screw', 'bolt', 'nut', 'washer', 'hinge', 'lock', 'switch', 'socket', 'bulb', 'tape', 'glue',
+         'sand', 'gravel', 'plank', 'plywood', 'nail', 'saw', 'chisel', 'spanner', 'wrench', 'ladder', 'bucket']
+skills = ['mason', 'plumber', 'electrician', 'carpenter', 'painter', 'tiler', 'welder']
+vehicles = ['bike', 'three wheeler', 'van', 'lorry']
+
+# every row of these tables is generated data, truncate() empties them
+generated_models = [Feedback, StockHold, StockShard, StockSnapshot, StockMovement, CartItem, Cart, OrderItem,
+                    PosOrderItem, PosOrder, TechnicianBooking, Address, Customer, Technician, DeliveryGuy, Cashier,
+                    Order, Item]
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def delete_rows(queryset) -> int:
+    """One DELETE ... WHERE pk IN (SELECT ...), QuerySet.delete() would load every row for cascades and signals"""
+    model, quote = queryset.model, connection.ops.quote_name
+    select, params = queryset.values('pk').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {quote(model._meta.db_table)} WHERE {quote(model._meta.pk.column)} IN ({select})",
+                       params)
+        return cursor.rowcount
+
+
+def truncate():
+    """Empties the tables of generated data and removes every user but the staff, a few statements in all"""
+    tables = [model._meta.db_table for model in generated_models]
+    if search.index_available():
+        tables.append(search.index_table)
+    with transaction.atomic():
+        connection.ops.execute_sql_flush(connection.ops.sql_flush(no_style(), tables))
+        users = RbacUser.objects.filter(is_staff=False)
+        delete_rows(Token.objects.filter(user__in=users))
+        delete_rows(LogEntry.objects.filter(user__in=users))
+        delete_rows(RbacUser.groups.through.objects.filter(rbacuser__in=users))
+        delete_rows(RbacUser.user_permissions.through.objects.filter(rbacuser__in=users))
+        delete_rows(users)
+    catalog_cache.invalidate()
+
+
+def insert_rows(model, objects):
+    """
+    INSERT of the model's own columns with the values as set on the objects. bulk_create() refuses models with
+    multi-table inheritance and overwrites auto_now_add timestamps, which would put the whole history at now.
+    """
+    # rows without an id get theirs from the database
+    fields = [field for field in model._meta.local_concrete_fields
+              if not (field.primary_key and getattr(objects[0], field.attname) is None)]
+    quote = connection.ops.quote_name
+    sql = f"INSERT INTO {quote(model._meta.db_table)} ({', '.join(quote(field.column) for field in fields)}) " \
+          f"VALUES ({', '.join(['%s'] * len(fields))})"
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [[field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields]
+                                 for obj in objects])
+
+
+def write_rows(model, objects):
+    if model._meta.parents:
+        # users: the RbacUser rows first, then the rows of the role table sharing their ids
+        parent = model._meta.pk.remote_field.model
+        parent.objects.bulk_create([parent(**{field.attname: getattr(obj, field.attname)
+                                              for field in parent._meta.concrete_fields}) for obj in objects])
+        for obj in objects:
+            setattr(obj, model._meta.pk.attname, obj.id)
+        insert_rows(model, objects)
+    elif any(getattr(field, 'auto_now_add', False) for field in model._meta.local_concrete_fields):
+        insert_rows(model, objects)
+    else:
+        model.objects.bulk_create(objects)
+
+
+class Generator:
+    """
+    Seeded generator of a marketplace dataset, written in chunks of bulk inserts. Ids are assigned here (after
+    the existing rows) so related rows are generated without reading anything back. Popularity is skewed like
+    real traffic: few items sell most, few customers buy most, orders get more frequent towards today.
+    """
+
+    def __init__(self, seed=1, chunk_size=5000, password='pass', log=None):
+        self.rand = random.Random(seed)
+        self.chunk_size = chunk_size
+        # hashed once, every generated user logs in with the same password
+        self.password = make_password(password)
+        self.log = log or (lambda message: None)
+        self.now = timezone.now()
+
+    @staticmethod
+    def next_id(model) -> int:
+        return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+    def picker(self, ids, exponent):
+        """Draws ids with zipf like popularity, the popular ones are spread over the id range"""
+        ids = list(ids)
+        self.rand.shuffle(ids)
+        cum_weights = list(itertools.accumulate(1 / rank ** exponent for rank in range(1, len(ids) + 1)))
+        return lambda k=1: self.rand.choices(ids, cum_weights=cum_weights, k=k)
+
+    def past(self, days, recent_bias=1.0):
+        # a bias above 1 packs the times towards now, like a growing shop
+        return self.now - timedelta(seconds=days * 86400 * self.rand.random() ** recent_bias)
+
+    def save(self, model, objects, dependents=None) -> int:
+        """
+        Writes the objects in chunks, one transaction each. `dependents` is a list the objects' generator fills
+        with rows referencing them (e.g. the items of orders), written with each chunk and emptied.
+        """
+        start, count, dependent_count = time.perf_counter(), 0, 0
+        for chunk in chunked(objects, self.chunk_size):
+            with transaction.atomic():
+                write_rows(model, chunk)
+                if dependents:
+                    for dependent_chunk in chunked(dependents, self.chunk_size):
+                        write_rows(type(dependent_chunk[0]), dependent_chunk)
+                    dependent_count += len(dependents)
+                    dependents.clear()
+            count += len(chunk)
+        elapsed = time.perf_counter() - start
+        related = f" (+{dependent_count} related rows)" if dependent_count else ""
+        self.log(f"{model.__name__}: {count}{related} in {elapsed:.1f}s")
+        return count
+
+    def users(self, model, count, **fields):
+        """Users of a role, `fields` are callables returning the value of a field of each user"""
+        first = self.next_id(RbacUser)
+        for user_id in range(first, first + count):
+            yield model(id=user_id, username=f"{model._meta.model_name}{user_id}", email=f"user{user_id}@shop.aa",
+                        password=self.password, first_name=self.rand.choice(first_names),
+                        last_name=self.rand.choice(last_names), phone=str(self.rand.randint(700000000, 789999999)),
+                        date_joined=self.past(730), **{name: value() for name, value in fields.items()})
+
+    def run(self, items=0, customers=0, technicians=0, delivery_guys=0, cashiers=0, orders=0, pos_orders=0,
+            bookings=0, feedback=0, cart_share=0.3, days=365) -> dict:
+        """Generates the rows and returns the id range of each kind"""
+        rand = self.rand
+        generated = {}
+
+        first = self.next_id(Item)
+        generated['items'] = item_ids = range(first, first + items)
+        # price of each item in cents, for order totals
+        prices = array('q')
+
+        restocks = []
+
+        def item_rows():
+            for item_id in item_ids:
+                # many cheap items and a long tail of expensive ones
+                price = min(int(rand.lognormvariate(7, 1.5)) + 50, 10 ** 9)
+                prices.append(price)
+                quantity = 0 if rand.random() < 0.1 else rand.randint(1, 500)
+                if quantity:
+                    # the stock is in the ledger from the start of the history
+                    restocks.append(StockMovement(item_id=item_id, kind=MovementKinds.RESTOCK, change=quantity,
+                                                  time=self.now - timedelta(days=days)))
+                yield Item(id=item_id, name=' '.join(rand.choices(words, k=3)),
+                           description=' '.join(rand.choices(words, k=12)), price=Decimal(price) / 100,
+                           quantity=quantity)
+
+        self.save(Item, item_rows(), restocks)
+
+        generated['customers'] = customer_ids = self.save_users(Customer, customers)
+        generated['technicians'] = self.save_users(
+            Technician, technicians, nic_no=lambda: str(rand.randint(10 ** 9, 10 ** 10 - 1)),
+            rate_per_hour=lambda: Decimal(rand.randint(500, 5000)), skill_category=lambda: rand.choice(skills),
+            is_approved=lambda: rand.random() < 0.9, updated_at=lambda: self.now)
+        generated['delivery_guys'] = self.save_users(
+            DeliveryGuy, delivery_guys, nic_no=lambda: str(rand.randint(10 ** 9, 10 ** 10 - 1)),
+            vehicle_type=lambda: rand.choice(vehicles), is_approved=lambda: rand.random() < 0.9)
+        generated['cashiers'] = self.save_users(Cashier, cashiers)
+
+        self.save(Address, (Address(customer_id=customer_id, address=f"{rand.randint(1, 500)}, {rand.choice(words)} "
+                                                                     f"road, {rand.choice(cities)}")
+                            for customer_id in customer_ids))
+
+        popular_item = self.picker(item_ids, 1.1) if item_ids else None
+
+        def line_items(model, **parent):
+            """Distinct items of an order or cart, mostly one or two"""
+            count = rand.choices([1, 2, 3, 4, 5, 8, 12], [40, 25, 12, 8, 6, 5, 4])[0]
+            return [model(item_id=item_id, quantity=rand.choices([1, 2, 3, 5, 10], [60, 20, 10, 6, 4])[0], **parent)
+                    for item_id in dict.fromkeys(popular_item(count))]
+
+        def total(lines) -> Decimal:
+            return Decimal(sum(prices[line.item_id - item_ids.start] * line.quantity for line in lines)) / 100
+
+        if customer_ids and item_ids:
+            active_customer = self.picker(customer_ids, 1.0)
+            cart_items = []
+
+            def cart_rows():
+                first_cart = self.next_id(Cart)
+                for cart_id, customer_id in enumerate(rand.sample(customer_ids, int(len(customer_ids) * cart_share)),
+                                                      start=first_cart):
+                    cart_items.extend(line_items(CartItem, cart_id=cart_id))
+                    yield Cart(id=cart_id, customer_id=customer_id)
+
+            self.save(Cart, cart_rows(), cart_items)
+
+            first = self.next_id(Order)
+            generated['orders'] = order_ids = range(first, first + orders)
+            order_items = []
+
+            def order_rows():
+                for order_id in order_ids:
+                    lines = line_items(OrderItem, order_id=order_id)
+                    order_items.extend(lines)
+                    ordered = self.past(days, recent_bias=2)
+                    yield Order(id=order_id, customer_id=active_customer()[0], time=ordered, total=total(lines),
+                                delivery_fee=Decimal(rand.choice([250, 350, 500, 750])),
+                                status=OrderStates.PAID if self.now - ordered < timedelta(days=1)
+                                else OrderStates.DELIVERED)
+
+            self.save(Order, order_rows(), order_items)
+            self.assign_deliveries(generated['delivery_guys'], order_ids)
+
+        if generated['cashiers'] and item_ids:
+            first = self.next_id(PosOrder)
+            generated['pos_orders'] = pos_order_ids = range(first, first + pos_orders)
+            pos_items = []
+
+            def pos_order_rows():
+                for pos_order_id in pos_order_ids:
+                    lines = line_items(PosOrderItem, pos_order_id=pos_order_id)
+                    pos_items.extend(lines)
+                    yield PosOrder(id=pos_order_id, cashier_id=rand.choice(generated['cashiers']),
+                                   time=self.past(days, recent_bias=2), total=total(lines))
+
+            self.save(PosOrder, pos_order_rows(), pos_items)
+
+        if customer_ids and generated['technicians']:
+            busy_technician = self.picker(generated['technicians'], 0.8)
+            self.save(TechnicianBooking, (self.booking(active_customer()[0], busy_technician()[0])
+                                          for _ in range(bookings)))
+        if customer_ids and item_ids:
+            self.save(Feedback, (Feedback(item_id=popular_item()[0], customer_id=active_customer()[0],
+                                          description=' '.join(rand.choices(words, k=rand.randint(3, 20))))
+                                 for _ in range(feedback)))
+
+        with connection.cursor() as cursor:
+            # ids were given explicitly, the sequences of databases that have them are moved past them
+            for sql in connection.ops.sequence_reset_sql(no_style(), [RbacUser, Item, Cart, Order, PosOrder]):
+                cursor.execute(sql)
+        if search.index_available():
+            search.rebuild_index()
+        catalog_cache.invalidate()
+        return generated
+
+    def save_users(self, model, count, **fields) -> range:
+        first = self.next_id(RbacUser)
+        self.save(model, self.users(model, count, **fields))
+        return range(first, first + count)
+
+    def booking(self, customer_id, technician_id):
+        rand = self.rand
+        skill = rand.choice(skills)
+        # the scheduler deletes bookings older than a day, so they are all recent
+        created = self.past(1)
+        booking = TechnicianBooking(customer_id=customer_id, technician_id=technician_id, created_time=created,
+                                    title=f"Need a {skill}", job_description=' '.join(rand.choices(words, k=15)),
+                                    status=rand.choices(BookingStates.values, [30, 15, 15, 10, 10, 10, 10])[0])
+        if booking.status != BookingStates.PENDING:
+            booking.estimated_time = rand.randint(1, 40)
+            booking.working_date = (created + timedelta(days=rand.randint(0, 14))).date()
+            booking.requested_rate = Decimal(rand.randint(500, 5000))
+        if booking.status in (BookingStates.TECHNICIAN_WORK_STARTED, BookingStates.TECHNICIAN_COMPLETED,
+                              BookingStates.CUSTOMER_APPROVED):
+            booking.working_start_time = created + timedelta(hours=rand.randint(1, 20))
+        if booking.status in (BookingStates.TECHNICIAN_COMPLETED, BookingStates.CUSTOMER_APPROVED):
+            booking.working_end_time = booking.working_start_time + timedelta(hours=booking.estimated_time)
+        return booking
+
+    def assign_deliveries(self, delivery_guy_ids, order_ids):
+        """Half of the approved delivery guys are out with one of the latest PAID orders"""
+        guys = list(DeliveryGuy.objects.filter(id__gte=delivery_guy_ids.start, id__lt=delivery_guy_ids.stop,
+                                               is_approved=True)
+                    .values_list('id', flat=True)[:len(delivery_guy_ids) // 2])
+        orders = list(Order.objects.filter(id__gte=order_ids.start, id__lt=order_ids.stop, status=OrderStates.PAID)
+                      .order_by('-time').values_list('id', flat=True)[:len(guys)])
+        with transaction.atomic():
+            Order.objects.filter(id__in=orders).update(status=OrderStates.AWAITING_DELIVERY)
+            DeliveryGuy.objects.bulk_update([DeliveryGuy(rbacuser_ptr_id=guy, current_delivery_id=order)
+                                             for guy, order in zip(guys, orders)], ['current_delivery'],
+                                            batch_size=self.chunk_size)
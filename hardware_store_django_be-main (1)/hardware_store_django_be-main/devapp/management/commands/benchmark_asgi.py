@@ -0,0 +1,170 @@
+import asyncio
+import io
+import logging
+import random
+import statistics
+import threading
+import time
+from decimal import Decimal
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from rest_framework.authtoken.models import Token
+
+from marketplace import search
+from marketplace.models import Item, Technician, Customer, Cart, Order
+
+words = ['copper', 'wire', 'cable', 'hammer', 'steel', 'pipe', 'valve', 'cement', 'brick', 'tile', 'paint', 'brush']
+
+
+class Command(BaseCommand):
+    help = 'Compare requests/sec and latency of the read endpoints under WSGI (sync views) and ASGI (async views)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=5000)
+        parser.add_argument('--requests', type=int, default=2000, help='requests per run')
+        parser.add_argument('--concurrency', type=int, default=64, help='threads (WSGI) or tasks (ASGI) in flight')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        # one log line per request would drown the results
+        logging.getLogger('helpers.instrumentation').setLevel(logging.WARNING)
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.run(options)
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def populate(self, options):
+        rand = random.Random(options['seed'])
+        Item.objects.bulk_create([Item(name=' '.join(rand.choices(words, k=3)),
+                                       description=' '.join(rand.choices(words, k=10)),
+                                       price=Decimal(rand.randint(100, 100000)) / 100, quantity=rand.randint(0, 50))
+                                  for _ in range(options['items'])], batch_size=1000)
+        search.rebuild_index()
+        for i in range(20):
+            Technician.objects.create_user(f"technician{i}", f"technician{i}@shop.aa", None, nic_no=str(i),
+                                           rate_per_hour=10, skill_category='mason', is_approved=True)
+        customer = Customer.objects.create_user('customer', 'customer@shop.aa', None)
+        cart = Cart.objects.create(customer=customer)
+        for item in Item.objects.order_by('id')[:10]:
+            cart.items.create(item=item, quantity=1)
+        Order.objects.bulk_create([Order(customer=customer, total=10, delivery_fee=1) for _ in range(20)])
+        return Token.objects.create(user=customer).key
+
+    def run(self, options):
+        token = self.populate(options)
+        connection.close()
+        item_ids = list(range(1, options['items'] + 1))
+        rand = random.Random(options['seed'])
+
+        def paths(prefix):
+            # hot read endpoints, the catalog list itself is served from the rendered page cache by both
+            return [f"{prefix}items/{rand.choice(item_ids)}",
+                    f"{prefix}items/search/{rand.choice(words)}",
+                    f"{prefix}technicians/",
+                    f"{prefix}cart/",
+                    f"{prefix}account/purchased/"]
+
+        requests = [paths('/') for _ in range(options['requests'] // 5)]
+        sync_requests = [request for group in requests for request in group]
+        async_requests = [path.replace('/', '/async/', 1) for path in sync_requests]
+
+        self.stdout.write(f"{options['items']} items, {len(sync_requests)} requests per run, "
+                          f"concurrency {options['concurrency']}")
+        for name, runner, batch in [('WSGI sync views', self.run_wsgi, sync_requests),
+                                    ('ASGI sync views', self.run_asgi, sync_requests),
+                                    ('ASGI async views', self.run_asgi, async_requests)]:
+            # one warm up pass fills the token and page caches
+            runner(batch[:50], token, options['concurrency'])
+            elapsed, latencies, errors = runner(batch, token, options['concurrency'])
+            latencies.sort()
+            self.stdout.write(f"{name:17} {len(batch) / elapsed:8.0f} req/s | "
+                              f"p50 {statistics.median(latencies):7.1f} ms | "
+                              f"p99 {latencies[int(len(latencies) * 0.99) - 1]:7.1f} ms | errors {errors}")
+
+    @staticmethod
+    def run_wsgi(batch, token, concurrency):
+        handler = WSGIHandler()
+        latencies, errors = [], []
+        pending = iter(batch)
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                while True:
+                    with lock:
+                        request = next(pending, None)
+                    if request is None:
+                        return
+                    environ = {
+                        'REQUEST_METHOD': 'GET', 'PATH_INFO': request, 'QUERY_STRING': '', 'SCRIPT_NAME': '',
+                        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                        'wsgi.input': io.BytesIO(), 'wsgi.errors': io.StringIO(), 'wsgi.url_scheme': 'http',
+                        'HTTP_AUTHORIZATION': f"Token {token}",
+                    }
+                    statuses = []
+                    start = time.perf_counter()
+                    response = handler(environ, lambda status, headers: statuses.append(status))
+                    b''.join(response)
+                    response.close()
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    if not statuses[0].startswith('200'):
+                        errors.append(statuses[0])
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start, latencies, len(errors)
+
+    @staticmethod
+    def run_asgi(batch, token, concurrency):
+        handler = ASGIHandler()
+        latencies, errors = [], []
+
+        async def call(path):
+            headers = [(b'host', b'localhost'), (b'authorization', f"Token {token}".encode())]
+            scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                     'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+                     'root_path': '', 'headers': headers, 'client': ('127.0.0.1', 1), 'server': ('localhost', 80)}
+            messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+            disconnected = asyncio.get_running_loop().create_future()
+
+            async def receive():
+                # the request, then nothing until the handler stops listening for a disconnect
+                return messages.pop() if messages else await disconnected
+
+            status = []
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+
+            start = time.perf_counter()
+            await handler(scope, receive, send)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if status[0] != 200:
+                errors.append(status[0])
+
+        async def main():
+            pending = iter(batch)
+
+            async def worker():
+                for path in pending:
+                    await call(path)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            return time.perf_counter() - start
+
+        elapsed = asyncio.run(main())
+        return elapsed, latencies, len(errors)
@@ -0,0 +1,308 @@
+import json
+import logging
+import math
+import random
+import statistics
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import timedelta
+from pathlib import Path
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Count, F
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from authentication.backends import token_cache
+from devapp import dataset
+from marketplace import dispatch
+from marketplace.models import Item, Cart, CartItem, Order, RbacUser, Customer, Technician, DeliveryGuy, \
+    TechnicianBooking, UserRoles
+
+# the request of an endpoint: `prepare()` sets up the rows it needs, unmeasured, and returns (method, path, data)
+Endpoint = namedtuple('Endpoint', 'name actor prepare')
+
+default_budgets = Path(__file__).resolve().parents[2] / 'benchmark_budgets.json'
+
+# latency changes below this are noise, whatever the threshold
+min_regression_ms = 1.0
+# headroom of a p95 budget over the recorded p95 when the relative tolerance gives less, fast endpoints are noisy
+min_budget_headroom_ms = 5.0
+
+
+def percentile(latencies, p):
+    """Nearest rank percentile of sorted latencies"""
+    return latencies[max(math.ceil(p / 100 * len(latencies)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the API endpoints on a throwaway seeded database and check them against budgets and a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=20000)
+        parser.add_argument('--customers', type=int, default=2000)
+        parser.add_argument('--orders', type=int, default=5000)
+        parser.add_argument('--iterations', type=int, default=20, help='measured requests per endpoint')
+        parser.add_argument('--profile-iterations', type=int, default=3,
+                            help='extra requests per endpoint counting queries and allocations')
+        parser.add_argument('--only', help='only the endpoints whose name contains this')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='write the results as JSON to this file')
+        parser.add_argument('--budgets', default=str(default_budgets),
+                            help='JSON of {"endpoints": {endpoint: {"queries": n, "p95_ms": ms}}}, "" for none')
+        parser.add_argument('--write-budgets', metavar='PATH',
+                            help='record the budgets from this run instead of checking them, see --tolerance')
+        parser.add_argument('--tolerance', type=float, default=1.0,
+                            help='p95 budget over the recorded p95 written by --write-budgets, 1.0 is twice the p95')
+        parser.add_argument('--baseline', help='results JSON of an earlier run to compare with')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='p95 increase over the baseline that counts as a regression, 0.25 is +25%%')
+
+    def handle(self, *args, **options):
+        if options['write_budgets'] and options['only']:
+            raise CommandError('budgets are recorded from a run of every endpoint, drop --only')
+        # one log line per request would drown the results
+        logging.getLogger('helpers.instrumentation').setLevel(logging.WARNING)
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        setup_test_environment()
+        try:
+            results = self.run(options)
+        finally:
+            teardown_test_environment()
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(results, indent=2))
+        if options['write_budgets']:
+            Path(options['write_budgets']).write_text(json.dumps(self.budgets(results, options), indent=2) + '\n')
+            options['budgets'] = ''
+        failures = self.compare(results['endpoints'], options)
+        for failure in failures:
+            self.stderr.write(failure)
+        if failures:
+            raise CommandError(f"{len(failures)} budget or regression failures")
+
+    def run(self, options):
+        self.rand = random.Random(options['seed'])
+        generated = dataset.Generator(seed=options['seed']).run(
+            items=options['items'], customers=options['customers'], technicians=50, delivery_guys=20, cashiers=2,
+            orders=options['orders'], pos_orders=options['orders'] // 4, bookings=500, feedback=options['items'] // 4)
+        self.generated = generated
+        endpoints = [endpoint for endpoint in self.endpoints()
+                     if not options['only'] or options['only'] in endpoint.name]
+
+        results = {}
+        self.stdout.write(f"{'endpoint':24} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8} {'peak KB':>8}")
+        for endpoint in endpoints:
+            results[endpoint.name] = result = self.measure(endpoint, options['iterations'],
+                                                           options['profile_iterations'])
+            self.stdout.write(f"{endpoint.name:24} {result['p50_ms']:8.1f} {result['p95_ms']:8.1f} "
+                              f"{result['p99_ms']:8.1f} {result['queries']:8} {result['peak_kb']:8.0f}"
+                              + (f"  {result['errors']} errors" if result['errors'] else ''))
+        return {
+            'meta': {'time': timezone.now().isoformat(), 'django': django.get_version(),
+                     'database': connection.vendor, 'iterations': options['iterations'],
+                     'dataset': {name: len(ids) for name, ids in generated.items()}},
+            'endpoints': results,
+        }
+
+    def measure(self, endpoint, iterations, profile_iterations) -> dict:
+        client = self.clients[endpoint.actor]
+        # warms the token claims and the page caches
+        self.call(client, *endpoint.prepare())
+        latencies, errors = [], 0
+        for _ in range(iterations):
+            request = endpoint.prepare()
+            start = time.perf_counter()
+            response = self.call(client, *request)
+            latencies.append((time.perf_counter() - start) * 1000)
+            errors += response.status_code >= 400
+
+        # counted apart from the timed requests, query capture and tracemalloc slow them down
+        queries, peaks = [], []
+        for _ in range(profile_iterations):
+            request = endpoint.prepare()
+            tracemalloc.start()
+            with CaptureQueriesContext(connection) as captured:
+                response = self.call(client, *request)
+            peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+            tracemalloc.stop()
+            queries.append(len(captured))
+            errors += response.status_code >= 400
+
+        latencies.sort()
+        return {
+            'p50_ms': round(statistics.median(latencies), 2), 'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2), 'queries': max(queries, default=0),
+            'peak_kb': round(max(peaks, default=0), 1), 'errors': errors,
+        }
+
+    @staticmethod
+    def call(client, method, path, data=None):
+        if method == 'get':
+            return client.get(path, data)
+        return getattr(client, method)(path, json.dumps(data) if data is not None else None,
+                                       content_type='application/json')
+
+    @staticmethod
+    def budgets(results, options) -> dict:
+        """
+        Budgets recorded from a run: its query counts as they are, its p95 latencies plus `--tolerance` (at least
+        min_budget_headroom_ms). The run they come from is kept under "meta", they only hold on similar hardware.
+        """
+        tolerance = options['tolerance']
+        return {
+            'meta': {**results['meta'], 'tolerance': tolerance, 'min_headroom_ms': min_budget_headroom_ms},
+            'endpoints': {name: {'queries': result['queries'],
+                                 'p95_ms': round(max(result['p95_ms'] * (1 + tolerance),
+                                                     result['p95_ms'] + min_budget_headroom_ms), 1)}
+                          for name, result in results['endpoints'].items()},
+        }
+
+    def compare(self, results, options) -> list:
+        failures = []
+        budgets = json.loads(Path(options['budgets']).read_text())['endpoints'] if options['budgets'] else {}
+        for name, result in results.items():
+            if result['errors']:
+                failures.append(f"{name}: {result['errors']} failed requests")
+            budget = budgets.get(name)
+            if budget is None:
+                continue
+            if result['queries'] > budget['queries']:
+                failures.append(f"{name}: {result['queries']} queries, budget {budget['queries']}")
+            if result['p95_ms'] > budget['p95_ms']:
+                failures.append(f"{name}: p95 {result['p95_ms']} ms, budget {budget['p95_ms']} ms")
+
+        if options['baseline']:
+            baseline = json.loads(Path(options['baseline']).read_text())['endpoints']
+            for name, result in results.items():
+                before = baseline.get(name)
+                if before is None:
+                    continue
+                if result['queries'] > before['queries']:
+                    failures.append(f"{name}: {result['queries']} queries, {before['queries']} in the baseline")
+                limit = before['p95_ms'] * (1 + options['threshold'])
+                if result['p95_ms'] > limit and result['p95_ms'] - before['p95_ms'] > min_regression_ms:
+                    failures.append(f"{name}: p95 {result['p95_ms']} ms, {before['p95_ms']} ms in the baseline")
+        return failures
+
+    def client(self, user) -> Client:
+        token, _ = Token.objects.get_or_create(user_id=user.id)
+        return Client(headers={'Authorization': f"Token {token.key}"})
+
+    def endpoints(self):
+        rand, generated = self.rand, self.generated
+        token_cache().clear()
+        # the busiest customer and technician, their lists are the longest ones
+        customer = Customer.objects.annotate(count=Count('orders')).order_by('-count').first()
+        technician = Technician.objects.filter(is_approved=True) \
+            .annotate(count=Count('technicianbooking')).order_by('-count').first()
+        delivery_guy = DeliveryGuy.objects.filter(is_approved=True).first()
+        cashier = RbacUser.objects.get(id=generated['cashiers'][0])
+        admin = RbacUser.objects.create_user('benchmark_admin', 'admin@shop.aa', None, role=UserRoles.ADMIN,
+                                             is_staff=True)
+        self.clients = {'anonymous': Client(), 'customer': self.client(customer), 'technician': self.client(technician),
+                        'delivery_guy': self.client(delivery_guy), 'cashier': self.client(cashier),
+                        'admin': self.client(admin)}
+        self.login = {'username': customer.username, 'password': 'pass'}
+
+        item_ids = list(generated['items'])
+        cart, _ = Cart.objects.get_or_create(customer=customer)
+        cart_item = item_ids[0]
+        words = dataset.words
+
+        def restock(ids):
+            Item.objects.filter(id__in=ids).update(quantity=F('quantity') + 1000)
+
+        def cart_add():
+            CartItem.objects.filter(cart=cart, item_id=cart_item).delete()
+            restock([cart_item])
+            return 'post', f"/cart/item/{cart_item}", None
+
+        def cart_remove():
+            CartItem.objects.update_or_create(cart=cart, item_id=cart_item, defaults={'quantity': 1})
+            return 'delete', f"/cart/item/{cart_item}", None
+
+        def cart_patch():
+            lines = rand.sample(item_ids, 10)
+            restock(lines)
+            return 'patch', '/cart/', {'items': [{'item': item_id, 'quantity': rand.randint(0, 5)} for item_id in lines]}
+
+        def payment():
+            lines = rand.sample(item_ids, 3)
+            restock(lines)
+            cart, _ = Cart.objects.get_or_create(customer=customer)
+            cart.items.all().delete()
+            CartItem.objects.bulk_create([CartItem(cart=cart, item_id=item_id, quantity=2) for item_id in lines])
+            return 'post', '/cart/payment/', None
+
+        def pos_billing():
+            lines = rand.sample(item_ids, 5)
+            restock(lines)
+            return 'post', '/cashier/pos_orders/', {'items': [{'item': item_id, 'quantity': 1} for item_id in lines]}
+
+        def pos_sync():
+            receipts = [{'key': f"{time.time_ns()}-{i}",
+                         'items': [{'item': item_id, 'quantity': 1} for item_id in rand.sample(item_ids, 3)]}
+                        for i in range(20)]
+            restock([line['item'] for receipt in receipts for line in receipt['items']])
+            return 'post', '/cashier/pos_orders/sync/', receipts
+
+        def booking_accept():
+            booking = TechnicianBooking.objects.create(customer=customer, technician=technician, title='Need a mason',
+                                                       job_description='wall')
+            return 'put', f"/technician/booking_accept/{booking.id}", {
+                'estimated_time': 4, 'working_date': (timezone.now() + timedelta(days=2)).date().isoformat(),
+                'requested_rate': '2500.00'}
+
+        def paid_order():
+            return Order.objects.create(customer=customer, total=100, delivery_fee=10)
+
+        def delivery_claim():
+            DeliveryGuy.objects.filter(id=delivery_guy.id).update(current_delivery=None)
+            paid_order()
+            return 'post', '/delivery_guy/claim/', None
+
+        def delivery_delivered():
+            DeliveryGuy.objects.filter(id=delivery_guy.id).update(current_delivery=None)
+            order = paid_order()
+            dispatch.take_order(delivery_guy.id, order.id)
+            return 'put', f"/delivery_guy/delivered/order/{order.id}", None
+
+        return [
+            Endpoint('login', 'anonymous', lambda: ('post', '/login/', self.login)),
+            Endpoint('account', 'customer', lambda: ('get', '/account/', None)),
+            Endpoint('catalog', 'anonymous', lambda: ('get', '/items/', None)),
+            Endpoint('catalog page size 100', 'anonymous', lambda: ('get', '/items/', {'page_size': 100})),
+            Endpoint('item', 'anonymous', lambda: ('get', f"/items/{rand.choice(item_ids)}", None)),
+            Endpoint('search', 'anonymous', lambda: ('get', f"/items/search/{rand.choice(words)}", None)),
+            Endpoint('suggest', 'anonymous', lambda: ('get', f"/items/suggest/{rand.choice(words)[:3]}", None)),
+            Endpoint('item feedbacks', 'customer',
+                     lambda: ('get', f"/item/{rand.choice(item_ids)}/feedbacks/", None)),
+            Endpoint('cart', 'customer', lambda: ('get', '/cart/', None)),
+            Endpoint('cart add', 'customer', cart_add),
+            Endpoint('cart remove', 'customer', cart_remove),
+            Endpoint('cart patch 10 lines', 'customer', cart_patch),
+            Endpoint('payment', 'customer', payment),
+            Endpoint('purchased orders', 'customer', lambda: ('get', '/account/purchased/', None)),
+            Endpoint('technicians', 'customer', lambda: ('get', '/technicians/', None)),
+            Endpoint('pos billing', 'cashier', pos_billing),
+            Endpoint('pos sync 20 receipts', 'cashier', pos_sync),
+            Endpoint('booking create', 'customer', lambda: ('post', '/booking/', {
+                'technician': technician.id, 'title': 'Need a mason', 'job_description': 'garden wall'})),
+            Endpoint('bookings', 'customer', lambda: ('get', '/booking/', None)),
+            Endpoint('technician bookings', 'technician', lambda: ('get', '/technician/booking/', None)),
+            Endpoint('booking accept', 'technician', booking_accept),
+            Endpoint('delivery orders', 'delivery_guy', lambda: ('get', '/delivery_guy/deliveries/', None)),
+            Endpoint('delivery claim', 'delivery_guy', delivery_claim),
+            Endpoint('delivery delivered', 'delivery_guy', delivery_delivered),
+            Endpoint('admin orders', 'admin', lambda: ('get', '/admin_area/orders/', None)),
+            Endpoint('admin out of stock', 'admin', lambda: ('get', '/admin_area/outofstock/', None)),
+        ]
@@ -0,0 +1,66 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from marketplace import search
+from marketplace.models import Item
+
+words = ['copper', 'wire', 'cable', 'hammer', 'steel', 'pipe', 'valve', 'cement', 'brick', 'tile', 'paint', 'brush',
+         'drill', 'screw', 'bolt', 'nut', 'washer', 'hinge', 'lock', 'switch', 'socket', 'bulb', 'tape', 'glue',
+         'sand', 'gravel', 'plank', 'plywood', 'nail', 'saw', 'chisel', 'spanner', 'wrench', 'ladder', 'bucket']
+syllables = ['ka', 'lo', 'mi', 'ran', 'te', 'vo', 'sil', 'du', 'pre', 'xo', 'na', 'bel', 'cor', 'fi', 'gu', 'ha']
+
+
+class Command(BaseCommand):
+    help = 'Compare LIKE (icontains) searches with FTS5 index searches on a throwaway database of generated items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, options):
+        rand = random.Random(options['seed'])
+        # brand/model like vocabulary with a zipf-like popularity so that some terms are common and most are rare
+        vocabulary = words + list({''.join(rand.choices(syllables, k=4)) for _ in range(5000)})
+        weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+        batch = []
+        for i in range(options['items']):
+            batch.append(Item(name=' '.join(rand.choices(vocabulary, weights, k=3)),
+                              description=' '.join(rand.choices(vocabulary, weights, k=12)),
+                              price=Decimal(rand.randint(100, 100000)) / 100, quantity=rand.randint(0, 50)))
+            if len(batch) == 5000:
+                Item.objects.bulk_create(batch)
+                batch = []
+        Item.objects.bulk_create(batch)
+        search.rebuild_index()
+        self.stdout.write(f"{options['items']} items generated")
+
+        size = options['page_size']
+        for value in ['cop', 'hammer steel', 'plyw', vocabulary[500], vocabulary[2000][:5], 'zzz']:
+            like = self.measure(lambda: list(search.matching_items(value).order_by('id')[:size]), options['repeat'])
+            fts = self.measure(lambda: list(search.ranked_items(value).order_by('rank', 'id')[:size]),
+                               options['repeat'])
+            self.stdout.write(f"{value!r:16} icontains median {like:8.2f} ms | fts5 median {fts:8.2f} ms")
+
+    @staticmethod
+    def measure(query, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            query()
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
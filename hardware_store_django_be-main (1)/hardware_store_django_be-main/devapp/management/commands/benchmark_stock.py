@@ -0,0 +1,83 @@
+import logging
+import statistics
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection, connections
+
+from marketplace import inventory, pos
+from marketplace.models import Item, PosOrder, Cashier
+
+
+class Command(BaseCommand):
+    help = 'Compare checkout throughput on a single item with its stock in the item row and split over shard rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sales', type=int, default=2000, help='checkouts per run')
+        parser.add_argument('--concurrency', default='1,2,4,8,16', help='comma separated thread counts')
+        parser.add_argument('--shards', type=int, default=16)
+
+    def handle(self, *args, **options):
+        logging.getLogger('helpers.instrumentation').setLevel(logging.WARNING)
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.run(options)
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, options):
+        cashier = Cashier.objects.create_user('cashier', 'cashier@shop.aa', None)
+        self.stdout.write(f"{connection.vendor}, {options['sales']} checkouts of one item per run")
+        for concurrency in map(int, options['concurrency'].split(',')):
+            for shards in [0, options['shards']]:
+                item = Item.objects.create(name='promotion', description='hot item', price=Decimal('10.00'),
+                                           quantity=options['sales'])
+                if shards:
+                    inventory.set_stock_shards(item.id, shards)
+                connection.close()
+                elapsed, latencies, errors = self.checkouts(item.id, cashier.id, options['sales'], concurrency)
+                item.refresh_from_db()
+                left = inventory.on_hand(item, cached=False)
+                latencies.sort()
+                mode = f"{shards} shards" if shards else 'item row'
+                self.stdout.write(f"{concurrency:3} threads {mode:10} {len(latencies) / elapsed:8.0f} checkouts/s | "
+                                  f"p50 {statistics.median(latencies):7.1f} ms | "
+                                  f"p99 {latencies[int(len(latencies) * 0.99) - 1]:7.1f} ms | errors {errors} | "
+                                  f"stock left {left}, sold {PosOrder.objects.filter(items__item=item).count()}")
+
+    @staticmethod
+    def checkouts(item_id, cashier_id, count, concurrency):
+        pending = iter(range(count))
+        lock = threading.Lock()
+        latencies, errors = [], []
+        lines = Counter({item_id: 1})
+
+        def worker():
+            try:
+                while True:
+                    with lock:
+                        if next(pending, None) is None:
+                            return
+                    start = time.perf_counter()
+                    try:
+                        pos.place_pos_order(lines, lambda total: PosOrder.objects.create(cashier_id=cashier_id,
+                                                                                         total=total))
+                    except (DatabaseError, inventory.OutOfStock) as error:
+                        errors.append(error)
+                        continue
+                    latencies.append((time.perf_counter() - start) * 1000)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start, latencies, len(errors)
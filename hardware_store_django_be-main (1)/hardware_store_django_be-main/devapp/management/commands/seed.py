@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from devapp import dataset
+
+
+class Command(BaseCommand):
+    help = 'Generate a seeded marketplace dataset of any size with bulk inserts, e.g. for profiling the endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=10000)
+        parser.add_argument('--customers', type=int, default=2000)
+        parser.add_argument('--technicians', type=int, default=200)
+        parser.add_argument('--delivery-guys', type=int, default=100)
+        parser.add_argument('--cashiers', type=int, default=10)
+        parser.add_argument('--orders', type=int, default=20000)
+        parser.add_argument('--pos-orders', type=int, default=5000)
+        parser.add_argument('--bookings', type=int, default=1000)
+        parser.add_argument('--feedback', type=int, default=5000)
+        parser.add_argument('--cart-share', type=float, default=0.3, help='share of the customers with a cart')
+        parser.add_argument('--days', type=int, default=365, help='days of order history')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--chunk-size', type=int, default=5000, help='rows per bulk insert and transaction')
+        parser.add_argument('--password', default='pass', help='password of every generated user')
+        parser.add_argument('--truncate', action='store_true',
+                            help='remove the generated tables and every user but the staff first')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive',
+                            help='do not ask before truncating')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['cart_share'] <= 1:
+            raise CommandError('--cart-share must be between 0 and 1')
+        if options['truncate']:
+            if options['interactive'] and input('This deletes the items, orders and every user but the staff. '
+                                                'Type "yes" to continue: ') != 'yes':
+                raise CommandError('Cancelled')
+            dataset.truncate()
+            self.stdout.write('Truncated')
+
+        generator = dataset.Generator(seed=options['seed'], chunk_size=options['chunk_size'],
+                                      password=options['password'], log=self.stdout.write)
+        generator.run(items=options['items'], customers=options['customers'], technicians=options['technicians'],
+                      delivery_guys=options['delivery_guys'], cashiers=options['cashiers'], orders=options['orders'],
+                      pos_orders=options['pos_orders'], bookings=options['bookings'], feedback=options['feedback'],
+                      cart_share=options['cart_share'], days=options['days'])
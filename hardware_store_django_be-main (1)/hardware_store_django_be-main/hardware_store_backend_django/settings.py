@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'helpers.instrumentation.InstrumentationMiddleware',
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -89,9 +90,33 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # a file backed test database lets concurrency tests use one connection per thread
+        "TEST": {
+            "NAME": BASE_DIR / "test_db.sqlite3",
+        },
     }
 }
 
+# Cache shared by the worker processes, holds the catalog version among others. Use a shared backend (e.g. redis)
+# when running more than one process so that catalog changes are seen by every process.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # token -> user claims of authentication.backends.CachedTokenAuthentication
+    "tokens": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "tokens",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+    # rendered carts of marketplace.cart_cache
+    "carts": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "carts",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -134,10 +159,97 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Uploads under helpers.vars.images_dir are stored once per content (helpers.storage)
+STORAGES = {
+    "default": {
+        "BACKEND": "helpers.storage.ContentAddressedStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
+
+# Resized copies of uploaded images (marketplace.images), created off the request thread after upload
+IMAGE_DERIVATIVE_WIDTHS = (150, 300, 600)
+IMAGE_DERIVATIVE_FORMATS = ('webp', 'jpeg')
+IMAGE_DERIVATIVES_ASYNC = True
+IMAGE_DERIVATIVE_WORKERS = 2
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'authentication.backends.CachedTokenAuthentication',
     ]
 }
 
+# Cache alias and lifetime (seconds) of the cached token claims, changes of users drop them right away
+AUTH_TOKEN_CACHE = "tokens"
+AUTH_TOKEN_CACHE_TTL = 300
+# Tokens are rejected this many seconds after login, None keeps them until logout
+AUTH_TOKEN_EXPIRY = None
+
 AUTH_USER_MODEL = "marketplace.RbacUser"
+
+# Catalog listings are keyset paginated over Item.id, clients may ask for up to CATALOG_MAX_PAGE_SIZE rows
+CATALOG_PAGE_SIZE = 50
+CATALOG_MAX_PAGE_SIZE = 500
+
+# Memory bound of the rendered catalog pages kept by each process (marketplace.catalog_cache)
+CATALOG_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Type-ahead suggestions are answered from a per-process index of item names which is reloaded after
+# SUGGEST_INDEX_TTL seconds to pick up changes made by other processes
+SUGGEST_INDEX_TTL = 300
+SUGGEST_MAX_SCAN = 5000
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+
+# Offline POS receipts are synced in transactions of this many receipts
+POS_SYNC_BATCH_SIZE = 200
+
+# Stock added to a cart is held for it this many seconds after the cart's last change, expired holds are released
+# by the scheduler every minute
+STOCK_HOLD_TTL = 15 * 60
+
+# Stock of a sharded item (Item.stock_shards, manage.py shard_stock) read by a process is the sum of its shards from
+# at most this many seconds ago
+STOCK_SHARD_CACHE_TTL = 2
+
+# Cache alias and lifetime (seconds) of the rendered carts served by GET cart, changes of a cart or of the price or
+# stock of its items drop it right away. Carts with sharded items are kept for STOCK_SHARD_CACHE_TTL
+CART_CACHE = "carts"
+CART_CACHE_TTL = 300
+
+# A delivery guy claiming the next order gives up after this many orders taken by others meanwhile
+DISPATCH_CLAIM_ATTEMPTS = 10
+
+# Server-sent events (events/): seconds between heartbeats of an idle stream, reconnect delay asked from clients
+# and the events queued for a slow client before it is told to reload
+EVENTS_HEARTBEAT = 15
+EVENTS_RETRY_MS = 3000
+EVENTS_MAX_QUEUED = 100
+
+# Job scheduler (manage.py scheduler): lease lifetime in seconds and the batches of the expiry deletes
+SCHEDULER_LEASE_TTL = 60
+JOB_DELETE_CHUNK_SIZE = 500
+JOB_DELETE_MAX_CHUNKS = 20
+
+# Request instrumentation (helpers.instrumentation): Server-Timing header on responses, queries slower than
+# SLOW_QUERY_MS milliseconds kept for admin_area/slow_queries/ (latest SLOW_QUERY_LOG_SIZE per process)
+REQUEST_TIMING_HEADER = True
+SLOW_QUERY_MS = 100
+SLOW_QUERY_LOG_SIZE = 200
+
+# one JSON line per request at INFO, the test runner quiets them
+REQUEST_LOG_LEVEL = os.environ.get('REQUEST_LOG_LEVEL', 'INFO')
+TEST_RUNNER = 'helpers.testing.TestRunner'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'helpers.instrumentation': {'handlers': ['console'], 'level': REQUEST_LOG_LEVEL, 'propagate': False},
+    },
+}
@@ -4,16 +4,34 @@ import decimal
 from datetime import timedelta
 
 import pytz
+from django.conf import settings
 from django.utils import timezone
 
 from marketplace.models import TechnicianBooking
 
 
-def clean_older_technician_bookings():
-    expired_bookings = TechnicianBooking.objects.filter(created_time__lt=timezone.now()-timedelta(days=1))
-    for exp_booking in expired_bookings:
-        exp_booking.delete()
-        print(f"Expired booking request: {exp_booking} removed.")
+def delete_in_chunks(queryset, order_by, chunk_size=None, max_chunks=None) -> int:
+    """
+    Deletes the rows of the queryset with one DELETE per chunk of `chunk_size` primary keys, taken in `order_by`
+    order (an indexed column keeps each chunk an index range scan). Stops after `max_chunks` chunks so a large
+    backlog does not hold the database for long, the rest goes with the next run. Returns the deleted rows.
+    """
+    chunk_size = chunk_size or settings.JOB_DELETE_CHUNK_SIZE
+    max_chunks = max_chunks or settings.JOB_DELETE_MAX_CHUNKS
+    deleted = 0
+    for _ in range(max_chunks):
+        ids = list(queryset.order_by(order_by).values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            break
+        deleted += queryset.model.objects.filter(pk__in=ids).delete()[1].get(queryset.model._meta.label, 0)
+        if len(ids) < chunk_size:
+            break
+    return deleted
+
+
+def clean_older_technician_bookings() -> int:
+    expired_bookings = TechnicianBooking.objects.filter(created_time__lt=timezone.now() - timedelta(days=1))
+    return delete_in_chunks(expired_bookings, 'created_time')
 
 
 def process_payment(amount: decimal) -> bool:
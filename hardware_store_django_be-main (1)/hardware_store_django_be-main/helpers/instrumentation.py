@@ -0,0 +1,182 @@
+import json
+import logging
+import re
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# metrics of the request being handled, also seen by the threads running the ORM for async views
+_metrics = ContextVar('request_metrics', default=None)
+
+_literal_re = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%s|\?")
+_in_list_re = re.compile(r"\(\?(?:, \?)*\)")
+_space_re = re.compile(r"\s+")
+
+
+def normalize_sql(sql: str) -> str:
+    """The statement with literals and parameters replaced by `?` and IN lists collapsed, to group equal queries"""
+    sql = _literal_re.sub('?', _space_re.sub(' ', sql).strip())
+    return _in_list_re.sub('(...)', sql)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.view = None
+        self.queries = 0
+        self.sql_time = 0.0
+        self.view_start = None
+        self.view_time = None
+        self.render_start = None
+        self.serialize_time = 0.0
+
+
+class SlowQueryLog:
+    """Thread safe ring buffer of the latest slow queries of this process"""
+
+    def __init__(self, size: int):
+        self._lock = threading.Lock()
+        self._entries = deque(maxlen=size)
+
+    def add(self, entry: dict):
+        with self._lock:
+            self._entries.append(entry)
+
+    def entries(self) -> list:
+        """Newest first"""
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+slow_queries = SlowQueryLog(settings.SLOW_QUERY_LOG_SIZE)
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = _metrics.get()
+    if metrics is None:
+        # not in a request, e.g. the scheduler
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - start
+        metrics.queries += 1
+        metrics.sql_time += duration
+        if duration * 1000 >= settings.SLOW_QUERY_MS:
+            slow_queries.add({'sql': normalize_sql(sql), 'ms': round(duration * 1000, 2), 'view': metrics.view,
+                              'database': context['connection'].alias, 'many': many,
+                              'time': timezone.now().isoformat()})
+
+
+def install_query_recorder(connection, **kwargs):
+    # connection_created is sent again on reconnects of the same connection object
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+_installed = False
+
+
+def install():
+    """Records the queries of every connection opened from now on"""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    connection_created.connect(install_query_recorder)
+    for connection in connections.all(initialized_only=True):
+        install_query_recorder(connection)
+
+
+class InstrumentationMiddleware:
+    """
+    Measures each request: resolved view, query count and SQL time (execute wrapper of every connection), time in
+    the view (which includes DRF serializers and their queries), time rendering DRF responses to JSON and wall
+    time. They are sent in a Server-Timing header, when REQUEST_TIMING_HEADER is set, and logged as one JSON line.
+    Queries slower than SLOW_QUERY_MS are kept in `slow_queries`. Goes first in MIDDLEWARE so the wall time covers
+    the others, and its process_template_response runs last, right before the response is rendered.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        install()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics, start = RequestMetrics(), time.perf_counter()
+        token = _metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _metrics.reset(token)
+        return self.finish(request, response, metrics, start)
+
+    async def __acall__(self, request):
+        metrics, start = RequestMetrics(), time.perf_counter()
+        token = _metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _metrics.reset(token)
+        return self.finish(request, response, metrics, start)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = _metrics.get()
+        if metrics is not None:
+            # api_view functions are wrapped in a view class named after them
+            view = getattr(view_func, 'view_class', view_func)
+            metrics.view = f"{view.__module__}.{view.__name__}"
+            metrics.view_start = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        metrics = _metrics.get()
+        if metrics is not None and metrics.view_start is not None:
+            # DRF responses are rendered after the view and the template response middleware
+            metrics.render_start = time.perf_counter()
+            metrics.view_time = metrics.render_start - metrics.view_start
+            response.add_post_render_callback(lambda _: self.rendered(metrics))
+        return response
+
+    @staticmethod
+    def rendered(metrics):
+        metrics.serialize_time = time.perf_counter() - metrics.render_start
+
+    @staticmethod
+    def finish(request, response, metrics, start):
+        end = time.perf_counter()
+        total = end - start
+        view_time = metrics.view_time
+        if view_time is None:
+            # responses without rendering, e.g. JsonResponse or 304, the view ran until the middleware got them
+            view_time = end - metrics.view_start if metrics.view_start is not None else 0.0
+        if settings.REQUEST_TIMING_HEADER:
+            response['Server-Timing'] = f'db;dur={metrics.sql_time * 1000:.1f};desc="{metrics.queries} queries", ' \
+                                        f'view;dur={view_time * 1000:.1f}, ' \
+                                        f'serialize;dur={metrics.serialize_time * 1000:.1f}, ' \
+                                        f'total;dur={total * 1000:.1f}'
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({
+                'method': request.method, 'path': request.path, 'view': metrics.view,
+                'status': response.status_code, 'queries': metrics.queries,
+                'sql_ms': round(metrics.sql_time * 1000, 2), 'view_ms': round(view_time * 1000, 2),
+                'serialize_ms': round(metrics.serialize_time * 1000, 2), 'total_ms': round(total * 1000, 2),
+            }))
+        return response
@@ -0,0 +1,82 @@
+import os
+import random
+import socket
+import time
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+
+class Job:
+    """A periodic job, `func()` returns the number of rows it handled"""
+
+    def __init__(self, name, func, interval: float, jitter: float = 0):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.next_run = 0.0
+
+    def schedule_next(self, now: float):
+        # jitter spreads jobs with equal intervals (and several deployments) over time
+        self.next_run = now + self.interval + random.uniform(0, self.jitter)
+
+    def run(self) -> dict:
+        started = time.monotonic()
+        rows = self.func()
+        return {'job': self.name, 'rows': rows or 0, 'duration': time.monotonic() - started}
+
+
+# jobs registered by the `jobs` modules of the installed apps, by name
+jobs = {}
+
+
+def register(interval: float, jitter: float = 0, name=None):
+    """
+    Registers the decorated function as a job run every `interval` seconds (plus up to `jitter` seconds), e.g.
+    `@register(interval=600, jitter=60)` in a `jobs.py` module of an app
+    """
+
+    def decorator(func):
+        job_name = name or func.__name__
+        jobs[job_name] = Job(job_name, func, interval, jitter)
+        return func
+
+    return decorator
+
+
+class Lease:
+    """
+    Database lease (marketplace.models.JobLease) making sure only one scheduler runs the jobs. The owner renews it
+    before it expires, another scheduler takes it over once it is not renewed for `ttl` seconds.
+    """
+
+    def __init__(self, name: str, ttl: float):
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    def acquire(self) -> bool:
+        """Takes or renews the lease, returns whether this process holds it"""
+        from marketplace.models import JobLease
+
+        now = timezone.now()
+        expires = now + timedelta(seconds=self.ttl)
+        # compare and set, free or expired leases and our own one
+        if JobLease.objects.filter(Q(owner=self.owner) | Q(expires__lt=now), name=self.name) \
+                .update(owner=self.owner, expires=expires):
+            return True
+        try:
+            with transaction.atomic():
+                JobLease.objects.create(name=self.name, owner=self.owner, expires=expires)
+            return True
+        except IntegrityError:
+            # held by another scheduler
+            return False
+
+    def release(self):
+        from marketplace.models import JobLease
+
+        JobLease.objects.filter(name=self.name, owner=self.owner).delete()
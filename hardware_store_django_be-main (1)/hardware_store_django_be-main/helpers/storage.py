@@ -0,0 +1,118 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from helpers.vars import images_dir
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores uploads under images_dir once per content, at images/<2 hex>/<2 hex>/<sha256>.<ext>. The file is hashed
+    while it is streamed to disk in chunks, so large uploads are never read into memory. Saving a picture that is
+    already stored reuses the existing file and adds a reference (marketplace.models.StoredFile), `delete` removes
+    a reference and only removes the file with the last one. Names outside images_dir are stored as usual.
+    """
+
+    content_path = re.compile(rf"^{images_dir}/([0-9a-f]{{2}})/([0-9a-f]{{2}})/\1\2[0-9a-f]{{60}}(\.\w+)?$")
+
+    @staticmethod
+    def is_upload(name) -> bool:
+        return name.replace('\\', '/').startswith(f"{images_dir}/")
+
+    @classmethod
+    def is_content_addressed(cls, name) -> bool:
+        return bool(cls.content_path.match(name.replace('\\', '/')))
+
+    def get_available_name(self, name, max_length=None):
+        if self.is_upload(name):
+            # the name is derived from the content in _save, equal names mean equal files
+            return name
+        return super().get_available_name(name, max_length)
+
+    def _save(self, name, content):
+        if not self.is_upload(name):
+            return super()._save(name, content)
+
+        incoming = self.path(images_dir)
+        os.makedirs(incoming, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        temporary = tempfile.NamedTemporaryFile(dir=incoming, prefix='.incoming-', delete=False)
+        try:
+            with temporary:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest.update(chunk)
+                    temporary.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            # closed by the with block first, Windows can't remove an open file
+            os.remove(temporary.name)
+            raise
+
+        hexdigest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        stored_name = f"{images_dir}/{hexdigest[:2]}/{hexdigest[2:4]}/{hexdigest}{extension}"
+        path = self.path(stored_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # in place before it is referenced, a concurrent delete of the last reference can't leave the new one without
+        # a file. Equal names mean equal content, replacing a stored file changes nothing for its readers
+        try:
+            os.replace(temporary.name, path)
+        except PermissionError:
+            # Windows can't replace a file that is open
+            if not os.path.exists(path):
+                raise
+            os.remove(temporary.name)
+        if self.file_permissions_mode is not None:
+            os.chmod(path, self.file_permissions_mode)
+        self.retain(stored_name, size=size)
+        return stored_name
+
+    def retain(self, name, count=1, size=None):
+        """Adds references to a content addressed file, e.g. when another field is pointed to an existing name"""
+        from marketplace.models import StoredFile
+
+        if not count or not self.is_content_addressed(name):
+            return
+        if StoredFile.objects.filter(name=name).update(references=F('references') + count):
+            return
+        if size is None:
+            if not self.exists(name):
+                return
+            size = self.size(name)
+        try:
+            with transaction.atomic():
+                StoredFile.objects.create(name=name, size=size, references=count)
+        except IntegrityError:
+            # created by a concurrent upload of the same content
+            StoredFile.objects.filter(name=name).update(references=F('references') + count)
+
+    def delete(self, name):
+        """
+        Releases one reference of a content addressed file and deletes it with the last one, once the transaction
+        releasing it commits and only if no upload referenced it again meanwhile. Other names under images_dir
+        (uploads from before this storage) may be shared by several rows and are kept.
+        """
+        from marketplace.models import StoredFile
+
+        if not self.is_content_addressed(name):
+            if not self.is_upload(name):
+                super().delete(name)
+            return
+        StoredFile.objects.filter(name=name, references__gt=0).update(references=F('references') - 1)
+        deleted, _ = StoredFile.objects.filter(name=name, references=0).delete()
+        if deleted:
+            transaction.on_commit(lambda: self._delete_unreferenced(name))
+
+    def _delete_unreferenced(self, name):
+        from marketplace.models import StoredFile
+
+        if not StoredFile.objects.filter(name=name, references__gt=0).exists():
+            super().delete(name)
@@ -0,0 +1,11 @@
+import logging
+
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """Runs the tests without the request log lines of helpers.instrumentation, one for every test client request"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        logging.getLogger('helpers.instrumentation').setLevel(logging.WARNING)
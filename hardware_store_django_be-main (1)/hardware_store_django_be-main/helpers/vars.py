@@ -1 +1,2 @@
 images_dir = "images"
+derivatives_dir = "derivatives"
@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 from .models import Item, Cart, CartItem, Customer, Technician, DeliveryGuy, Cashier, Order, \
-    OrderItem, RbacUser, Address, TechnicianBooking
+    OrderItem, RbacUser, Address, TechnicianBooking, StockHold, StockMovement, StockShard
 
 # Register your models here.
 admin.site.register(Item)
@@ -16,3 +16,6 @@ admin.site.register(Order)
 admin.site.register(OrderItem)
 admin.site.register(Address)
 admin.site.register(TechnicianBooking)
+admin.site.register(StockHold)
+admin.site.register(StockMovement)
+admin.site.register(StockShard)
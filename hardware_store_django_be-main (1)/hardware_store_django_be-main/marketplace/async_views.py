@@ -0,0 +1,168 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework import exceptions, status
+
+from authentication.backends import CachedTokenAuthentication
+from authentication.serializers import TechnicianSerializer
+from . import cart_cache, catalog_cache, events, querysets, search as item_search
+from .models import Item, Cart, Technician, UserRoles
+from .pagination import apaginate
+from .serializers import ItemSerializer, CartSerializer, OrderSerializer, adata
+
+# Async variants of the read heavy GET endpoints, served under async/ by the ASGI application. They read with the
+# async ORM and serialize rows loaded with everything the serializers read, so no query runs lazily.
+
+
+async def authenticate(request, allow_query_token=False):
+    """
+    User of the `Authorization: Token <key>` header. EventSource clients can't send headers, their stream allows the
+    `token` query parameter instead (tokens in URLs end up in access logs, no other endpoint takes them).
+    """
+    header = request.headers.get('Authorization', '').split()
+    key = header[1] if len(header) == 2 and header[0] == 'Token' else None
+    if key is None and allow_query_token:
+        key = request.GET.get('token')
+    if not key:
+        return None
+    try:
+        user, _ = await sync_to_async(CachedTokenAuthentication().authenticate_credentials)(key)
+        return user
+    except exceptions.AuthenticationFailed:
+        return None
+
+
+def unauthorized():
+    return JsonResponse({'detail': 'Authentication credentials were not provided.'},
+                        status=status.HTTP_401_UNAUTHORIZED)
+
+
+async def authenticate_customer(request):
+    """(user, None) for customers, else (None, the 401/403 response) like the IsCustomer permission"""
+    user = await authenticate(request)
+    if user is None:
+        return None, unauthorized()
+    if user.role != UserRoles.CUSTOMER:
+        return None, JsonResponse({'detail': 'You do not have permission to perform this action.'},
+                                  status=status.HTTP_403_FORBIDDEN)
+    return user, None
+
+
+@require_GET
+async def items_view(request, key=None):
+    if key is None:
+        return await catalog_cache.acached_response(
+            request, lambda: apaginate(request, Item.objects.all(), ItemSerializer))
+    try:
+        item = await Item.objects.aget(id=key)
+    except Item.DoesNotExist as err:
+        return JsonResponse({'error': str(err)}, status=status.HTTP_404_NOT_FOUND)
+    return JsonResponse(await adata(ItemSerializer(item), [item]))
+
+
+@require_GET
+async def search(request, value=""):
+    if value == '*' or not value.strip():
+        return await catalog_cache.acached_response(
+            request, lambda: apaginate(request, Item.objects.all(), ItemSerializer))
+
+    # the first call per database introspects the tables
+    if await sync_to_async(item_search.index_available)():
+        return await apaginate(request, item_search.ranked_items(value), ItemSerializer, ordering=('rank', 'id'))
+    return await apaginate(request, item_search.matching_items(value), ItemSerializer)
+
+
+@require_GET
+async def technicians_view(request, key=None):
+    user, error = await authenticate_customer(request)
+    if error:
+        return error
+    try:
+        if not key:
+            technicians = [technician async for technician in Technician.objects.filter(is_approved=True)]
+            return JsonResponse(TechnicianSerializer(technicians, many=True).data, safe=False)
+        technician = await Technician.objects.aget(id=key)
+        return JsonResponse(TechnicianSerializer(technician).data)
+
+    except Exception as err:
+        return JsonResponse({'errors': str(err)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@require_GET
+async def my_cart(request):
+    user, error = await authenticate_customer(request)
+    if error:
+        return error
+
+    async def build_cart():
+        try:
+            cart = await Cart.objects.prefetch_related('items__item').aget(customer_id=user.id)
+        except Cart.DoesNotExist:
+            # create cart if not exist
+            cart = await Cart.objects.acreate(customer_id=user.id)
+            cart = await Cart.objects.prefetch_related('items__item').aget(id=cart.id)
+        return await adata(CartSerializer(instance=cart), [line.item for line in cart.items.all()])
+
+    return await cart_cache.acached_response(user.id, build_cart)
+
+
+@require_GET
+async def orders_view(request):
+    user = await authenticate(request)
+    if user is None:
+        return unauthorized()
+    try:
+        orders = [order async for order in querysets.order_list().filter(customer_id=user.id)]
+        return JsonResponse(OrderSerializer(orders, many=True).data, safe=False)
+    except Exception as error:
+        return JsonResponse({'errors': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+def server_sent_event(event_type, data, event_id=None) -> str:
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event_type}", f"data: {json.dumps(data)}"]
+    return '\n'.join(lines) + '\n\n'
+
+
+async def stream(subscription):
+    try:
+        yield f"retry: {settings.EVENTS_RETRY_MS}\n\n"
+        while True:
+            event = await subscription.get(settings.EVENTS_HEARTBEAT)
+            if subscription.overflowed:
+                subscription.overflowed = False
+                yield server_sent_event('reload', {})
+            if event is None:
+                # keeps proxies from closing an idle connection
+                yield ': heartbeat\n\n'
+            else:
+                yield server_sent_event(event['type'], event['data'], event['id'])
+    finally:
+        subscription.close()
+
+
+@require_GET
+async def events_view(request):
+    """
+    Server-sent events of the orders and bookings of the user: `order` {id, status} for the customer, the delivery
+    guy delivering it and every delivery guy when an order (stops) waiting for one, `booking` {id, status} for the
+    customer and the technician. After `reload` (missed events) or a reconnect clients fetch their lists again.
+    Served by the ASGI application only, each open stream would hold a WSGI worker.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'errors': 'Events are served by the ASGI application'},
+                            status=status.HTTP_501_NOT_IMPLEMENTED)
+    user = await authenticate(request, allow_query_token=True)
+    if user is None:
+        return unauthorized()
+
+    subscription = events.broker.subscribe(events.channels_of(user))
+    response = StreamingHttpResponse(stream(subscription), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # nginx would buffer the stream otherwise
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,89 @@
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+
+from .models import CartItem
+
+
+def cart_cache():
+    return caches[settings.CART_CACHE]
+
+
+def entry_key(customer_id) -> str:
+    return f"marketplace:cart:{customer_id}"
+
+
+def version_key(customer_id) -> str:
+    return f"marketplace:cart_version:{customer_id}"
+
+
+def _replace_versions(customer_ids):
+    # a new version never equals the one an entry was rendered at, an evicted version is replaced the same way
+    cart_cache().set_many({version_key(customer_id): time.time_ns() for customer_id in customer_ids}, timeout=None)
+
+
+def invalidate_customers(customer_ids):
+    """
+    Drops the cached carts of the customers, right away so this connection's own reads see the change, and again
+    after commit so carts rendered meanwhile from pre-commit data by other connections are dropped too
+    """
+    customer_ids = list(customer_ids)
+    if customer_ids:
+        _replace_versions(customer_ids)
+        transaction.on_commit(lambda: _replace_versions(customer_ids))
+
+
+def invalidate_items(item_ids):
+    """Drops the cached carts containing the items, found by the cart lines of the items (the item -> carts index)"""
+    item_ids = list(item_ids)
+    if item_ids:
+        invalidate_customers(CartItem.objects.filter(item_id__in=item_ids)
+                             .values_list('cart__customer_id', flat=True).distinct())
+
+
+def _lookup(customer_id):
+    """(version, entry) of the customer's cart, entry is (rendered cart, subtotal) or None"""
+    found = cart_cache().get_many([entry_key(customer_id), version_key(customer_id)])
+    version = found.get(version_key(customer_id))
+    if version is None:
+        cart_cache().add(version_key(customer_id), time.time_ns(), timeout=None)
+        version = cart_cache().get(version_key(customer_id))
+    entry = found.get(entry_key(customer_id))
+    return version, entry[1:] if entry is not None and entry[0] == version else None
+
+
+def _store(customer_id, version, data) -> bytes:
+    body = JSONRenderer().render(data)
+    # the stock of sharded items is only as fresh as STOCK_SHARD_CACHE_TTL, their sales don't drop carts
+    sharded = any(line['item']['stock_shards'] for line in data['items'])
+    cart_cache().set(entry_key(customer_id), (version, body, Decimal(data['subtotal'])),
+                     settings.STOCK_SHARD_CACHE_TTL if sharded else settings.CART_CACHE_TTL)
+    return body
+
+
+def cached_response(customer_id, build_data):
+    """
+    Serves the customer's cart from the cache without touching the database, or serializes it with `build_data()`
+    (CartSerializer data) and keeps it rendered along with its subtotal
+    """
+    version, entry = _lookup(customer_id)
+    body = entry[0] if entry else _store(customer_id, version, build_data())
+    return HttpResponse(body, content_type='application/json')
+
+
+async def acached_response(customer_id, build_data):
+    """cached_response of the async views, `build_data()` is awaited"""
+    version, entry = _lookup(customer_id)
+    body = entry[0] if entry else _store(customer_id, version, await build_data())
+    return HttpResponse(body, content_type='application/json')
+
+
+def subtotal(customer_id):
+    """Subtotal of the customer's cart as last rendered, None when it isn't cached"""
+    _, entry = _lookup(customer_id)
+    return entry[1] if entry else None
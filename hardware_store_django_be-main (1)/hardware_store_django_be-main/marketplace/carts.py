@@ -0,0 +1,65 @@
+from django.db import transaction
+
+from . import cart_cache, inventory, reservations
+from .models import Item, CartItem
+
+
+class InvalidCartChange(Exception):
+    """Raised when the changes of a cart patch can't be applied"""
+
+
+def cart_changes(items) -> dict:
+    """
+    Validates the `items` of a cart patch, [{'item': <id>, 'quantity': <n>}, ...], and returns the quantity to set
+    per item id (0 removes the line). A later change of the same item replaces the earlier one.
+    """
+    if not isinstance(items, list) or not items:
+        raise InvalidCartChange('items should be a non empty list')
+    changes = {}
+    for change in items:
+        try:
+            item_id, quantity = int(change['item']), int(change['quantity'])
+        except (KeyError, TypeError, ValueError):
+            raise InvalidCartChange(f"Invalid change: {change}")
+        if quantity < 0:
+            raise InvalidCartChange(f"Item: {item_id} quantity should not be negative")
+        changes[item_id] = quantity
+    return changes
+
+
+def apply_changes(cart, changes: dict):
+    """
+    Sets the quantities of the cart lines in a fixed number of queries, whatever the number of changes: one in_bulk
+    fetch of the items, one of the lines, a bulk DELETE, UPDATE and INSERT of the lines and the holds of the
+    changed quantities (reservations.hold_lines), all in one transaction. Raises OutOfStock, changing nothing, when
+    an item can't cover its new quantity.
+    """
+    items = Item.objects.in_bulk(changes)
+    missing = [item_id for item_id in changes if item_id not in items]
+    if missing:
+        raise InvalidCartChange(f"Item: {', '.join(map(str, missing))} does not exist")
+    lines = {line.item_id: line for line in CartItem.objects.filter(cart=cart, item_id__in=changes)}
+    changes = {item_id: quantity for item_id, quantity in changes.items()
+               if quantity != (lines[item_id].quantity if item_id in lines else 0)}
+    # sharded items aren't held, their stock is only checked here and taken at checkout
+    short = [items[item_id] for item_id, quantity in changes.items()
+             if items[item_id].stock_shards and quantity > (lines[item_id].quantity if item_id in lines else 0)
+             and inventory.available(items[item_id]) < quantity]
+    if short:
+        raise inventory.OutOfStock(short)
+
+    removed = [lines[item_id].id for item_id, quantity in changes.items() if not quantity and item_id in lines]
+    updated = [lines[item_id] for item_id, quantity in changes.items() if quantity and item_id in lines]
+    for line in updated:
+        line.quantity = changes[line.item_id]
+    with transaction.atomic():
+        if removed:
+            CartItem.objects.filter(id__in=removed).delete()
+        CartItem.objects.bulk_update(updated, ['quantity'])
+        CartItem.objects.bulk_create([CartItem(cart=cart, item_id=item_id, quantity=quantity)
+                                      for item_id, quantity in changes.items() if quantity and item_id not in lines])
+        cart_cache.invalidate_customers([cart.customer_id])
+        # after the lines, so the transaction starts with a write
+        held = {item_id: quantity for item_id, quantity in changes.items() if not items[item_id].stock_shards}
+        if held:
+            reservations.hold_lines(cart.id, held)
@@ -0,0 +1,116 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+
+from helpers.lru import LRUCache
+
+version_key = 'marketplace:catalog_version'
+
+# rendered catalog pages of this process, keyed by (catalog version, full request path)
+pages = LRUCache(settings.CATALOG_CACHE_MAX_BYTES)
+# values computed from the items at the current catalog version by this process, by name
+_computed = {}
+
+_lock = threading.Lock()
+_seen_version = None
+
+
+def current_version() -> int:
+    """
+    Catalog version, kept in the default cache. Processes only share it when that is a shared backend (e.g. redis),
+    with the LocMem cache of these settings every process has its own version and doesn't see the changes made by
+    the others. A missing version (first use, eviction, restart) starts from the current time so it never goes back
+    to a version already used for pages.
+    """
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, time.time_ns(), timeout=None)
+        version = cache.get(version_key)
+    return version
+
+
+def bump_version():
+    try:
+        cache.incr(version_key)
+    except ValueError:
+        cache.add(version_key, time.time_ns(), timeout=None)
+
+
+def invalidate():
+    """
+    Called whenever items change. The version is bumped right away, so this connection's own reads see the change,
+    and again after commit, so pages rendered meanwhile from pre-commit data by other connections are dropped too.
+    """
+    bump_version()
+    transaction.on_commit(bump_version)
+
+
+def _sync_version():
+    global _seen_version
+    version = current_version()
+    with _lock:
+        if version != _seen_version:
+            # pages and values of older versions can never be served again
+            pages.clear()
+            _computed.clear()
+            _seen_version = version
+    return version
+
+
+def page_key(request):
+    return _sync_version(), request.get_full_path()
+
+
+def computed(name, compute):
+    """
+    `compute()` once per catalog version, e.g. aggregates of the items, so they are read like the pages without a
+    query until the items change
+    """
+    version = _sync_version()
+    with _lock:
+        if name in _computed:
+            return _computed[name]
+    value = compute()
+    with _lock:
+        if version == _seen_version:
+            _computed[name] = value
+    return value
+
+
+def cached_response(request, build_response):
+    """
+    Serves the request from the rendered pages of the current catalog version, or builds the DRF response with
+    `build_response()`, renders and keeps it. Only successful responses are kept.
+    """
+    key = page_key(request)
+    body = pages.get(key)
+    if body is None:
+        response = build_response()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        body = JSONRenderer().render(response.data)
+        pages.set(key, body)
+    return HttpResponse(body, content_type='application/json')
+
+
+async def acached_response(request, build_response):
+    """cached_response of the async views, `build_response()` is awaited and gives a (json) HttpResponse"""
+    key = page_key(request)
+    body = pages.get(key)
+    if body is None:
+        response = await build_response()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        body = response.content
+        pages.set(key, body)
+    return HttpResponse(body, content_type='application/json')
+
+
+def stats() -> dict:
+    return {'version': current_version(), **pages.stats()}
@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.db import transaction
+
+from . import events, querysets
+from .models import Order, OrderStates, DeliveryGuy
+
+
+class DispatchError(Exception):
+    pass
+
+
+def take_order(delivery_guy_id, order_id) -> bool:
+    """
+    Compare and set: moves the order from PAID to AWAITING_DELIVERY and makes it the current delivery of the
+    delivery guy, in one transaction of two conditional UPDATEs. Returns False when the order is not PAID anymore
+    (taken by someone else), raises DispatchError when the delivery guy already has a delivery.
+    """
+    with transaction.atomic():
+        if not Order.objects.filter(id=order_id, status=OrderStates.PAID) \
+                .update(status=OrderStates.AWAITING_DELIVERY):
+            return False
+        if not DeliveryGuy.objects.filter(id=delivery_guy_id, current_delivery__isnull=True) \
+                .update(current_delivery_id=order_id):
+            transaction.set_rollback(True)
+            raise DispatchError('Please completed the current delivery before accepting new')
+        # conditional updates do not send model signals
+        events.order_changed(order_id, OrderStates.AWAITING_DELIVERY, previous_status=OrderStates.PAID)
+    return True
+
+
+def claim_next_order(delivery_guy_id):
+    """
+    Claims the oldest PAID order for the delivery guy and returns it, or None when no order is waiting. A candidate
+    taken by another delivery guy in the meantime is skipped for the next one, up to DISPATCH_CLAIM_ATTEMPTS times.
+    """
+    for _ in range(settings.DISPATCH_CLAIM_ATTEMPTS):
+        # (status, time) index range scan, oldest first
+        order_id = Order.objects.filter(status=OrderStates.PAID).order_by('time', 'id') \
+            .values_list('id', flat=True).first()
+        if order_id is None:
+            return None
+        if take_order(delivery_guy_id, order_id):
+            return querysets.order_list().get(id=order_id)
+    raise DispatchError('Too many delivery guys are claiming orders, try again')
@@ -0,0 +1,47 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+from . import catalog_cache
+from .models import Item, Technician
+
+
+def _etag(*parts) -> str:
+    return hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def _list_etag(queryset, request):
+    # the count changes on deletes, the latest updated_at on inserts and updates
+    marker = queryset.aggregate(count=Count('id'), changed=Max('updated_at'))
+    return _etag(queryset.model.__name__, marker['count'], marker['changed'], request.get_full_path())
+
+
+def _object_etag(queryset, key):
+    changed = queryset.filter(id=key).values_list('updated_at', flat=True).first()
+    return None if changed is None else _etag(queryset.model.__name__, key, changed)
+
+
+def _shard_period() -> int:
+    # sales of sharded items don't touch Item.updated_at, their stock is shown as of at most STOCK_SHARD_CACHE_TTL ago
+    return int(time.time() // max(settings.STOCK_SHARD_CACHE_TTL, 1))
+
+
+def items_etag(request, key=None):
+    """ETag of items_view responses, computed from Item.updated_at without serializing anything"""
+    if key is None:
+        # every change of the items bumps the catalog version, polls of cached pages don't query
+        marker = catalog_cache.computed('items_etag', lambda: Item.objects.aggregate(
+            count=Count('id'), changed=Max('updated_at'), sharded=Max('stock_shards')))
+        return _etag('Item', marker['count'], marker['changed'], marker['sharded'] and _shard_period(),
+                     request.get_full_path())
+    item = Item.objects.filter(id=key).values_list('updated_at', 'stock_shards').first()
+    return None if item is None else _etag('Item', key, item[0], item[1] and _shard_period())
+
+
+def technicians_etag(request, key=None):
+    """ETag of technicians_view responses, computed from Technician.updated_at without serializing anything"""
+    if key is None:
+        return _list_etag(Technician.objects.filter(is_approved=True), request)
+    return _object_etag(Technician.objects.all(), key)
@@ -0,0 +1,122 @@
+import asyncio
+import itertools
+import threading
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import DeliveryGuy, Order, OrderStates, UserRoles
+
+# channel of every delivery guy, tells them when orders start or stop waiting for delivery
+delivery_guys_channel = 'delivery_guys'
+
+
+def user_channel(user_id) -> str:
+    return f"user:{user_id}"
+
+
+def channels_of(user) -> list:
+    channels = [user_channel(user.id)]
+    if user.role == UserRoles.DELIVERY_GUY:
+        channels.append(delivery_guys_channel)
+    return channels
+
+
+class Subscription:
+    """Events of some channels, queued for one client on its event loop"""
+
+    def __init__(self, broker, channels, loop, max_events):
+        self.broker = broker
+        self.channels = channels
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_events)
+        self.overflowed = False
+
+    def push(self, event):
+        # on the subscriber's event loop
+        if self.queue.full():
+            # a client that does not keep up is told to reload instead of growing the queue
+            self.overflowed = True
+            return
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout):
+        """The next event, or None after `timeout` seconds"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """
+    In-process publish/subscribe of events to channels. Publishers may run on any thread (e.g. a sync view),
+    events are handed to the event loop of each subscriber. Subscribers only get events published by their own
+    process, a shared broker (e.g. redis pub/sub) has to take its place when running several processes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+        self._ids = itertools.count(1)
+
+    def subscribe(self, channels) -> Subscription:
+        subscription = Subscription(self, channels, asyncio.get_running_loop(), settings.EVENTS_MAX_QUEUED)
+        with self._lock:
+            for channel in channels:
+                self._subscriptions.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscriptions.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscriptions[channel]
+
+    def publish(self, channels, event_type: str, data: dict):
+        event = {'id': next(self._ids), 'type': event_type, 'data': data}
+        with self._lock:
+            subscriptions = set().union(*(self._subscriptions.get(channel, ()) for channel in channels))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.push, event)
+            except RuntimeError:
+                # the subscriber's loop is closed
+                self.unsubscribe(subscription)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(set().union(*self._subscriptions.values()))
+
+
+broker = LocalBroker()
+
+
+def publish_on_commit(channels, event_type, data):
+    # subscribers only hear about committed changes
+    transaction.on_commit(lambda: broker.publish(channels, event_type, data))
+
+
+def order_changed(order_id, status, previous_status=None, customer_id=None):
+    """Tells the customer, the delivery guy delivering it and, when it (stops) waiting for one, every delivery guy"""
+    if customer_id is None:
+        customer_id = Order.objects.filter(id=order_id).values_list('customer_id', flat=True).first()
+    channels = [user_channel(customer_id)]
+    if previous_status is not None:
+        # new orders have no delivery guy yet
+        channels += [user_channel(delivery_guy_id) for delivery_guy_id
+                     in DeliveryGuy.objects.filter(current_delivery_id=order_id).values_list('id', flat=True)]
+    if OrderStates.PAID in (status, previous_status):
+        channels.append(delivery_guys_channel)
+    publish_on_commit(channels, 'order', {'id': order_id, 'status': status})
+
+
+def booking_changed(booking_id, customer_id, technician_id, status):
+    publish_on_commit([user_channel(customer_id), user_channel(technician_id)], 'booking',
+                      {'id': booking_id, 'status': status})
@@ -0,0 +1,17 @@
+from django.db import models
+
+
+class FullTextField(models.TextField):
+    """
+    Hidden column of an SQLite FTS5 table (it has the same name as the table). Supports the `match` lookup.
+    """
+
+
+@FullTextField.register_lookup
+class FullTextMatch(models.Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", lhs_params + rhs_params
@@ -0,0 +1,121 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+from rest_framework import serializers
+
+from helpers.vars import derivatives_dir
+
+logger = logging.getLogger(__name__)
+
+_save_options = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+_executor = ThreadPoolExecutor(max_workers=settings.IMAGE_DERIVATIVE_WORKERS, thread_name_prefix='derivatives')
+
+
+def derivative_name(name: str, width: int, image_format: str) -> str:
+    """Storage name of a derivative, e.g. images/th.jpeg -> derivatives/images/th_300w.webp"""
+    stem = os.path.splitext(name)[0]
+    return f"{derivatives_dir}/{stem}_{width}w.{image_format}"
+
+
+def derivative_names(name: str):
+    return [derivative_name(name, width, image_format)
+            for width in settings.IMAGE_DERIVATIVE_WIDTHS for image_format in settings.IMAGE_DERIVATIVE_FORMATS]
+
+
+def _encode(image, width, image_format) -> bytes:
+    resized = image.copy()
+    # keeps the aspect ratio and never upscales
+    resized.thumbnail((width, width * 10), Image.LANCZOS)
+    if image_format == 'jpeg' and resized.mode != 'RGB':
+        background = Image.new('RGB', resized.size, 'white')
+        background.paste(resized, mask=resized.getchannel('A') if 'A' in resized.getbands() else None)
+        resized = background
+    output = BytesIO()
+    resized.save(output, **_save_options[image_format])
+    return output.getvalue()
+
+
+def generate_derivatives(name: str, overwrite=False) -> int:
+    """Writes the missing (or, with overwrite, all) derivatives of a stored image and returns how many were written"""
+    missing = [derivative for derivative in derivative_names(name)
+               if overwrite or not default_storage.exists(derivative)]
+    if not missing:
+        return 0
+    try:
+        with default_storage.open(name, 'rb') as source:
+            image = ImageOps.exif_transpose(Image.open(source))
+            image.load()
+    except (FileNotFoundError, UnidentifiedImageError, OSError) as err:
+        logger.warning("Cannot create derivatives of %s: %s", name, err)
+        return 0
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+    written = 0
+    for width in settings.IMAGE_DERIVATIVE_WIDTHS:
+        for image_format in settings.IMAGE_DERIVATIVE_FORMATS:
+            derivative = derivative_name(name, width, image_format)
+            if derivative not in missing:
+                continue
+            if default_storage.exists(derivative):
+                default_storage.delete(derivative)
+            default_storage.save(derivative, ContentFile(_encode(image, width, image_format)))
+            written += 1
+    return written
+
+
+def delete_derivatives(name: str):
+    for derivative in derivative_names(name):
+        default_storage.delete(derivative)
+
+
+def _generate_in_background(name):
+    try:
+        generate_derivatives(name)
+    except Exception:
+        logger.exception("Creating derivatives of %s failed", name)
+
+
+def schedule_derivatives(field_file):
+    """Creates the derivatives of an uploaded image on a worker thread once the transaction is committed"""
+    if not field_file:
+        return
+    name = field_file.name
+    if settings.IMAGE_DERIVATIVES_ASYNC:
+        transaction.on_commit(lambda: _executor.submit(_generate_in_background, name))
+    else:
+        transaction.on_commit(lambda: _generate_in_background(name))
+
+
+class ThumbnailsField(serializers.Field):
+    """
+    Read only {width: {format: url}} of the derivatives of an image field, e.g. `thumbnails = ThumbnailsField(
+    source='image')`. URLs are derived from the image name, a just uploaded image may take a moment to get them.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        request = self.context.get('request')
+        thumbnails = {}
+        for width in settings.IMAGE_DERIVATIVE_WIDTHS:
+            thumbnails[str(width)] = {}
+            for image_format in settings.IMAGE_DERIVATIVE_FORMATS:
+                url = default_storage.url(derivative_name(value.name, width, image_format))
+                thumbnails[str(width)][image_format] = request.build_absolute_uri(url) if request else url
+        return thumbnails
@@ -0,0 +1,174 @@
+import random
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When
+from django.utils import timezone
+
+from . import cart_cache, catalog_cache, ledger
+from .models import Item, MovementKinds, StockHold, StockShard
+
+# {item_id: (expiry, quantity)} of the sharded items read by this process
+_shard_totals = {}
+
+
+class OutOfStock(Exception):
+    """Raised when one or more items don't have the requested quantity in stock. Nothing is taken out of stock."""
+
+    def __init__(self, items):
+        self.items = items
+        super().__init__(f"Requested quantity is not available in item: {', '.join(str(item) for item in items)}")
+
+
+def per_item(values: dict, key='id'):
+    """CASE expression giving each item id its own value, so rows can be updated differently in one statement"""
+    return Case(*[When(**{key: item_id}, then=Value(value)) for item_id, value in values.items()],
+                output_field=IntegerField())
+
+
+def on_hand(item, cached=True) -> int:
+    """
+    Stock of the item: its quantity, or the sum of its shards for a sharded item, cached for STOCK_SHARD_CACHE_TTL
+    seconds so reads of a hot item don't add up its shards every time
+    """
+    if not item.stock_shards:
+        return item.quantity
+    now = time.monotonic()
+    entry = _shard_totals.get(item.id)
+    if cached and entry and entry[0] > now:
+        return entry[1]
+    total = StockShard.objects.filter(item_id=item.id).aggregate(total=Sum('quantity'))['total'] or 0
+    _shard_totals[item.id] = (now + settings.STOCK_SHARD_CACHE_TTL, total)
+    return total
+
+
+def available(item) -> int:
+    """Stock of the item which isn't held by carts, sharded items have no holds"""
+    return on_hand(item) - item.reserved
+
+
+def decrement_stock(quantities: dict, held=None, kind=MovementKinds.SALE):
+    """
+    Takes {item_id: quantity} out of stock and records the `kind` movements in the ledger. Either every item is
+    decremented or, if any of them is short, none is and OutOfStock is raised. Items are decremented with a single
+    conditional UPDATE, sharded ones by take_from_shards(). Stock held by carts is not available, except for `held`
+    {item_id: quantity}: the holds of the buyer taken by reservations.take_holds, released by the same UPDATE.
+    """
+    quantities = {item_id: quantity for item_id, quantity in quantities.items() if quantity}
+    if not quantities:
+        return
+    held = {item_id: held.get(item_id, 0) for item_id in quantities} if held else {}
+    requested = per_item(quantities)
+    reserved = F('reserved') - per_item(held) if held else F('reserved')
+    changes = {'quantity': F('quantity') - requested, 'updated_at': timezone.now()}
+    if held:
+        changes['reserved'] = reserved
+    short = []
+    with transaction.atomic():
+        updated = Item.objects.filter(id__in=quantities, stock_shards=0, quantity__gte=reserved + requested) \
+            .update(**changes)
+        sharded = {}
+        if updated < len(quantities):
+            # read after the UPDATE, which already locked what it needs
+            sharded = dict(Item.objects.filter(id__in=quantities, stock_shards__gt=0)
+                           .values_list('id', 'stock_shards'))
+        if updated == len(quantities) - len(sharded):
+            short = [item_id for item_id, shards in sharded.items()
+                     if not take_from_shards(item_id, quantities[item_id], shards)]
+            if not short:
+                ledger.record(kind, {item_id: -quantity for item_id, quantity in quantities.items()})
+                catalog_cache.invalidate()
+                # carts show sharded items with STOCK_SHARD_CACHE_TTL old stock, their sales would drop every cart
+                cart_cache.invalidate_items(item_id for item_id in quantities if item_id not in sharded)
+                return
+        transaction.set_rollback(True)
+    items = Item.objects.in_bulk(quantities)
+    raise OutOfStock([items.get(item_id, item_id) for item_id, quantity in quantities.items()
+                      if item_id not in items or item_id in short or available(items[item_id]) + held.get(item_id, 0)
+                      < quantity])
+
+
+def take_from_shards(item_id, quantity, shards) -> bool:
+    """
+    Takes the quantity from the shards of the item, returns False when they don't have it (nothing is taken then).
+    A random shard covering all of it is tried first with a conditional UPDATE, so concurrent sales change different
+    rows. Otherwise the shards are locked and the quantity is taken from as many of them as needed.
+    """
+    _shard_totals.pop(item_id, None)
+    start = random.randrange(shards)
+    if StockShard.objects.filter(item_id=item_id, index=start, quantity__gte=quantity) \
+            .update(quantity=F('quantity') - quantity):
+        return True
+    stock = list(StockShard.objects.select_for_update().filter(item_id=item_id, quantity__gt=0)
+                 .values_list('index', 'quantity'))
+    if sum(shard_quantity for _, shard_quantity in stock) < quantity:
+        return False
+    taken, remaining = {}, quantity
+    # the shards after the random one first, spreading the emptied shards
+    for index, shard_quantity in sorted(stock, key=lambda shard: (shard[0] - start) % shards):
+        taken[index] = min(shard_quantity, remaining)
+        remaining -= taken[index]
+        if not remaining:
+            break
+    StockShard.objects.filter(item_id=item_id, index__in=taken) \
+        .update(quantity=F('quantity') - per_item(taken, key='index'))
+    return True
+
+
+def adjust_stock(item_id, change, kind=None):
+    """
+    Adds `change` (negative to remove) to the stock of the item and records it in the ledger, as a restock when it
+    adds and an adjustment when it removes unless `kind` is given. Raises OutOfStock when the item doesn't have the
+    quantity to remove.
+    """
+    if not change:
+        return
+    kind = kind or (MovementKinds.RESTOCK if change > 0 else MovementKinds.ADJUSTMENT)
+    with transaction.atomic():
+        if Item.objects.filter(id=item_id, stock_shards=0, quantity__gte=-change) \
+                .update(quantity=F('quantity') + change, updated_at=timezone.now()):
+            ledger.record(kind, {item_id: change})
+            catalog_cache.invalidate()
+            cart_cache.invalidate_items([item_id])
+            return
+        shards = Item.objects.filter(id=item_id).values_list('stock_shards', flat=True).first()
+        if shards and change > 0:
+            _shard_totals.pop(item_id, None)
+            StockShard.objects.filter(item_id=item_id, index=random.randrange(shards)) \
+                .update(quantity=F('quantity') + change)
+        if shards and (change > 0 or take_from_shards(item_id, -change, shards)):
+            ledger.record(kind, {item_id: change})
+            catalog_cache.invalidate()
+            cart_cache.invalidate_items([item_id])
+            return
+    raise OutOfStock([Item.objects.filter(id=item_id).first() or item_id])
+
+
+def set_stock_shards(item_id, shards):
+    """
+    Splits the stock of the item evenly over `shards` StockShard rows, or with 0 moves it back into Item.quantity.
+    Sharded items are sold first come first served: the holds of the item are dropped and no new ones are taken.
+    """
+    with transaction.atomic():
+        # locks the item (and the database on SQLite) before it's read
+        if not Item.objects.filter(id=item_id).update(updated_at=timezone.now()):
+            raise Item.DoesNotExist(f"Item {item_id} does not exist")
+        item = Item.objects.get(id=item_id)
+        stock = item.quantity
+        if item.stock_shards:
+            stock += sum(StockShard.objects.select_for_update().filter(item_id=item_id)
+                         .values_list('quantity', flat=True))
+            StockShard.objects.filter(item_id=item_id).delete()
+        if shards:
+            StockHold.objects.filter(item_id=item_id).delete()
+            StockShard.objects.bulk_create([StockShard(item_id=item_id, index=index,
+                                                       quantity=stock // shards + (index < stock % shards))
+                                            for index in range(shards)])
+            Item.objects.filter(id=item_id).update(quantity=0, reserved=0, stock_shards=shards,
+                                                   updated_at=timezone.now())
+        else:
+            Item.objects.filter(id=item_id).update(quantity=stock, stock_shards=0, updated_at=timezone.now())
+        _shard_totals.pop(item_id, None)
+        catalog_cache.invalidate()
+        cart_cache.invalidate_items([item_id])
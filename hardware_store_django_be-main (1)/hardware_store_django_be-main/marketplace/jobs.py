@@ -0,0 +1,10 @@
+from helpers.functions import clean_older_technician_bookings
+from helpers.scheduler import register
+from .ledger import take_snapshots
+from .reservations import release_expired_holds
+
+# periodic jobs of the marketplace, run by `manage.py scheduler`
+
+register(interval=300, jitter=30)(clean_older_technician_bookings)
+register(interval=60, jitter=10)(release_expired_holds)
+register(interval=3600, jitter=300)(take_snapshots)
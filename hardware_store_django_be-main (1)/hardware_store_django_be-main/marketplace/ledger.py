@@ -0,0 +1,91 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, IntegerField, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import querysets
+from .models import Item, StockMovement, StockSnapshot
+
+# movements younger than this are left to the next snapshot, a transaction which got a lower id may still commit
+snapshot_settle = timedelta(seconds=60)
+snapshot_batch_size = 500
+
+
+def record(kind, changes: dict):
+    """Appends one movement per item of {item_id: change}, in the transaction changing the stock"""
+    StockMovement.objects.bulk_create([StockMovement(item_id=item_id, kind=kind, change=change)
+                                       for item_id, change in changes.items() if change])
+
+
+def _latest_snapshot(field, before=None):
+    snapshots = StockSnapshot.objects.filter(item=OuterRef('pk'))
+    if before is not None:
+        snapshots = snapshots.filter(time__lte=before)
+    return Subquery(snapshots.order_by('-movement').values(field)[:1])
+
+
+def with_ledger_quantity(items, at=None):
+    """
+    Annotates the items with `ledger_quantity`: the quantity after the movements up to `at` (all of them by
+    default), from the latest snapshot before it and the movements after that snapshot.
+    """
+    movements = StockMovement.objects.filter(item=OuterRef('pk'), id__gt=OuterRef('snapshot_movement'))
+    if at is not None:
+        movements = movements.filter(time__lte=at)
+    delta = Subquery(movements.values('item').annotate(total=Sum('change')).values('total'),
+                     output_field=IntegerField())
+    return items.annotate(snapshot_movement=Coalesce(_latest_snapshot('movement', at), Value(0))) \
+        .annotate(ledger_quantity=Coalesce(_latest_snapshot('quantity', at), Value(0)) + Coalesce(delta, Value(0)))
+
+
+def quantity_at(item_id, at) -> int:
+    """Stock of the item at the given time, rebuilt from the ledger"""
+    return with_ledger_quantity(Item.objects.filter(id=item_id), at).values_list('ledger_quantity', flat=True).get()
+
+
+def take_snapshots() -> int:
+    """
+    Snapshots the quantity of every item moved since the last snapshots, from its previous snapshot and its new
+    movements (one aggregate over the new movements, not the ledger), and returns the number of snapshots taken.
+    """
+    since = StockSnapshot.objects.aggregate(last=Max('movement'))['last'] or 0
+    until = StockMovement.objects.filter(id__gt=since, time__lt=timezone.now() - snapshot_settle) \
+        .aggregate(last=Max('id'))['last']
+    if until is None:
+        return 0
+    moved = StockMovement.objects.filter(id__gt=since, id__lte=until).values('item') \
+        .annotate(change=Sum('change'), last=Max('id'), last_time=Max('time')).order_by('item')
+    taken = 0
+    batch = []
+    for movement in moved.iterator(chunk_size=snapshot_batch_size):
+        batch.append(movement)
+        if len(batch) == snapshot_batch_size:
+            taken += _save_snapshots(batch)
+            batch = []
+    if batch:
+        taken += _save_snapshots(batch)
+    return taken
+
+
+def _save_snapshots(moved):
+    previous = dict(Item.objects.filter(id__in=[movement['item'] for movement in moved])
+                    .annotate(previous=Coalesce(_latest_snapshot('quantity'), Value(0)))
+                    .values_list('id', 'previous'))
+    with transaction.atomic():
+        # items deleted meanwhile took their movements with them
+        snapshots = StockSnapshot.objects.bulk_create([
+            StockSnapshot(item_id=movement['item'], quantity=previous[movement['item']] + movement['change'],
+                          movement=movement['last'], time=movement['last_time'])
+            for movement in moved if movement['item'] in previous])
+    return len(snapshots)
+
+
+def mismatches(chunk_size=2000):
+    """
+    Yields (item id, stock, ledger quantity) of the items whose stock (quantity or sum of shards) doesn't match the
+    ledger. One query, streamed: the stock and the ledger are read together so concurrent sales can't tell them apart.
+    """
+    items = with_ledger_quantity(querysets.with_stock(Item.objects.order_by('id'))).exclude(stock=F('ledger_quantity'))
+    yield from items.values_list('id', 'stock', 'ledger_quantity').iterator(chunk_size=chunk_size)
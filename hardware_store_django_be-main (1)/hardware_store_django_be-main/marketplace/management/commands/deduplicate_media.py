@@ -0,0 +1,35 @@
+from django.core.files.storage import default_storage, FileSystemStorage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from marketplace.models import Item, Technician, DeliveryGuy
+
+
+class Command(BaseCommand):
+    help = 'Move images uploaded before the content addressed storage to their content path, sharing equal files'
+
+    def handle(self, *args, **options):
+        fields = [(Item, 'image'), (Technician, 'nic_image'), (DeliveryGuy, 'nic_image')]
+        legacy = set()
+        for model, field in fields:
+            legacy.update(model.objects.values_list(field, flat=True).distinct())
+        legacy = {name for name in legacy
+                  if name and default_storage.is_upload(name) and not default_storage.is_content_addressed(name)}
+
+        # legacy files have no reference count, they are removed directly once no row uses them
+        plain_storage = FileSystemStorage()
+        moved = 0
+        for name in sorted(legacy):
+            if not default_storage.exists(name):
+                self.stderr.write(f"{name} is missing, skipped")
+                continue
+            with transaction.atomic():
+                with default_storage.open(name, 'rb') as content:
+                    # saving adds the first reference, every other row pointing at the name adds one more
+                    stored_name = default_storage.save(name, content)
+                rows = sum(model.objects.filter(**{field: name}).update(**{field: stored_name})
+                           for model, field in fields)
+                default_storage.retain(stored_name, count=rows - 1)
+            plain_storage.delete(name)
+            moved += 1
+        self.stdout.write(self.style.SUCCESS(f"{moved} images moved to content addressed paths"))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from marketplace.images import generate_derivatives
+from marketplace.models import Item, Technician, DeliveryGuy
+
+
+class Command(BaseCommand):
+    help = 'Create the missing resized copies of item and NIC images, e.g. for images uploaded before the pipeline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--overwrite', action='store_true', help='re-create existing derivatives too')
+
+    def handle(self, *args, **options):
+        names = set(Item.objects.exclude(image='').exclude(image__isnull=True).values_list('image', flat=True))
+        for model in (Technician, DeliveryGuy):
+            names.update(model.objects.exclude(nic_image='').values_list('nic_image', flat=True))
+
+        written = 0
+        for name in sorted(names):
+            written += generate_derivatives(name, overwrite=options['overwrite'])
+        self.stdout.write(self.style.SUCCESS(f"{written} derivatives written for {len(names)} images"))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from marketplace import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full text search index of items from the item table'
+
+    def handle(self, *args, **options):
+        if not search.index_available():
+            raise CommandError('Search index table does not exist, run `manage.py migrate` on an SQLite database')
+        count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} items"))
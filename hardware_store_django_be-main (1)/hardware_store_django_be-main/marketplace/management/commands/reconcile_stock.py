@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from marketplace import ledger
+
+
+class Command(BaseCommand):
+    help = 'Verify the quantity of every item against the stock ledger (latest snapshot and the movements after it)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='rows fetched at a time')
+
+    def handle(self, *args, **options):
+        count = 0
+        for item_id, quantity, ledger_quantity in ledger.mismatches(options['chunk_size']):
+            count += 1
+            self.stdout.write(f"Item {item_id}: quantity {quantity}, ledger {ledger_quantity} "
+                              f"({quantity - ledger_quantity:+})")
+        if count:
+            raise CommandError(f"{count} items don't match the ledger")
+        self.stdout.write(self.style.SUCCESS('Every item matches the ledger'))
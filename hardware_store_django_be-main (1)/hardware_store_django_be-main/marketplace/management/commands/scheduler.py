@@ -1,19 +1,84 @@
-# your_app/management/commands/run_function.py
-
 import time
 
-import schedule
+from django.conf import settings
 from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils.module_loading import autodiscover_modules
 
-from helpers.functions import clean_older_technician_bookings
+from helpers.scheduler import jobs, Lease
 
 
 class Command(BaseCommand):
-    help = 'Run a functions at regular intervals'
+    help = 'Run the periodic jobs registered in the jobs.py modules of the apps, one active scheduler at a time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='run every job once and exit')
+        parser.add_argument('--list', action='store_true', help='list the registered jobs and exit')
 
     def handle(self, *args, **options):
-        schedule.every(1).seconds.do(clean_older_technician_bookings)
+        autodiscover_modules('jobs')
+        if options['list']:
+            for job in jobs.values():
+                self.stdout.write(f"{job.name}: every {job.interval}s (+{job.jitter}s)")
+            return
+
+        lease = Lease('scheduler', settings.SCHEDULER_LEASE_TTL)
+        if options['once']:
+            if not lease.acquire():
+                self.stderr.write('Another scheduler holds the lease')
+                return
+            try:
+                for job in jobs.values():
+                    self.report(job.run())
+            finally:
+                # a failing job must not keep other schedulers out until the lease expires
+                lease.release()
+            return
+
+        now = time.monotonic()
+        for job in jobs.values():
+            job.schedule_next(now - job.interval)
+        try:
+            self.run_forever(lease)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            lease.release()
 
+    def run_forever(self, lease):
+        # the lease is renewed well before it expires, a standby scheduler checks it at the same pace
+        renew_every = settings.SCHEDULER_LEASE_TTL / 3
+        next_renewal = 0.0
+        holder = False
         while True:
-            schedule.run_pending()
-            time.sleep(1)
+            now = time.monotonic()
+            if now >= next_renewal:
+                close_old_connections()
+                was_holder, holder = holder, lease.acquire()
+                if holder != was_holder:
+                    self.stdout.write('Took the scheduler lease' if holder else 'Waiting for the scheduler lease')
+                next_renewal = now + renew_every
+
+            if holder:
+                for job in jobs.values():
+                    if job.next_run <= now and holder:
+                        self.report(self.run_job(job))
+                        job.schedule_next(time.monotonic())
+                        # a slow job must not let the lease run out under it
+                        holder = lease.acquire()
+
+            # sleeps until the next due job (or lease renewal), nothing runs in between
+            due = min([next_renewal] + ([job.next_run for job in jobs.values()] if holder else []))
+            time.sleep(max(0.0, due - time.monotonic()))
+
+    def run_job(self, job):
+        try:
+            return job.run()
+        except Exception as err:
+            return {'job': job.name, 'error': str(err)}
+
+    def report(self, result):
+        if 'error' in result:
+            self.stderr.write(f"{result['job']} failed: {result['error']}")
+        else:
+            self.stdout.write(f"{result['job']}: {result['rows']} rows in {result['duration'] * 1000:.1f} ms")
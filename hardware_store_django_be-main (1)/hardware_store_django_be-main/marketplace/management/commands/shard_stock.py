@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from marketplace import inventory
+from marketplace.models import Item
+
+
+class Command(BaseCommand):
+    help = 'Split the stock of a hot item over shard rows so concurrent sales update different rows (0 merges it back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('item', type=int)
+        parser.add_argument('shards', type=int, help='number of shards, 0 keeps the stock in the item row again')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['shards'] <= 256:
+            raise CommandError('shards should be between 0 and 256')
+        try:
+            inventory.set_stock_shards(options['item'], options['shards'])
+        except Item.DoesNotExist as error:
+            raise CommandError(str(error))
+        self.stdout.write(self.style.SUCCESS(f"Item {options['item']}: {options['shards'] or 'no'} stock shards"))
@@ -0,0 +1,50 @@
+# Generated by Django 5.0 on 2026-10-18 08:29
+
+import django.db.models.deletion
+import marketplace.fields
+from django.db import migrations, models
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 is SQLite specific, other databases fall back to LIKE queries in marketplace.search
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS marketplace_item_fts USING fts5("
+        "name, description, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')")
+    # matches in the name weigh more than matches in the description
+    schema_editor.execute("INSERT INTO marketplace_item_fts (marketplace_item_fts, rank) "
+                          "VALUES ('rank', 'bm25(10.0, 1.0)')")
+    schema_editor.execute("INSERT INTO marketplace_item_fts (rowid, name, description) "
+                          "SELECT id, name, description FROM marketplace_item")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS marketplace_item_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ItemSearchDocument',
+            fields=[
+                ('item', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_document', serialize=False, to='marketplace.item')),
+                ('name', models.TextField()),
+                ('description', models.TextField()),
+                ('document', marketplace.fields.FullTextField(db_column='marketplace_item_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'marketplace_item_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
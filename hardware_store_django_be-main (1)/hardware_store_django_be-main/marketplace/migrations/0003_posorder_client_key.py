@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-18 08:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0002_item_search_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='posorder',
+            name='client_key',
+            field=models.CharField(blank=True, help_text='idempotency key generated by the cashier terminal for offline receipts', max_length=64, null=True, unique=True),
+        ),
+    ]
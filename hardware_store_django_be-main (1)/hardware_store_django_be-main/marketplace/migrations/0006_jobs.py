@@ -0,0 +1,27 @@
+# Generated by Django 5.0 on 2026-10-18 08:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0005_storedfile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('owner', models.CharField(max_length=100)),
+                ('expires', models.DateTimeField()),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='technicianbooking',
+            name='created_time',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
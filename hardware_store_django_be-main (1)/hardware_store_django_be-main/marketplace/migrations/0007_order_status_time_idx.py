@@ -0,0 +1,17 @@
+# Generated by Django 5.0 on 2026-10-18 08:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0006_jobs'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'time'], name='order_status_time_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.0 on 2026-10-18 09:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0007_order_status_time_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='reserved',
+            field=models.IntegerField(default=0, help_text="quantity held by carts, the sum of the item's stock holds"),
+        ),
+        migrations.CreateModel(
+            name='StockHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('expires', models.DateTimeField(db_index=True)),
+                ('cart', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='holds', to='marketplace.cart')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='marketplace.item')),
+            ],
+            options={
+                'unique_together': {('cart', 'item')},
+            },
+        ),
+    ]
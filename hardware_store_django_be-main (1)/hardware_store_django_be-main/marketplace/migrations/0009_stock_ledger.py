@@ -0,0 +1,47 @@
+# Generated by Django 5.0 on 2026-10-18 09:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def open_ledger(apps, schema_editor):
+    # the stock from before the ledger is its opening adjustment, so every quantity is the sum of its movements
+    Item, StockMovement = apps.get_model('marketplace', 'Item'), apps.get_model('marketplace', 'StockMovement')
+    StockMovement.objects.bulk_create(
+        [StockMovement(item_id=item_id, kind='ADJUSTMENT', change=quantity)
+         for item_id, quantity in Item.objects.exclude(quantity=0).values_list('id', 'quantity').iterator()],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0008_stock_holds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('SALE', 'Sale'), ('POS_SALE', 'Pos Sale'), ('RESTOCK', 'Restock'), ('ADJUSTMENT', 'Adjustment')], max_length=20)),
+                ('change', models.IntegerField()),
+                ('time', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='movements', to='marketplace.item')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('movement', models.BigIntegerField(db_index=True)),
+                ('time', models.DateTimeField()),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='marketplace.item')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['item', 'movement'], name='marketplace_item_id_86e8b9_idx')],
+            },
+        ),
+        migrations.RunPython(open_ledger, migrations.RunPython.noop),
+    ]
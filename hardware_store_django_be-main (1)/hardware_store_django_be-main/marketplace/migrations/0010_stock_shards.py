@@ -0,0 +1,31 @@
+# Generated by Django 5.0 on 2026-10-18 09:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marketplace', '0009_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='stock_shards',
+            field=models.PositiveSmallIntegerField(default=0, help_text='when set, the stock is split over this many StockShard rows instead of quantity'),
+        ),
+        migrations.CreateModel(
+            name='StockShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveSmallIntegerField()),
+                ('quantity', models.IntegerField(default=0)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shards', to='marketplace.item')),
+            ],
+            options={
+                'unique_together': {('item', 'index')},
+            },
+        ),
+    ]
@@ -2,6 +2,7 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 
 from helpers.vars import images_dir
+from .fields import FullTextField
 
 
 # Choices
@@ -25,6 +26,13 @@ class JobStates(models.TextChoices):
     DONE = 'done'
 
 
+class MovementKinds(models.TextChoices):
+    SALE = 'SALE'
+    POS_SALE = 'POS_SALE'
+    RESTOCK = 'RESTOCK'
+    ADJUSTMENT = 'ADJUSTMENT'
+
+
 class BookingStates(models.TextChoices):
     PENDING = 'PENDING'
     TECHNICIAN_ACCEPTED = 'TECHNICIAN_ACCEPTED'  # booking accepted by technician
@@ -70,6 +78,7 @@ class Technician(RbacUser):
     nic_no = models.CharField(max_length=10, null=False)
     nic_image = models.ImageField(upload_to=images_dir, null=False)
     skill_category = models.CharField(max_length=100, null=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         verbose_name = "Technician"
@@ -102,12 +111,37 @@ class Item(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     image = models.ImageField(upload_to=images_dir, null=True)
     quantity = models.IntegerField(default=0)
+    reserved = models.IntegerField(default=0, help_text="quantity held by carts, the sum of the item's stock holds")
+    stock_shards = models.PositiveSmallIntegerField(
+        default=0, help_text="when set, the stock is split over this many StockShard rows instead of quantity")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    @property
+    def available(self) -> int:
+        return self.quantity - self.reserved
 
     def __str__(self):
         return f"{self.id}: {self.name} | {self.price} | qty: {self.quantity}  |" \
                f" {'In Stock' if self.quantity > 0 else 'Out of Stock'}"
 
 
+class ItemSearchDocument(models.Model):
+    """
+    Row of the SQLite FTS5 index over Item.name and Item.description. The table is created by a migration and
+    kept in sync by marketplace.search, `rank` is only populated when the query has a `document__match` filter.
+    """
+    item = models.OneToOneField(Item, primary_key=True, db_column='rowid', on_delete=models.DO_NOTHING,
+                                related_name='search_document')
+    name = models.TextField()
+    description = models.TextField()
+    document = FullTextField(db_column='marketplace_item_fts')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'marketplace_item_fts'
+
+
 class Feedback(models.Model):
     description = models.CharField(max_length=300, null=False)
     item = models.ForeignKey(Item, null=True, on_delete=models.CASCADE, related_name='feedbacks')
@@ -134,6 +168,71 @@ class CartItem(models.Model):
         return f"{self.id} | {self.item.id} - {self.item.name} qty: {self.quantity}"
 
 
+class StockHold(models.Model):
+    """
+    Quantity of an item held for a cart line until `expires`, counted in Item.reserved. Holds of a deleted cart are
+    kept (cart set to null) until they expire, so the counter is only changed with the holds (marketplace.reservations).
+    """
+    cart = models.ForeignKey(Cart, on_delete=models.SET_NULL, null=True, related_name='holds')
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='holds')
+    quantity = models.IntegerField()
+    expires = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('cart', 'item')
+
+    def __str__(self):
+        return f"{self.id} | cart {self.cart_id} - item {self.item_id} qty: {self.quantity} until {self.expires}"
+
+
+class StockShard(models.Model):
+    """
+    Part of the stock of an item with Item.stock_shards set. Sales take from a random shard, so concurrent sales of
+    a hot item change different rows (marketplace.inventory).
+    """
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='shards')
+    index = models.PositiveSmallIntegerField()
+    quantity = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('item', 'index')
+
+    def __str__(self):
+        return f"{self.id} | item {self.item_id} shard {self.index} qty: {self.quantity}"
+
+
+class StockMovement(models.Model):
+    """
+    Append only ledger of stock changes, written in the transaction changing Item.quantity (marketplace.inventory).
+    The quantity of an item is the sum of its changes.
+    """
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='movements')
+    kind = models.CharField(max_length=20, choices=MovementKinds)
+    change = models.IntegerField()
+    time = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.id} | item {self.item_id} {self.kind} {self.change:+} at {self.time}"
+
+
+class StockSnapshot(models.Model):
+    """
+    Quantity of an item after its movements up to `movement` (the id of the last one counted), taken periodically
+    so the stock at a point in time is the latest snapshot before it plus the movements after the snapshot.
+    """
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='snapshots')
+    quantity = models.IntegerField()
+    movement = models.BigIntegerField(db_index=True)
+    # time of the last movement counted
+    time = models.DateTimeField()
+
+    class Meta:
+        indexes = [models.Index(fields=['item', 'movement'])]
+
+    def __str__(self):
+        return f"{self.id} | item {self.item_id} qty: {self.quantity} at {self.time}"
+
+
 class Order(models.Model):
     status = models.CharField(max_length=20, choices=OrderStates, default=OrderStates.PAID)
     time = models.DateTimeField(auto_now_add=True)
@@ -144,6 +243,12 @@ class Order(models.Model):
     def __str__(self):
         return f"{self.id}. {self.customer.__str__()} | {self.status}"
 
+    class Meta:
+        indexes = [
+            # the dispatch queue takes the oldest PAID order
+            models.Index(fields=['status', 'time'], name='order_status_time_idx'),
+        ]
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, null=False, related_name="items")
@@ -176,7 +281,7 @@ class DeliveryGuy(RbacUser):
 class TechnicianBooking(models.Model):
     title = models.CharField(max_length=50, null=False)
     job_description = models.CharField(max_length=300, null=False)
-    created_time = models.DateTimeField(auto_now_add=True)
+    created_time = models.DateTimeField(auto_now_add=True, db_index=True)
 
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, null=False)
     technician = models.ForeignKey(Technician, on_delete=models.CASCADE, null=False)
@@ -197,9 +302,32 @@ class PosOrder(models.Model):
 
     total = models.DecimalField(max_digits=10, decimal_places=2, null=True)
     is_paid = models.BooleanField(default=True)
+    client_key = models.CharField(max_length=64, unique=True, null=True, blank=True,
+                                  help_text="idempotency key generated by the cashier terminal for offline receipts")
 
 
 class PosOrderItem(models.Model):
     pos_order = models.ForeignKey(PosOrder, on_delete=models.CASCADE, null=False, related_name="items")
     item = models.ForeignKey(Item, on_delete=models.CASCADE, null=False)
     quantity = models.IntegerField()
+
+
+class StoredFile(models.Model):
+    """Reference count of a content addressed upload, shared by every field pointing to the same file"""
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField()
+    references = models.PositiveIntegerField(default=0)
+    created_time = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} | refs: {self.references}"
+
+
+class JobLease(models.Model):
+    """Lease of the job scheduler, only the owner of an unexpired lease runs the jobs"""
+    name = models.CharField(max_length=50, unique=True)
+    owner = models.CharField(max_length=100)
+    expires = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} | {self.owner} until {self.expires}"
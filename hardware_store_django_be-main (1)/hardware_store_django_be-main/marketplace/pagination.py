@@ -0,0 +1,163 @@
+import base64
+import json
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import JsonResponse
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .serializers import adata
+
+
+class ItemCursorPagination(CursorPagination):
+    """
+    Keyset pagination over Item.id. Page size can be changed with `?page_size=` and the total number of
+    matching rows is only counted when `?count=true` is requested.
+    """
+    ordering = 'id'
+    page_size = settings.CATALOG_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.CATALOG_MAX_PAGE_SIZE
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param, '').lower() in ('1', 'true'):
+            self.count = queryset.count()
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        content = {
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+        }
+        if self.count is not None:
+            content['count'] = self.count
+        content['results'] = data
+        return Response(content)
+
+
+class RankedItemCursorPagination(ItemCursorPagination):
+    """
+    Keyset pagination over search results annotated with an FTS `rank`, best matches first, on (rank, id). Unlike
+    DRF's cursors, which keep the rank of their row, the position is the current rank of that row: bm25 ranks all
+    shift as items are added and a kept rank would repeat or skip rows on the next page. Cursors of apaginate().
+    """
+    ordering = ('rank', 'id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count = None
+        if request.query_params.get(self.count_query_param, '').lower() in ('1', 'true'):
+            self.count = queryset.count()
+        page_size = self.get_page_size(request)
+        values, reverse = _decode_position(request.query_params.get(self.cursor_query_param, ''))
+        if not _valid_position(values, self.ordering):
+            values, reverse = None, False
+        elif _relocated(self.ordering):
+            values = list(queryset.filter(id=values[-1]).values_list(*self.ordering).first() or values)
+        rows = list(_keyset(queryset, self.ordering, values, reverse)[:page_size + 1])
+        page, self.next_link, self.previous_link = _page(request, rows, page_size, self.ordering, values, reverse)
+        return page
+
+    def get_next_link(self):
+        return self.next_link
+
+    def get_previous_link(self):
+        return self.previous_link
+
+
+def paginate(request, queryset, serializer_class, paginator_class=ItemCursorPagination):
+    """Serializes a single keyset page of the queryset and returns the paginated response"""
+    paginator = paginator_class()
+    page = paginator.paginate_queryset(queryset, request)
+    serializer = serializer_class(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+
+def _encode_position(values, reverse) -> str:
+    return base64.urlsafe_b64encode(json.dumps({'p': values, 'r': reverse}).encode()).decode()
+
+
+def _decode_position(cursor):
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return position['p'], bool(position['r'])
+    except (ValueError, KeyError, TypeError):
+        return None, False
+
+
+def _after(ordering, values, reverse):
+    """Keyset condition of the rows after (or, reversed, before) the row with the given ordering values"""
+    lookup = 'lt' if reverse else 'gt'
+    return reduce(or_, [Q(**{field: value for field, value in zip(ordering[:i], values[:i])},
+                          **{f"{ordering[i]}__{lookup}": values[i]}) for i in range(len(ordering))])
+
+
+# ordering fields whose value of a row changes without the row changing: bm25 ranks depend on the whole index
+_volatile_fields = {'rank'}
+
+
+def _valid_position(values, ordering) -> bool:
+    return isinstance(values, list) and len(values) == len(ordering)
+
+
+def _relocated(ordering) -> bool:
+    """
+    Whether the position of a cursor is read again from its row (by id) rather than taken from the cursor, so a page
+    continues right after that row even when its rank shifted since. A row gone since keeps the cursor's values.
+    """
+    return ordering[-1] == 'id' and bool(_volatile_fields.intersection(ordering))
+
+
+def _keyset(queryset, ordering, values, reverse):
+    if values is not None:
+        queryset = queryset.filter(_after(ordering, values, reverse))
+    return queryset.order_by(*(f"-{field}" if reverse else field for field in ordering))
+
+
+def _page(request, rows, page_size, ordering, values, reverse):
+    """(rows of the page, next link, previous link) from the page_size + 1 rows read after the position"""
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if reverse:
+        rows.reverse()
+
+    def link(row, link_reverse):
+        position = [getattr(row, field) for field in ordering]
+        return replace_query_param(request.build_absolute_uri(), 'cursor', _encode_position(position, link_reverse))
+
+    # more rows ahead: when reading forward the extra row tells, when reading backward the cursor row itself does
+    has_next = has_more if not reverse else values is not None
+    has_previous = values is not None if not reverse else has_more
+    return (rows, link(rows[-1], False) if rows and has_next else None,
+            link(rows[0], True) if rows and has_previous else None)
+
+
+async def apaginate(request, queryset, serializer_class, ordering=('id',)):
+    """
+    Async keyset pagination for the async views, with the response shape of ItemCursorPagination ({next, previous,
+    results}, `?page_size=`, `?cursor=`). Rows are read with the async ORM; `ordering` fields must be ascending and
+    unique together. Ranked cursors are the ones of RankedItemCursorPagination, the others are not interchangeable
+    with the ones of the sync views.
+    """
+    try:
+        page_size = min(int(request.GET.get('page_size', settings.CATALOG_PAGE_SIZE)), settings.CATALOG_MAX_PAGE_SIZE)
+    except ValueError:
+        page_size = settings.CATALOG_PAGE_SIZE
+    page_size = max(page_size, 1)
+    values, reverse = _decode_position(request.GET.get('cursor', ''))
+    if not _valid_position(values, ordering):
+        values, reverse = None, False
+    elif _relocated(ordering):
+        values = list(await queryset.filter(id=values[-1]).values_list(*ordering).afirst() or values)
+    rows = [row async for row in _keyset(queryset, ordering, values, reverse)[:page_size + 1]]
+    rows, next_link, previous_link = _page(request, rows, page_size, ordering, values, reverse)
+    return JsonResponse({
+        'next': next_link,
+        'previous': previous_link,
+        'results': await adata(serializer_class(rows, many=True), rows),
+    })
@@ -39,19 +39,20 @@ class IsDeliveryGuy(BasePermission):
         return bool(request.user and request.user.is_authenticated and request.user.role == UserRoles.DELIVERY_GUY)
 
 
+def is_approved(user, model) -> bool:
+    # CachedTokenAuthentication gives the Technician/DeliveryGuy itself, other authentications a plain RbacUser
+    if hasattr(user, 'is_approved'):
+        return user.is_approved
+    return model.objects.filter(id=user.id, is_approved=True).exists()
+
+
 class IsDeliveryGuyApproved(BasePermission):
     def has_permission(self, request, view):
-        try:
-            user = DeliveryGuy.objects.get(id=request.user.id)
-            return bool(
-                request.user and request.user.is_authenticated and request.user.role == UserRoles.DELIVERY_GUY and user.is_approved)
-        except Exception as err:
-            return False
+        return bool(request.user and request.user.is_authenticated and request.user.role == UserRoles.DELIVERY_GUY
+                    and is_approved(request.user, DeliveryGuy))
+
+
 class IsTechnicianApproved(BasePermission):
     def has_permission(self, request, view):
-        try:
-            user = Technician.objects.get(id=request.user.id)
-            return bool(
-                request.user and request.user.is_authenticated and request.user.role == UserRoles.TECHNICIAN and user.is_approved)
-        except Exception as err:
-            return False
+        return bool(request.user and request.user.is_authenticated and request.user.role == UserRoles.TECHNICIAN
+                    and is_approved(request.user, Technician))
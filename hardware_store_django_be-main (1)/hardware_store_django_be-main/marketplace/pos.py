@@ -0,0 +1,146 @@
+from collections import Counter
+from itertools import islice
+
+from django.db import IntegrityError, transaction
+
+from . import inventory
+from .models import Item, MovementKinds, PosOrder, PosOrderItem
+
+# attempts of a sync batch which lost a race against another writer (stock taken or same key synced meanwhile)
+sync_attempts = 3
+
+
+class InvalidReceipt(Exception):
+    """Raised when the lines of a receipt can't be billed"""
+
+
+def receipt_lines(items) -> Counter:
+    """
+    Validates the `items` of a billing request, [{'item': <id>, 'quantity': <n>}, ...], and returns the quantity per
+    item id. Lines of the same item are added up.
+    """
+    if not isinstance(items, list) or not items:
+        raise InvalidReceipt('items should be a non empty list')
+    lines = Counter()
+    for line in items:
+        try:
+            item_id, quantity = int(line['item']), int(line['quantity'])
+        except (KeyError, TypeError, ValueError):
+            raise InvalidReceipt(f"Invalid line: {line}")
+        if quantity <= 0:
+            raise InvalidReceipt(f"Item: {item_id} quantity should be positive")
+        lines[item_id] += quantity
+    return lines
+
+
+def check_stock(lines: Counter, items: dict):
+    """Checks the lines against already fetched {item_id: Item} and returns the receipt total"""
+    missing = [item_id for item_id in lines if item_id not in items]
+    if missing:
+        raise InvalidReceipt(f"Item: {', '.join(map(str, missing))} does not exist")
+    for item_id, quantity in lines.items():
+        if inventory.available(items[item_id]) < quantity:
+            raise inventory.OutOfStock([items[item_id]])
+    return sum(items[item_id].price * quantity for item_id, quantity in lines.items())
+
+
+def place_pos_order(lines: Counter, save_order):
+    """
+    Bills the lines in a fixed number of queries, whatever the receipt size: one in_bulk fetch of the items, one
+    conditional stock UPDATE, the order insert (done by `save_order(total)`, which returns the PosOrder) and one bulk
+    insert of the order lines. Stock and order are written in the same transaction.
+    """
+    items = Item.objects.in_bulk(lines)
+    total = check_stock(lines, items)
+    with transaction.atomic():
+        inventory.decrement_stock(lines, kind=MovementKinds.POS_SALE)
+        order = save_order(total)
+        PosOrderItem.objects.bulk_create([PosOrderItem(pos_order=order, item_id=item_id, quantity=quantity)
+                                          for item_id, quantity in lines.items()])
+    return order
+
+
+def _receipt_result(receipt, status, **details):
+    key = receipt.get('key') if isinstance(receipt, dict) else None
+    return {'key': key, 'status': status, **details}
+
+
+def _parse_receipt(receipt):
+    """Returns (key, lines, is_paid) of a queued receipt or raises InvalidReceipt"""
+    if not isinstance(receipt, dict):
+        raise InvalidReceipt('receipt should be an object')
+    key = receipt.get('key')
+    if not isinstance(key, str) or not key or len(key) > PosOrder._meta.get_field('client_key').max_length:
+        raise InvalidReceipt('key should be a non empty string of at most 64 characters')
+    return key, receipt_lines(receipt.get('items')), bool(receipt.get('is_paid', True))
+
+
+def _apply_batch(receipts, cashier_id):
+    results = [None] * len(receipts)
+    parsed = {}
+    for index, receipt in enumerate(receipts):
+        try:
+            parsed[index] = _parse_receipt(receipt)
+        except InvalidReceipt as error:
+            results[index] = _receipt_result(receipt, 'rejected', errors=str(error))
+
+    synced = dict(PosOrder.objects.filter(client_key__in=[key for key, _, _ in parsed.values()])
+                  .values_list('client_key', 'id'))
+    items = Item.objects.in_bulk({item_id for _, lines, _ in parsed.values() for item_id in lines})
+    stock = {item_id: inventory.available(item) for item_id, item in items.items()}
+
+    accepted, sold = [], Counter()
+    for index, (key, lines, is_paid) in parsed.items():
+        receipt = receipts[index]
+        if key in synced:
+            results[index] = _receipt_result(receipt, 'duplicate', id=synced[key])
+            continue
+        try:
+            total = check_stock(lines, items)
+            short = [item_id for item_id, quantity in lines.items() if stock[item_id] < quantity]
+            if short:
+                raise inventory.OutOfStock([items[item_id] for item_id in short])
+        except (InvalidReceipt, inventory.OutOfStock) as error:
+            results[index] = _receipt_result(receipt, 'rejected', errors=str(error))
+            continue
+        stock.update({item_id: stock[item_id] - quantity for item_id, quantity in lines.items()})
+        sold.update(lines)
+        # a key repeated in the same batch is a duplicate of its first receipt
+        synced[key] = None
+        accepted.append((index, PosOrder(cashier_id=cashier_id, total=total, is_paid=is_paid, client_key=key), lines))
+
+    with transaction.atomic():
+        # one stock UPDATE for the whole batch, with the quantities of all receipts added up per item
+        inventory.decrement_stock(sold, kind=MovementKinds.POS_SALE)
+        orders = PosOrder.objects.bulk_create([order for _, order, _ in accepted])
+        PosOrderItem.objects.bulk_create([PosOrderItem(pos_order=order, item_id=item_id, quantity=quantity)
+                                          for order, (_, _, lines) in zip(orders, accepted)
+                                          for item_id, quantity in lines.items()])
+
+    for order, (index, _, _) in zip(orders, accepted):
+        results[index] = _receipt_result(receipts[index], 'created', id=order.id)
+    ids = {order.client_key: order.id for order in orders}
+    for index, result in enumerate(results):
+        if result['status'] == 'duplicate' and result['id'] is None:
+            result['id'] = ids[result['key']]
+    return results
+
+
+def sync_receipts(receipts, cashier_id, batch_size):
+    """
+    Applies receipts queued by an offline terminal, [{'key': <idempotency key>, 'items': [...], 'is_paid': ...}, ...],
+    in batched transactions and returns one result per receipt: `created`, `duplicate` (key already synced, nothing is
+    charged again) or `rejected`. Receipts are applied in order, so a receipt is rejected when the ones before it
+    used up the stock. `receipts` may be any iterable, it is consumed one batch at a time.
+    """
+    receipts = iter(receipts)
+    results = []
+    while batch := list(islice(receipts, batch_size)):
+        for attempt in range(sync_attempts):
+            try:
+                results.extend(_apply_batch(batch, cashier_id))
+                break
+            except (inventory.OutOfStock, IntegrityError):
+                if attempt == sync_attempts - 1:
+                    raise
+    return results
@@ -0,0 +1,25 @@
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import Order, StockShard, TechnicianBooking
+
+
+def order_list():
+    """Orders with the customer (and its RbacUser parent row) and address joined in, as read by OrderSerializer"""
+    return Order.objects.select_related('customer__address')
+
+
+def booking_list():
+    """
+    Bookings with everything TechnicianBookingSerializer reads joined in: the customer with its address and the
+    technician, each along with its RbacUser parent row.
+    """
+    return TechnicianBooking.objects.select_related('customer__address', 'technician')
+
+
+def with_stock(items):
+    """Annotates the items with `stock`: their quantity, or the sum of the shards of the sharded ones"""
+    shards = StockShard.objects.filter(item=OuterRef('pk')).values('item').annotate(total=Sum('quantity')) \
+        .values('total')
+    return items.annotate(stock=Case(When(stock_shards=0, then=F('quantity')),
+                                     default=Coalesce(Subquery(shards), Value(0)), output_field=IntegerField()))
@@ -0,0 +1,149 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import cart_cache, catalog_cache, inventory
+from .models import Item, StockHold
+
+# attempts of an operation which lost a race for the same hold (renewed, swept or taken meanwhile)
+hold_attempts = 3
+
+
+class HoldChanged(Exception):
+    """The hold was changed by someone else between reading and writing it"""
+
+
+def hold(cart_id, item_id, quantity):
+    """Holds `quantity` of the item for the cart line, see hold_lines()"""
+    hold_lines(cart_id, {item_id: quantity})
+
+
+def hold_lines(cart_id, quantities: dict):
+    """
+    Holds {item_id: quantity} for the cart lines (0 releases the hold) and renews every hold of the cart for
+    STOCK_HOLD_TTL seconds, in a fixed number of queries whatever the number of lines. The holds are changed first
+    with a compare and set on their quantities, then Item.reserved by the differences. Raises OutOfStock, keeping the
+    previous holds, when the available quantity of an item can't cover its increase.
+    """
+    for attempt in range(hold_attempts):
+        # read outside of the transaction, SQLite can't turn a reading transaction into a writing one under load
+        previous = {item_id: (hold_id, held) for hold_id, item_id, held in StockHold.objects
+                    .filter(cart_id=cart_id, item_id__in=quantities).values_list('id', 'item_id', 'quantity')}
+        try:
+            with transaction.atomic():
+                _set_holds(cart_id, quantities, previous)
+            return
+        except (HoldChanged, IntegrityError):
+            if attempt == hold_attempts - 1:
+                raise
+
+
+def _unchanged(holds):
+    # the holds as read, by id and quantity
+    condition = Q(pk__in=[])
+    for hold_id, held in holds:
+        condition |= Q(id=hold_id, quantity=held)
+    return condition
+
+
+def _set_holds(cart_id, quantities, previous):
+    expires = timezone.now() + timedelta(seconds=settings.STOCK_HOLD_TTL)
+    changes = {item_id: quantity - previous.get(item_id, (None, 0))[1] for item_id, quantity in quantities.items()}
+    released = [previous[item_id] for item_id, quantity in quantities.items()
+                if not quantity and item_id in previous]
+    updated = {item_id: quantity for item_id, quantity in quantities.items()
+               if quantity and item_id in previous and changes[item_id]}
+    if released and StockHold.objects.filter(_unchanged(released)).delete()[0] != len(released):
+        raise HoldChanged()
+    if updated:
+        holds = {previous[item_id][0]: quantity for item_id, quantity in updated.items()}
+        if StockHold.objects.filter(_unchanged(previous[item_id] for item_id in updated)) \
+                .update(quantity=inventory.per_item(holds)) != len(updated):
+            raise HoldChanged()
+    StockHold.objects.bulk_create([StockHold(cart_id=cart_id, item_id=item_id, quantity=quantity, expires=expires)
+                                   for item_id, quantity in quantities.items()
+                                   if quantity and item_id not in previous])
+
+    increases = {item_id: change for item_id, change in changes.items() if change > 0}
+    decreases = {item_id: change for item_id, change in changes.items() if change < 0}
+    increase = inventory.per_item(increases)
+    if increases and Item.objects.filter(id__in=increases, quantity__gte=F('reserved') + increase) \
+            .update(reserved=F('reserved') + increase, updated_at=timezone.now()) != len(increases):
+        items = Item.objects.in_bulk(increases)
+        raise inventory.OutOfStock([item for item_id, item in items.items() if item.available < increases[item_id]]
+                                   or list(items.values()))
+    if decreases:
+        Item.objects.filter(id__in=decreases).update(reserved=F('reserved') + inventory.per_item(decreases),
+                                                     updated_at=timezone.now())
+    StockHold.objects.filter(cart_id=cart_id).update(expires=expires)
+    if increases or decreases:
+        # the catalog and the carts of the items show their reserved stock
+        catalog_cache.invalidate()
+        cart_cache.invalidate_items([*increases, *decreases])
+
+
+def held_quantities(cart_id) -> dict:
+    """{item_id: quantity} held for the cart"""
+    return dict(StockHold.objects.filter(cart_id=cart_id).values_list('item_id', 'quantity'))
+
+
+def _delete_returning(where: str, params):
+    """
+    Deletes the holds matching the WHERE clause and returns the quantity they held per item and their count, in one
+    statement (DELETE ... RETURNING, SQLite 3.35+ and PostgreSQL). A hold deleted by someone else meanwhile is not
+    returned, so it is never released twice.
+    """
+    quote = connection.ops.quote_name
+    table = quote(StockHold._meta.db_table)
+    item, quantity = (quote(StockHold._meta.get_field(name).column) for name in ('item', 'quantity'))
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE {where} RETURNING {item}, {quantity}", params)
+        rows = cursor.fetchall()
+    totals = Counter()
+    for item_id, held in rows:
+        totals[item_id] += held
+    return totals, len(rows)
+
+
+def take_holds(cart_id, item_ids) -> dict:
+    """
+    Deletes the holds of the cart on the items and returns {item_id: quantity} they held, to be released from
+    Item.reserved by the sale in the same transaction (inventory.decrement_stock). One query whatever the cart size.
+    """
+    item_ids = list(item_ids)
+    if not item_ids:
+        return {}
+    quote = connection.ops.quote_name
+    cart, item = (quote(StockHold._meta.get_field(name).column) for name in ('cart', 'item'))
+    totals, _ = _delete_returning(f"{cart} = %s AND {item} IN ({', '.join(['%s'] * len(item_ids))})",
+                                  [cart_id, *item_ids])
+    return dict(totals)
+
+
+def release_expired_holds() -> int:
+    """
+    Releases the holds past their expiry, in chunks of one DELETE of the oldest expired holds and one UPDATE of the
+    reserved counters, and returns the number of released holds.
+    """
+    quote = connection.ops.quote_name
+    table = quote(StockHold._meta.db_table)
+    pk, expires = quote(StockHold._meta.pk.column), quote(StockHold._meta.get_field('expires').column)
+    released = 0
+    for _ in range(settings.JOB_DELETE_MAX_CHUNKS):
+        with transaction.atomic():
+            totals, count = _delete_returning(
+                f"{pk} IN (SELECT {pk} FROM {table} WHERE {expires} < %s ORDER BY {expires} LIMIT %s)",
+                [connection.ops.adapt_datetimefield_value(timezone.now()), settings.JOB_DELETE_CHUNK_SIZE])
+            if totals:
+                Item.objects.filter(id__in=totals).update(reserved=F('reserved') - inventory.per_item(totals),
+                                                          updated_at=timezone.now())
+                catalog_cache.invalidate()
+                cart_cache.invalidate_items(totals)
+        released += count
+        if count < settings.JOB_DELETE_CHUNK_SIZE:
+            break
+    return released
@@ -0,0 +1,78 @@
+import re
+
+from django.db import connection
+from django.db.models import F, Q, FloatField, Value
+
+from .models import Item
+
+index_table = 'marketplace_item_fts'
+
+_token_re = re.compile(r'\w+')
+
+# databases already known to have the index, so the catalog is not introspected on every search
+_indexed_databases = set()
+
+
+def index_available() -> bool:
+    """Returns True if the FTS5 index exists on the current database"""
+    database = str(connection.settings_dict['NAME'])
+    if database in _indexed_databases:
+        return True
+    if connection.vendor == 'sqlite' and index_table in connection.introspection.table_names():
+        _indexed_databases.add(database)
+        return True
+    return False
+
+
+def match_expression(value: str):
+    """
+    Turns free text typed by a user into an FTS5 query where every word is a prefix match, e.g. `cop wi` becomes
+    `"cop"* "wi"*`. Returns None when the text has no searchable words.
+    """
+    tokens = _token_re.findall(value.lower())
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def ranked_items(value: str):
+    """Items matching the value ordered by relevance (best first), each annotated with its `rank`"""
+    expression = match_expression(value)
+    if expression is None:
+        return Item.objects.none().annotate(rank=Value(0.0, output_field=FloatField()))
+    return Item.objects.filter(search_document__document__match=expression) \
+        .annotate(rank=F('search_document__rank'))
+
+
+def matching_items(value: str):
+    """Unranked LIKE based fallback for databases without the FTS5 index"""
+    return Item.objects.filter(Q(name__icontains=value) | Q(description__icontains=value))
+
+
+def index_items(items):
+    """Adds or refreshes the index rows of the given items"""
+    if not index_available():
+        return
+    rows = [(item.id, item.name, item.description) for item in items]
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {index_table} WHERE rowid = %s", [(row[0],) for row in rows])
+        cursor.executemany(f"INSERT INTO {index_table} (rowid, name, description) VALUES (%s, %s, %s)", rows)
+
+
+def unindex_items(item_ids):
+    """Removes the index rows of the given item ids"""
+    if not index_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {index_table} WHERE rowid = %s", [(item_id,) for item_id in item_ids])
+
+
+def rebuild_index() -> int:
+    """Re-creates every index row from the item table in one statement and returns the number of indexed items"""
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {index_table}")
+        cursor.execute(f"INSERT INTO {index_table} (rowid, name, description) "
+                       f"SELECT id, name, description FROM {Item._meta.db_table}")
+        cursor.execute(f"INSERT INTO {index_table} ({index_table}) VALUES ('optimize')")
+        cursor.execute(f"SELECT COUNT(*) FROM {index_table}")
+        return cursor.fetchone()[0]
@@ -1,13 +1,45 @@
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
 from rest_framework import serializers
 
 from authentication.serializers import CustomerSerializer, TechnicianSerializer
+from . import inventory
+from .images import ThumbnailsField
 from .models import Item, Cart, CartItem, TechnicianBooking, Feedback, OrderItem, Order, PosOrder, PosOrderItem
 
 
 class ItemSerializer(serializers.ModelSerializer):
+    thumbnails = ThumbnailsField(source='image')
+
     class Meta:
         model = Item
         fields = "__all__"
+        read_only_fields = ['reserved', 'stock_shards']
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if instance.stock_shards:
+            data['quantity'] = inventory.on_hand(instance)
+        return data
+
+    def update(self, instance, validated_data):
+        # only the sent fields are written, a full save would put back the stock read with the item over the sales
+        # made since (stock is changed by marketplace.inventory)
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        instance.save(update_fields=[*validated_data, 'updated_at'])
+        return instance
+
+
+async def adata(serializer, items):
+    """
+    `serializer.data` for the async views. Sharded `items` read their stock from their shards with the sync ORM, the
+    serializer is then run on a thread.
+    """
+    if any(item.stock_shards for item in items):
+        return await sync_to_async(lambda: serializer.data)()
+    return serializer.data
 
 
 class CartItemSerializer(serializers.ModelSerializer):
@@ -20,10 +52,15 @@ class CartItemSerializer(serializers.ModelSerializer):
 
 class CartSerializer(serializers.ModelSerializer):
     items = CartItemSerializer(read_only=True, many=True)
+    subtotal = serializers.SerializerMethodField()
 
     class Meta:
         model = Cart
-        fields = ['id', 'customer', 'items']
+        fields = ['id', 'customer', 'items', 'subtotal']
+
+    def get_subtotal(self, instance):
+        # from the lines serialized with it, prefetch them with their items
+        return str(sum((line.item.price * line.quantity for line in instance.items.all()), Decimal('0.00')))
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
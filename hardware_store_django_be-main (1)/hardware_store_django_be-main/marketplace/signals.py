@@ -0,0 +1,136 @@
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import cart_cache, catalog_cache, events, search
+from .images import schedule_derivatives, delete_derivatives
+from .models import Item, Cart, Technician, DeliveryGuy, Order, TechnicianBooking
+from .suggest import name_index
+
+
+# the item fields of the search and suggest indexes
+indexed_fields = {'name', 'description'}
+
+
+@receiver(post_save, sender=Item)
+def index_saved_item(sender, instance, update_fields=None, **kwargs):
+    catalog_cache.invalidate()
+    cart_cache.invalidate_items([instance.id])
+    if kwargs['created'] or instance._image_uploading:
+        schedule_derivatives(instance.image)
+    if update_fields is not None and not indexed_fields & set(update_fields):
+        # e.g. stock updates of the quantity or reserved count, the indexed text is unchanged
+        return
+    search.index_items([instance])
+    transaction.on_commit(lambda: name_index.update(instance))
+
+
+@receiver(pre_delete, sender=Item)
+def drop_carts_of_deleted_item(sender, instance, **kwargs):
+    # before the cart lines of the item are deleted with it
+    cart_cache.invalidate_items([instance.id])
+
+
+@receiver(post_delete, sender=Item)
+def unindex_deleted_item(sender, instance, **kwargs):
+    item_id = instance.id
+    search.unindex_items([item_id])
+    catalog_cache.invalidate()
+    transaction.on_commit(lambda: name_index.remove(item_id))
+
+
+@receiver(post_save, sender=Cart)
+@receiver(post_delete, sender=Cart)
+def drop_cached_cart(sender, instance, created=False, **kwargs):
+    # a new cart also drops what was cached for a reused customer id, cart lines are dropped by their writers
+    if created or kwargs['signal'] is post_delete:
+        cart_cache.invalidate_customers([instance.customer_id])
+
+
+@receiver(post_save, sender=Technician)
+@receiver(post_save, sender=DeliveryGuy)
+def create_nic_image_derivatives(sender, instance, **kwargs):
+    # not on every save of the user, e.g. approvals or a new current delivery
+    if kwargs['created'] or instance._image_uploading:
+        schedule_derivatives(instance.nic_image)
+
+
+# image fields whose files are released from the storage when the row lets go of them
+image_fields = {Item: 'image', Technician: 'nic_image', DeliveryGuy: 'nic_image'}
+
+
+def release_file(storage, name):
+    # only reference counted files are removed, other names may be shared by rows from before the counting
+    if not getattr(storage, 'is_content_addressed', lambda _: False)(name):
+        return
+    storage.delete(name)
+
+    def delete_unused_derivatives():
+        # after the file, which is only deleted once the release commits
+        if not storage.exists(name):
+            delete_derivatives(name)
+
+    transaction.on_commit(delete_unused_derivatives)
+
+
+@receiver(pre_save, sender=Item)
+@receiver(pre_save, sender=Technician)
+@receiver(pre_save, sender=DeliveryGuy)
+def remember_previous_image(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and image_fields[sender] not in update_fields:
+        instance._image_uploading, instance._previous_image = False, None
+        return
+    field_file = getattr(instance, image_fields[sender])
+    # uncommitted files are new uploads, they are stored (and counted) by the field when the row is saved
+    instance._image_uploading = bool(field_file) and not field_file._committed
+    instance._previous_image = None
+    if instance.pk is not None and not kwargs.get('raw'):
+        instance._previous_image = sender.objects.filter(pk=instance.pk) \
+            .values_list(image_fields[sender], flat=True).first()
+
+
+@receiver(post_save, sender=Item)
+@receiver(post_save, sender=Technician)
+@receiver(post_save, sender=DeliveryGuy)
+def release_previous_image(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and image_fields[sender] not in update_fields:
+        return
+    field_file = getattr(instance, image_fields[sender])
+    previous, current = getattr(instance, '_previous_image', None), field_file.name
+    if not getattr(instance, '_image_uploading', False) and current and current != previous:
+        # pointed to an already stored file
+        field_file.storage.retain(current)
+    if previous and (previous != current or getattr(instance, '_image_uploading', False)):
+        transaction.on_commit(lambda: release_file(field_file.storage, previous))
+
+
+@receiver(post_delete, sender=Item)
+@receiver(post_delete, sender=Technician)
+@receiver(post_delete, sender=DeliveryGuy)
+def release_deleted_image(sender, instance, **kwargs):
+    field_file = getattr(instance, image_fields[sender])
+    if field_file:
+        name = field_file.name
+        transaction.on_commit(lambda: release_file(field_file.storage, name))
+
+
+@receiver(post_init, sender=Order)
+@receiver(post_init, sender=TechnicianBooking)
+def remember_status(sender, instance, **kwargs):
+    # status as loaded, to tell status changes from other saves
+    instance._saved_status = instance.__dict__.get('status')
+
+
+@receiver(post_save, sender=Order)
+def publish_order_status(sender, instance, created, **kwargs):
+    if created or instance.status != instance._saved_status:
+        events.order_changed(instance.id, instance.status, None if created else instance._saved_status,
+                             instance.customer_id)
+        instance._saved_status = instance.status
+
+
+@receiver(post_save, sender=TechnicianBooking)
+def publish_booking_status(sender, instance, created, **kwargs):
+    if created or instance.status != instance._saved_status:
+        events.booking_changed(instance.id, instance.customer_id, instance.technician_id, instance.status)
+        instance._saved_status = instance.status
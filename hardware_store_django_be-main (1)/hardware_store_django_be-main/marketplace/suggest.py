@@ -0,0 +1,112 @@
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from decimal import Decimal
+
+from django.conf import settings
+
+from .models import Item
+
+_token_re = re.compile(r'\w+')
+
+
+def normalize(value: str) -> str:
+    """Lower cases the value and strips accents, so `Café` and `cafe` suggest the same items"""
+    decomposed = unicodedata.normalize('NFKD', value.casefold())
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def tokenize(value: str):
+    return _token_re.findall(normalize(value))
+
+
+class ItemNameIndex:
+    """
+    Per-process prefix index over the words of item names, a sorted list of (token, item_id) pairs searched with
+    bisect. It is loaded from the item table on first use, kept up to date by Item signals of this process and
+    reloaded after SUGGEST_INDEX_TTL seconds to pick up changes made by other processes.
+    """
+
+    def __init__(self, ttl=None, max_scan=None):
+        self.ttl = settings.SUGGEST_INDEX_TTL if ttl is None else ttl
+        self.max_scan = settings.SUGGEST_MAX_SCAN if max_scan is None else max_scan
+        self._lock = threading.Lock()
+        self._entries = []
+        self._items = {}  # item_id -> (name, normalized name, price)
+        self._loaded_at = None
+
+    def _load(self):
+        entries, items = [], {}
+        for item_id, name, price in Item.objects.values_list('id', 'name', 'price').iterator(chunk_size=5000):
+            items[item_id] = (name, normalize(name), price)
+            entries.extend((token, item_id) for token in set(tokenize(name)))
+        entries.sort()
+        self._entries, self._items, self._loaded_at = entries, items, time.monotonic()
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            self._load()
+
+    def _discard(self, item_id):
+        entry = self._items.pop(item_id, None)
+        if entry is None:
+            return
+        for token in set(tokenize(entry[0])):
+            position = bisect_left(self._entries, (token, item_id))
+            if position < len(self._entries) and self._entries[position] == (token, item_id):
+                del self._entries[position]
+
+    def update(self, item):
+        """Adds the item or replaces its previous name and price"""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            self._discard(item.id)
+            price = Decimal(item.price).quantize(Decimal('0.01'))
+            self._items[item.id] = (item.name, normalize(item.name), price)
+            for token in set(tokenize(item.name)):
+                insort(self._entries, (token, item.id))
+
+    def remove(self, item_id):
+        with self._lock:
+            if self._loaded_at is not None:
+                self._discard(item_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries, self._items, self._loaded_at = [], {}, None
+
+    def suggest(self, value: str, limit: int):
+        """
+        Items whose name has a word starting with every word of the value. Names starting with the whole value come
+        first, then shorter names. Only the first SUGGEST_MAX_SCAN index entries of the longest word are considered.
+        """
+        tokens = tokenize(value)
+        if not tokens:
+            return []
+        query = ' '.join(tokens)
+        with self._lock:
+            self._ensure_loaded()
+            # the longest word is usually the most selective one to scan
+            probe = max(tokens, key=len)
+            start = bisect_left(self._entries, (probe,))
+            candidates = set()
+            for position in range(start, min(start + self.max_scan, len(self._entries))):
+                token, item_id = self._entries[position]
+                if not token.startswith(probe):
+                    break
+                candidates.add(item_id)
+            matches = []
+            for item_id in candidates:
+                name, normalized, price = self._items[item_id]
+                words = tokenize(normalized)
+                if all(any(word.startswith(token) for word in words) for token in tokens):
+                    matches.append((not normalized.startswith(query), len(name), name, item_id, price))
+        return [{'id': item_id, 'name': name, 'price': str(price)}
+                for _, _, name, item_id, price in heapq.nsmallest(limit, matches)]
+
+
+name_index = ItemNameIndex()
@@ -1,3 +1,1180 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from authentication.backends import CachedTokenAuthentication
+from devapp import dataset
+from helpers.functions import clean_older_technician_bookings
+from helpers.lru import LRUCache
+from helpers.scheduler import Job, Lease, jobs
+
+from . import cart_cache, catalog_cache, dispatch, events, inventory, ledger, reservations, search
+from .images import delete_derivatives, derivative_name, derivative_names
+from .suggest import name_index
+from .models import Item, Cart, CartItem, Customer, Order, OrderItem, Cashier, PosOrder, Address, Technician, \
+    DeliveryGuy, RbacUser, TechnicianBooking, UserRoles, OrderStates, StockHold, StockMovement, StockSnapshot, \
+    MovementKinds, StoredFile, ItemSearchDocument, JobLease
+
+
+def create_user_token(model, username, **fields):
+    # clients authenticate with tokens, an unusable password skips the slow password hashing
+    user = model.objects.create_user(username, f"{username}@shop.aa", None, **fields)
+    token = Token.objects.create(user=user)
+    return user, token.key
+
+
+def create_user(model, username, **fields):
+    user, key = create_user_token(model, username, **fields)
+    # the claims are cached by the first request, warmed here so that query counts only show the views
+    CachedTokenAuthentication().authenticate_credentials(key)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Token {key}")
+    return user, client
+
+
+def create_customer(username):
+    return create_user(Customer, username)
+
+
+def fill_cart(customer, quantities):
+    cart, _ = Cart.objects.get_or_create(customer=customer)
+    for item, quantity in quantities.items():
+        cart.items.create(item=item, quantity=quantity)
+    return cart
+
+
+def create_items(count, quantity=10, price='10.00'):
+    return [Item.objects.create(name=f"item {i}", description='test', price=Decimal(price), quantity=quantity)
+            for i in range(count)]
+
+
+class PaymentTests(TestCase):
+
+    def test_places_order_and_takes_stock(self):
+        customer, client = create_customer('buyer')
+        first, second = create_items(2)
+        fill_cart(customer, {first: 2, second: 3})
+
+        response = client.post('/cart/payment/')
+
+        self.assertEqual(response.status_code, 200)
+        order = Order.objects.get(customer=customer)
+        self.assertEqual(order.total, Decimal('50.00'))
+        self.assertEqual(sorted(order.items.values_list('quantity', flat=True)), [2, 3])
+        self.assertEqual([item.quantity for item in Item.objects.order_by('id')], [8, 7])
+        self.assertFalse(Cart.objects.filter(customer=customer).exists())
+
+    def test_rejects_whole_order_when_a_line_is_short(self):
+        customer, client = create_customer('buyer')
+        first, second = create_items(2, quantity=2)
+        fill_cart(customer, {first: 1, second: 3})
+
+        response = client.post('/cart/payment/')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual([item.quantity for item in Item.objects.order_by('id')], [2, 2])
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        counts = []
+        for size in (1, 20):
+            customer, client = create_customer(f"buyer{size}")
+            fill_cart(customer, {item: 1 for item in create_items(size)})
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(client.post('/cart/payment/').status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+def png(color):
+    output = io.BytesIO()
+    Image.new('RGB', (8, 8), color).save(output, format='PNG')
+    return output.getvalue()
+
+
+class ContentAddressedStorageTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name, IMAGE_DERIVATIVES_ASYNC=False))
+
+    def create_item(self, content, name):
+        # the previous files are released and the derivatives written after commit
+        with self.captureOnCommitCallbacks(execute=True):
+            return Item.objects.create(name='drill', description='test', price=Decimal('10.00'),
+                                       image=ContentFile(content, name=name))
+
+    def test_equal_uploads_share_one_file(self):
+        first = self.create_item(png('red'), 'first.png')
+        second = self.create_item(png('red'), 'second.png')
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(default_storage.is_content_addressed(first.image.name))
+        self.assertEqual(StoredFile.objects.get().references, 2)
+        self.assertEqual(len(os.listdir(os.path.dirname(first.image.path))), 1)
+
+    def test_file_is_removed_with_its_last_reference(self):
+        first = self.create_item(png('red'), 'first.png')
+        second = self.create_item(png('red'), 'second.png')
+        third = self.create_item(png('red'), 'third.png')
+        name = first.image.name
+        self.assertTrue(all(default_storage.exists(derivative) for derivative in derivative_names(name)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.image = ContentFile(png('blue'), name='replaced.png')
+            first.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertEqual(StoredFile.objects.get(name=name).references, 1)
+        self.assertTrue(default_storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            third.delete()
+        self.assertFalse(StoredFile.objects.filter(name=name).exists())
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(any(default_storage.exists(derivative) for derivative in derivative_names(name)))
+        self.assertTrue(default_storage.exists(first.image.name))
+
+    def test_file_is_deleted_after_commit_unless_referenced_again(self):
+        name = default_storage.save('images/first.png', ContentFile(png('red')))
+        with self.captureOnCommitCallbacks() as callbacks:
+            default_storage.delete(name)
+            self.assertTrue(default_storage.exists(name))
+            # uploaded again before the delete commits
+            self.assertEqual(default_storage.save('images/second.png', ContentFile(png('red'))), name)
+        for callback in callbacks:
+            callback()
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(StoredFile.objects.get(name=name).references, 1)
+
+        # a rolled back release keeps the file and its reference
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(RuntimeError), transaction.atomic():
+            default_storage.delete(name)
+            raise RuntimeError()
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(StoredFile.objects.get(name=name).references, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            default_storage.delete(name)
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(StoredFile.objects.exists())
+
+    def test_deduplicate_media_counts_the_rows_of_each_file(self):
+        # uploads from before the storage, under their own names
+        legacy = FileSystemStorage()
+        red = [legacy.save('images/red.png', ContentFile(png('red'))),
+               legacy.save('images/red_copy.png', ContentFile(png('red')))]
+        blue = legacy.save('images/blue.png', ContentFile(png('blue')))
+        for name in [red[0], red[0], red[1], blue]:
+            Item.objects.create(name='drill', description='test', price=Decimal('10.00'), image=name)
+
+        call_command('deduplicate_media', stdout=io.StringIO())
+
+        rows = {}
+        for name in Item.objects.values_list('image', flat=True):
+            rows[name] = rows.get(name, 0) + 1
+        self.assertEqual(sorted(rows.values()), [1, 3])
+        self.assertEqual(dict(StoredFile.objects.values_list('name', 'references')), rows)
+        self.assertFalse(any(legacy.exists(name) for name in [*red, blue]))
+        self.assertTrue(all(default_storage.exists(name) for name in rows))
+
+
+class ImageDerivativeTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name, IMAGE_DERIVATIVES_ASYNC=False))
+
+    def picture(self, name):
+        output = io.BytesIO()
+        Image.new('RGBA', (1200, 800), (200, 40, 40, 128)).save(output, format='PNG')
+        return ContentFile(output.getvalue(), name=name)
+
+    def assertDerivatives(self, name):
+        for width in settings.IMAGE_DERIVATIVE_WIDTHS:
+            for image_format in settings.IMAGE_DERIVATIVE_FORMATS:
+                with default_storage.open(derivative_name(name, width, image_format), 'rb') as file:
+                    derivative = Image.open(file)
+                    self.assertEqual(derivative.format, image_format.upper())
+                    self.assertEqual(derivative.size, (width, width * 2 // 3))
+
+    def test_item_images(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            item = Item.objects.create(name='drill', description='test', price=Decimal('10.00'),
+                                       image=self.picture('drill.png'))
+        self.assertDerivatives(item.image.name)
+
+    def test_nic_images(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            technician, _ = create_user_token(Technician, 'mason', nic_no='1', nic_image=self.picture('nic.png'),
+                                              rate_per_hour=10, skill_category='mason')
+            driver, _ = create_user_token(DeliveryGuy, 'driver', nic_no='2', nic_image=self.picture('nic.png'),
+                                          vehicle_type='bike')
+        self.assertDerivatives(technician.nic_image.name)
+        self.assertDerivatives(driver.nic_image.name)
+
+        # an approval doesn't upload a new picture
+        with self.captureOnCommitCallbacks(execute=True):
+            delete_derivatives(driver.nic_image.name)
+            driver.is_approved = True
+            driver.save()
+        self.assertFalse(any(default_storage.exists(name) for name in derivative_names(driver.nic_image.name)))
+
+
+class CartTests(TestCase):
+
+    def test_removes_the_item_from_own_cart_only(self):
+        customer, client = create_customer('buyer')
+        other, _ = create_customer('other')
+        item, = create_items(1)
+        fill_cart(customer, {item: 2})
+        fill_cart(other, {item: 1})
+
+        self.assertEqual(client.delete(f'/cart/item/{item.id}').status_code, 200)
+        self.assertEqual(client.delete(f'/cart/item/{item.id}').status_code, 200)
+        self.assertFalse(CartItem.objects.filter(cart__customer=customer).exists())
+        self.assertEqual(CartItem.objects.get(cart__customer=other).quantity, 1)
+
+
+class CartPatchTests(TestCase):
+
+    def test_sets_quantities_and_returns_the_cart(self):
+        customer, client = create_customer('buyer')
+        first, second, third = create_items(3)
+        fill_cart(customer, {first: 1, second: 1})
+        reservations.hold_lines(Cart.objects.get(customer=customer).id, {first.id: 1, second.id: 1})
+
+        response = client.patch('/cart/', {'items': [{'item': first.id, 'quantity': 4}, {'item': second.id,
+                                                                                         'quantity': 0},
+                                                     {'item': third.id, 'quantity': 2}]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({line['item']['id']: line['quantity'] for line in response.data['items']},
+                         {first.id: 4, third.id: 2})
+        self.assertEqual(dict(StockHold.objects.values_list('item_id', 'quantity')), {first.id: 4, third.id: 2})
+        self.assertEqual([item.reserved for item in Item.objects.order_by('id')], [4, 0, 2])
+
+    def test_rejects_the_whole_patch_when_an_item_is_short(self):
+        customer, client = create_customer('buyer')
+        first, second = create_items(2, quantity=3)
+
+        response = client.patch('/cart/', {'items': [{'item': first.id, 'quantity': 2},
+                                                     {'item': second.id, 'quantity': 5}]}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CartItem.objects.exists() or StockHold.objects.exists())
+        self.assertEqual(client.patch('/cart/', {'items': [{'item': 0, 'quantity': 1}]}, format='json').status_code,
+                         400)
+
+    def test_query_count_does_not_grow_with_the_changes(self):
+        items = create_items(20)
+
+        def patch(username, count):
+            customer, client = create_customer(username)
+            fill_cart(customer, {items[0]: 1})
+            with CaptureQueriesContext(connection) as queries:
+                response = client.patch('/cart/', {'items': [{'item': item.id, 'quantity': 2}
+                                                             for item in items[:count]]}, format='json')
+            self.assertEqual(response.status_code, 200)
+            return len(queries)
+
+        self.assertEqual(patch('few', 2), patch('many', 20))
+
+
+class CartCacheTests(TestCase):
+
+    def test_warm_cart_costs_no_query(self):
+        customer, client = create_customer('buyer')
+        first, second = create_items(2)
+        self.assertEqual(client.post(f'/cart/item/{first.id}').status_code, 200)
+        self.assertEqual(client.patch('/cart/', {'items': [{'item': second.id, 'quantity': 2}]},
+                                      format='json').status_code, 200)
+        self.assertEqual(client.get('/cart/').json()['subtotal'], '30.00')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/cart/')
+        self.assertEqual(len(queries), 0)
+        self.assertEqual({line['item']['id']: line['quantity'] for line in response.json()['items']},
+                         {first.id: 1, second.id: 2})
+        self.assertEqual(cart_cache.subtotal(customer.id), Decimal('30.00'))
+
+    def test_changes_of_contained_items_drop_the_cart(self):
+        customer, client = create_customer('buyer')
+        _, admin = create_user(RbacUser, 'admin', role=UserRoles.ADMIN)
+        other, other_client = create_customer('other')
+        item, = create_items(1)
+        self.assertEqual(client.post(f'/cart/item/{item.id}').status_code, 200)
+        self.assertEqual(client.get('/cart/').json()['subtotal'], '10.00')
+
+        self.assertEqual(admin.put(f'/admin_area/items/{item.id}', {'name': 'item 0', 'description': 'test',
+                                                                  'price': '12.50', 'quantity': 10}).status_code, 200)
+        self.assertEqual(client.get('/cart/').json()['subtotal'], '12.50')
+
+        # a sale to someone else changes the stock shown in the cart
+        self.assertEqual(other_client.post(f'/cart/item/{item.id}').status_code, 200)
+        self.assertEqual(other_client.post('/cart/payment/').status_code, 200)
+        self.assertEqual(client.get('/cart/').json()['items'][0]['item']['quantity'], 9)
+        self.assertEqual(other_client.get('/cart/').json()['items'], [])
+
+
+class CatalogCacheTests(TestCase):
+
+    def prices(self):
+        return {item['id']: item['price'] for item in self.client.get('/items/').json()['results']}
+
+    def test_repeated_pages_cost_no_query(self):
+        create_items(3)
+        for path in ['/items/', '/items/?page_size=2', '/items/search/*']:
+            first = self.client.get(path)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(path)
+            self.assertEqual(len(queries), 0, path)
+            self.assertEqual(response.content, first.content)
+            if 'ETag' in first:
+                with CaptureQueriesContext(connection) as queries:
+                    self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+                self.assertEqual(len(queries), 0)
+
+    def test_admin_changes_serve_fresh_pages(self):
+        _, admin = create_user(RbacUser, 'admin', role=UserRoles.ADMIN)
+        item, other = create_items(2)
+        self.assertEqual(self.prices(), {item.id: '10.00', other.id: '10.00'})
+
+        version = catalog_cache.current_version()
+        self.assertEqual(admin.put(f'/admin_area/items/{item.id}', {'name': 'item 0', 'description': 'test',
+                                                                  'price': '12.50', 'quantity': 10}).status_code, 200)
+        self.assertNotEqual(catalog_cache.current_version(), version)
+        self.assertEqual(self.prices(), {item.id: '12.50', other.id: '10.00'})
+
+        version = catalog_cache.current_version()
+        self.assertEqual(admin.delete(f'/admin_area/items/{other.id}').status_code, 204)
+        self.assertNotEqual(catalog_cache.current_version(), version)
+        self.assertEqual(self.prices(), {item.id: '12.50'})
+        self.assertEqual([row['id'] for row in self.client.get('/items/search/*').json()['results']], [item.id])
+
+    def test_sales_serve_fresh_stock(self):
+        customer, client = create_customer('buyer')
+        _, cashier = create_user(Cashier, 'cashier')
+        item, = create_items(1)
+        fill_cart(customer, {item: 2})
+        for sell in [lambda: client.post('/cart/payment/'),
+                     lambda: cashier.post('/cashier/pos_orders/', {'items': [{'item': item.id, 'quantity': 3}]},
+                                          format='json')]:
+            stock = self.client.get('/items/').json()['results'][0]['quantity']
+            version = catalog_cache.current_version()
+            self.assertEqual(sell().status_code, 200)
+            self.assertNotEqual(catalog_cache.current_version(), version)
+            self.assertLess(self.client.get('/items/').json()['results'][0]['quantity'], stock)
+        self.assertEqual(self.client.get('/items/').json()['results'][0]['quantity'], 5)
+
+    def test_pages_are_evicted_past_the_memory_bound(self):
+        create_items(3)
+        size = len(self.client.get('/items/').content)
+        with mock.patch.object(catalog_cache, 'pages', LRUCache(size + size // 2)):
+            self.client.get('/items/')
+            self.client.get('/items/?page_size=2')
+            self.assertEqual(catalog_cache.pages.stats()['evictions'], 1)
+            self.assertEqual(catalog_cache.pages.stats()['entries'], 1)
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get('/items/')
+            self.assertGreater(len(queries), 0)
+
+    def test_stats_count_hits_and_misses(self):
+        _, admin = create_user(RbacUser, 'admin', role=UserRoles.ADMIN)
+        create_items(1)
+        before = admin.get('/admin_area/catalog_cache/').json()
+        self.client.get('/items/?page_size=7')
+        self.client.get('/items/?page_size=7')
+        self.client.get('/items/?page_size=7')
+        after = admin.get('/admin_area/catalog_cache/').json()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 2)
+        self.assertEqual(after['version'], catalog_cache.current_version())
+        self.assertEqual(self.client.get('/items/search/%20').status_code, 200)
+        self.assertEqual(admin.get('/admin_area/catalog_cache/').json()['misses'] - after['misses'], 1)
+
+
+class StockHoldTests(TestCase):
+
+    def test_holds_change_the_catalog_etag(self):
+        customer, client = create_customer('buyer')
+        item, = create_items(1)
+        etag = APIClient().get('/items/')['ETag']
+        self.assertEqual(APIClient().get('/items/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.assertEqual(client.post(f'/cart/item/{item.id}').status_code, 200)
+        response = APIClient().get('/items/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['reserved'], 1)
+
+        reservations.release_expired_holds()
+        self.assertEqual(APIClient().get('/items/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        StockHold.objects.update(expires=timezone.now() - timedelta(seconds=1))
+        reservations.release_expired_holds()
+        response = APIClient().get('/items/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['reserved'], 0)
+
+    def test_holds_changing_on_every_attempt_give_a_conflict(self):
+        customer, client = create_customer('buyer')
+        item, = create_items(1, quantity=5)
+        self.assertEqual(client.post(f'/cart/item/{item.id}').status_code, 200)
+
+        with mock.patch.object(reservations, '_set_holds', side_effect=reservations.HoldChanged) as set_holds:
+            self.assertEqual(client.post(f'/cart/item/{item.id}').status_code, 409)
+            self.assertEqual(client.delete(f'/cart/item/{item.id}').status_code, 409)
+            response = client.patch('/cart/', {'items': [{'item': item.id, 'quantity': 3}]}, format='json')
+            self.assertEqual(response.status_code, 409)
+            self.assertIn('errors', response.json())
+        self.assertEqual(set_holds.call_count, 3 * reservations.hold_attempts)
+        # the cart lines were rolled back with the holds
+        self.assertEqual(CartItem.objects.get().quantity, 1)
+        self.assertEqual(Item.objects.get().reserved, 1)
+
+    def test_held_stock_is_not_available_to_other_carts(self):
+        customer, client = create_customer('buyer')
+        other, other_client = create_customer('other')
+        item, = create_items(1, quantity=2)
+
+        self.assertEqual(client.post(f'/cart/item/{item.id}').status_code, 200)
+        self.assertEqual(client.post(f'/cart/item/{item.id}').status_code, 200)
+        self.assertEqual(other_client.post(f'/cart/item/{item.id}').status_code, 400)
+        self.assertEqual(Item.objects.get().reserved, 2)
+
+        self.assertEqual(client.delete(f'/cart/item/{item.id}').status_code, 200)
+        self.assertEqual(other_client.post(f'/cart/item/{item.id}').status_code, 200)
+        self.assertEqual(StockHold.objects.get(cart__customer=customer).quantity, 1)
+        self.assertEqual(StockHold.objects.get(cart__customer=other).quantity, 1)
+
+    def test_checkout_turns_holds_into_the_sale(self):
+        customer, client = create_customer('buyer')
+        item, = create_items(1, quantity=3)
+        client.post(f'/cart/item/{item.id}')
+        client.post(f'/cart/item/{item.id}')
+
+        self.assertEqual(client.post('/cart/payment/').status_code, 200)
+        item.refresh_from_db()
+        self.assertEqual((item.quantity, item.reserved), (1, 0))
+        self.assertFalse(StockHold.objects.exists())
+
+    def test_expired_holds_are_released(self):
+        _, client = create_customer('buyer')
+        first, second = create_items(2)
+        client.post(f'/cart/item/{first.id}')
+        client.post(f'/cart/item/{second.id}')
+        StockHold.objects.filter(item=first).update(expires=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(reservations.release_expired_holds(), 1)
+        self.assertEqual([item.reserved for item in Item.objects.order_by('id')], [0, 1])
+        self.assertEqual(StockHold.objects.get().item_id, second.id)
+
+
+class LedgerTests(TestCase):
+
+    def test_every_stock_change_is_recorded(self):
+        _, admin = create_user(RbacUser, 'admin', role=UserRoles.ADMIN)
+        customer, client = create_customer('buyer')
+        _, cashier = create_user(Cashier, 'cashier')
+        response = admin.post('/admin_area/items/', {'name': 'drill', 'description': 'test', 'price': '10.00',
+                                                     'quantity': 10})
+        item_id = response.data['id']
+
+        client.post(f'/cart/item/{item_id}')
+        client.post(f'/cart/item/{item_id}')
+        self.assertEqual(client.post('/cart/payment/').status_code, 200)
+        cashier.post('/cashier/pos_orders/', {'items': [{'item': item_id, 'quantity': 1}]}, format='json')
+        response = admin.put(f'/admin_area/items/{item_id}', {'name': 'drill', 'description': 'test',
+                                                              'price': '12.00', 'quantity': 20, 'reserved': 5})
+
+        self.assertEqual((response.data['quantity'], response.data['reserved']), (20, 0))
+        self.assertEqual(list(StockMovement.objects.order_by('id').values_list('kind', 'change')),
+                         [('RESTOCK', 10), ('SALE', -2), ('POS_SALE', -1), ('RESTOCK', 13)])
+        self.assertEqual(list(ledger.mismatches()), [])
+
+    def test_stock_is_rebuilt_from_snapshot_and_later_movements(self):
+        item, = create_items(1, quantity=0)
+        for change in [10, 5, -3]:
+            inventory.adjust_stock(item.id, change)
+        start = timezone.now() - timedelta(hours=2)
+        for minutes, movement in enumerate(StockMovement.objects.order_by('id')):
+            StockMovement.objects.filter(id=movement.id).update(time=start + timedelta(minutes=minutes))
+
+        self.assertEqual(ledger.take_snapshots(), 1)
+        self.assertEqual(ledger.take_snapshots(), 0)
+        inventory.decrement_stock({item.id: 4})
+
+        self.assertEqual(StockSnapshot.objects.get().quantity, 12)
+        self.assertEqual(ledger.quantity_at(item.id, start + timedelta(seconds=90)), 15)
+        self.assertEqual(ledger.quantity_at(item.id, start + timedelta(hours=1)), 12)
+        self.assertEqual(ledger.quantity_at(item.id, timezone.now()), 8)
+        self.assertEqual(list(ledger.mismatches()), [])
+
+        Item.objects.filter(id=item.id).update(quantity=9)
+        self.assertEqual(list(ledger.mismatches()), [(item.id, 9, 8)])
+        with self.assertRaises(CommandError):
+            call_command('reconcile_stock', stdout=io.StringIO())
+
+
+@override_settings(STOCK_SHARD_CACHE_TTL=0)
+class StockShardTests(TestCase):
+
+    def setUp(self):
+        self.item, = create_items(1, quantity=0)
+        inventory.adjust_stock(self.item.id, 10)
+        inventory.set_stock_shards(self.item.id, 3)
+        self.item.refresh_from_db()
+
+    def test_stock_is_split_and_merged_back(self):
+        self.assertEqual(list(self.item.shards.order_by('index').values_list('quantity', flat=True)), [4, 3, 3])
+        self.assertEqual((self.item.quantity, inventory.on_hand(self.item)), (0, 10))
+        self.assertEqual(self.client.get(f'/items/{self.item.id}').data['quantity'], 10)
+
+        inventory.decrement_stock({self.item.id: 6}, kind=MovementKinds.POS_SALE)
+        with self.assertRaises(inventory.OutOfStock):
+            inventory.decrement_stock({self.item.id: 5})
+        self.assertEqual(inventory.on_hand(self.item), 4)
+        self.assertEqual(list(ledger.mismatches()), [])
+
+        inventory.set_stock_shards(self.item.id, 0)
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.quantity, self.item.stock_shards, self.item.shards.count()), (4, 0, 0))
+        self.assertEqual(list(ledger.mismatches()), [])
+
+    def test_sharded_items_are_sold_without_holds(self):
+        customer, client = create_customer('buyer')
+        other, _ = create_customer('other')
+        fill_cart(other, {self.item: 9})
+        for _ in range(2):
+            self.assertEqual(client.post(f'/cart/item/{self.item.id}').status_code, 200)
+        self.assertFalse(StockHold.objects.exists())
+
+        self.assertEqual(client.post('/cart/payment/').status_code, 200)
+        self.assertEqual(inventory.on_hand(self.item), 8)
+        _, admin = create_user(RbacUser, 'admin', role=UserRoles.ADMIN)
+        self.assertEqual(admin.get('/admin_area/outofstock/').data['results'], [])
+        self.assertEqual([item['quantity'] for item in admin.get('/admin_area/instock/').data['results']], [8])
+
+
+class BillingTests(TestCase):
+
+    def setUp(self):
+        self.cashier, self.client = create_user(Cashier, 'cashier')
+
+    def test_bills_receipt_and_takes_stock(self):
+        first, second = create_items(2)
+        response = self.client.post('/cashier/pos_orders/', {'items': [
+            {'item': first.id, 'quantity': 2}, {'item': second.id, 'quantity': 1}, {'item': first.id, 'quantity': 1}
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        order = PosOrder.objects.get()
+        self.assertEqual(order.total, Decimal('40.00'))
+        self.assertEqual(order.cashier_id, self.cashier.id)
+        self.assertEqual(len(response.data['items']), 2)
+        self.assertEqual([item.quantity for item in Item.objects.order_by('id')], [7, 9])
+
+    def test_rejects_receipt_with_short_line(self):
+        first, second = create_items(2, quantity=1)
+        response = self.client.post('/cashier/pos_orders/', {'items': [
+            {'item': first.id, 'quantity': 1}, {'item': second.id, 'quantity': 2}
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PosOrder.objects.exists())
+        self.assertEqual([item.quantity for item in Item.objects.order_by('id')], [1, 1])
+
+    def test_query_count_does_not_grow_with_receipt_size(self):
+        counts = []
+        for size in (1, 40):
+            receipt = {'items': [{'item': item.id, 'quantity': 1} for item in create_items(size)]}
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.post('/cashier/pos_orders/', receipt, format='json').status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class PosSyncTests(TestCase):
+
+    def setUp(self):
+        self.cashier, self.client = create_user(Cashier, 'cashier')
+
+    def test_replayed_receipts_are_not_charged_twice(self):
+        item = create_items(1, quantity=5)[0]
+        receipts = [{'key': f"till-1-{i}", 'items': [{'item': item.id, 'quantity': 2}]} for i in range(3)]
+        body = '\n'.join(json.dumps(receipt) for receipt in receipts)
+
+        first = self.client.post('/cashier/pos_orders/sync/', body, content_type='application/x-ndjson')
+        replay = self.client.post('/cashier/pos_orders/sync/', receipts, format='json')
+
+        self.assertEqual([result['status'] for result in first.data['results']], ['created', 'created', 'rejected'])
+        self.assertEqual([result['status'] for result in replay.data['results']],
+                         ['duplicate', 'duplicate', 'rejected'])
+        self.assertEqual([result['id'] for result in replay.data['results'][:2]],
+                         [result['id'] for result in first.data['results'][:2]])
+        item.refresh_from_db()
+        self.assertEqual(item.quantity, 1)
+        self.assertEqual(PosOrder.objects.count(), 2)
+
+
+class CursorPaginationTests(TestCase):
+
+    def walk(self, path, insert):
+        """Ids of every page of the path, calling insert() between page fetches"""
+        seen, page = [], self.client.get(path, {'page_size': 2}).json()
+        while True:
+            seen += [item['id'] for item in page['results']]
+            if not page['next']:
+                return seen
+            insert()
+            page = self.client.get(page['next']).json()
+
+    def test_catalog_pages_have_no_duplicates_or_gaps_while_items_are_added(self):
+        items = create_items(5)
+        added = []
+        seen = self.walk('/items/', lambda: added.extend(create_items(1)))
+
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(seen, sorted(item.id for item in items + added))
+        self.assertEqual(self.client.get('/items/', {'page_size': 2, 'count': 'true'}).json()['count'], 5 + len(added))
+
+    def test_ranked_pages_have_no_duplicates_or_gaps_while_items_are_added(self):
+        items = [Item.objects.create(name=f"drill {'bit ' * i}", description='test', price=Decimal('5.00'))
+                 for i in range(5)]
+        # every insert shifts the bm25 ranks of all the matches
+        seen = self.walk('/items/search/drill', lambda: Item.objects.create(name='drill', description='new',
+                                                                             price=Decimal('5.00')))
+
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual([item_id for item_id in seen if item_id <= items[-1].id], [item.id for item in items])
+
+    def test_previous_pages_match_the_pages_read_forward(self):
+        create_items(5)
+        first = self.client.get('/items/', {'page_size': 2}).json()
+        second = self.client.get(first['next']).json()
+        create_items(1)
+        self.assertEqual(self.client.get(second['previous']).json()['results'], first['results'])
+
+
+class SearchTests(TestCase):
+
+    def search(self, value):
+        response = self.client.get(f'/items/search/{value}')
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.json()['results']]
+
+    def test_index_follows_item_changes(self):
+        self.assertTrue(search.index_available())
+        wire = Item.objects.create(name='Copper wire', description='2.5 mm, 100 m roll', price=Decimal('25.00'))
+        Item.objects.create(name='Hammer', description='steel claw', price=Decimal('12.00'))
+        self.assertEqual(self.search('cop'), [wire.id])
+        self.assertEqual(self.search('roll'), [wire.id])
+
+        wire.name = 'Aluminium wire'
+        wire.save()
+        self.assertEqual(self.search('cop'), [])
+        self.assertEqual(self.search('alu wi'), [wire.id])
+
+        # stock saves leave the document as it is
+        wire.name, wire.quantity = 'Brass wire', 5
+        with CaptureQueriesContext(connection) as queries:
+            wire.save(update_fields=['quantity'])
+        self.assertFalse([query for query in queries if search.index_table in query['sql']])
+        self.assertEqual(self.search('alu'), [wire.id])
+        wire.save(update_fields=['name'])
+        self.assertEqual(self.search('brass'), [wire.id])
+
+        wire.delete()
+        self.assertEqual(self.search('alu'), [])
+        self.assertFalse(ItemSearchDocument.objects.filter(item_id=wire.id).exists())
+        self.assertEqual(search.rebuild_index(), 1)
+
+    def test_match_takes_any_user_input(self):
+        wire = Item.objects.create(name='Copper wire', description='"heavy" duty', price=Decimal('25.00'))
+        # FTS5 syntax is searched as plain words, every word being a prefix
+        for value in ['"copper"', '(copper', 'wire*', "cop'; --", '-heavy', 'copper: "wire', '{duty}']:
+            self.assertEqual(self.search(value), [wire.id], value)
+        for value in ['"', '()', '^:', 'copper OR', 'AND']:
+            self.assertEqual(self.search(value), [], value)
+        self.assertEqual(list(ItemSearchDocument.objects.filter(document__match=search.match_expression('Wire"'))
+                              .values_list('item_id', flat=True)), [wire.id])
+        self.assertIsNone(search.match_expression('"()*'))
+
+
+class SuggestTests(TestCase):
+
+    def setUp(self):
+        # the index is kept per process, it's loaded again from this test's items
+        name_index.clear()
+        self.addCleanup(name_index.clear)
+
+    def suggest(self, value):
+        response = self.client.get(f'/items/suggest/{value}')
+        self.assertEqual(response.status_code, 200)
+        return [item['name'] for item in response.json()]
+
+    def test_prefixes_follow_renames(self):
+        Item.objects.create(name='Copper wire', description='test', price=Decimal('25.00'))
+        pipe = Item.objects.create(name='Copper pipe', description='test', price=Decimal('30.00'))
+        self.assertEqual(self.suggest('cop'), ['Copper pipe', 'Copper wire'])
+        self.assertEqual(self.suggest('wi co'), ['Copper wire'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            pipe.name = 'Café pipe'
+            pipe.save()
+        self.assertEqual(self.suggest('cop'), ['Copper wire'])
+        self.assertEqual(self.suggest('cafe'), ['Café pipe'])
+        self.assertEqual(self.suggest('pi'), ['Café pipe'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            pipe.delete()
+        self.assertEqual(self.suggest('caf'), [])
+        self.assertEqual(self.client.get('/items/suggest/cop', {'limit': 'x'}).status_code, 400)
+
+
+class ConditionalGetTests(TestCase):
+
+    def test_unchanged_items_are_not_sent_again(self):
+        item, = create_items(1)
+        for path in ['/items/', f'/items/{item.id}']:
+            etag = self.client.get(path)['ETag']
+            self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+            inventory.adjust_stock(item.id, 1)
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_technicians_are_checked_after_authentication(self):
+        _, client = create_customer('customer')
+        _, cashier = create_user(Cashier, 'cashier')
+        technician = Technician.objects.create_user('technician', nic_no='1', nic_image='nic.png', rate_per_hour=10,
+                                                    skill_category='mason', is_approved=True)
+        for path in ['/technicians/', f'/technicians/{technician.id}']:
+            etag = client.get(path)['ETag']
+            self.assertEqual(APIClient().get(path, HTTP_IF_NONE_MATCH=etag).status_code, 401)
+            self.assertEqual(cashier.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 403)
+            self.assertEqual(client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+            technician.rate_per_hour += 1
+            technician.save()
+            self.assertEqual(client.get(path, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ListQueryCountTests(TestCase):
+    """List endpoints should cost the same number of queries whatever the number of returned rows"""
+
+    def setUp(self):
+        self.admin, self.admin_client = create_user(RbacUser, 'admin', role=UserRoles.ADMIN)
+        self.driver, self.driver_client = create_user(DeliveryGuy, 'driver', nic_no='1', nic_image='nic.png',
+                                                      vehicle_type='bike', is_approved=True)
+        self.technician, self.technician_client = create_user(Technician, 'technician', nic_no='2',
+                                                              nic_image='nic.png', rate_per_hour=10,
+                                                              skill_category='mason', is_approved=True)
+        self.customer_clients = []
+
+    def add_rows(self, count):
+        for _ in range(count):
+            number = len(self.customer_clients)
+            customer, client = create_customer(f"customer{number}")
+            Address.objects.create(customer=customer, address=f"{number} Main street")
+            Order.objects.create(customer=customer, total=10, delivery_fee=1)
+            TechnicianBooking.objects.create(title='fix', job_description='wall', customer=customer,
+                                             technician=self.technician)
+            self.customer_clients.append(client)
+
+    def assertConstantQueries(self, url, client=None):
+        counts = []
+        for rows in (1, 5):
+            self.add_rows(rows)
+            with CaptureQueriesContext(connection) as queries:
+                response = (client or self.customer_clients[0]).get(url)
+            self.assertEqual(response.status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1], f"{url} issues more queries as the number of rows grows")
+
+    def test_admin_orders(self):
+        self.assertConstantQueries('/admin_area/orders/', self.admin_client)
+
+    def test_delivery_guy_orders(self):
+        self.assertConstantQueries('/delivery_guy/deliveries/', self.driver_client)
+
+    def test_technician_requests(self):
+        self.assertConstantQueries('/technician/booking/', self.technician_client)
+
+    def test_customer_bookings(self):
+        self.add_rows(1)
+        customer = Customer.objects.get(username='customer0')
+        technicians = [Technician.objects.create_user(f"technician{i}", nic_no='3', nic_image='nic.png',
+                                                      rate_per_hour=10, skill_category='mason') for i in range(5)]
+        counts = []
+        for technician in technicians:
+            TechnicianBooking.objects.create(title='fix', job_description='roof', customer=customer,
+                                             technician=technician)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.customer_clients[0].get('/booking/').status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(len(set(counts)), 1)
+
+    def test_customer_orders(self):
+        self.add_rows(1)
+        customer = Customer.objects.get(username='customer0')
+        counts = []
+        for _ in range(3):
+            Order.objects.create(customer=customer, total=10, delivery_fee=1)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.customer_clients[0].get('/account/purchased/').status_code, 200)
+            counts.append(len(queries))
+        self.assertEqual(len(set(counts)), 1)
+
+
+class ExpiryJobTests(TestCase):
+
+    @override_settings(JOB_DELETE_CHUNK_SIZE=3, JOB_DELETE_MAX_CHUNKS=2)
+    def test_expired_bookings_are_deleted_in_limited_chunks(self):
+        customer, _ = create_customer('customer')
+        technician, _ = create_user(Technician, 'technician', nic_no='1', nic_image='nic.png', rate_per_hour=10,
+                                    skill_category='mason')
+        bookings = [TechnicianBooking.objects.create(title='fix', job_description='wall', customer=customer,
+                                                     technician=technician) for _ in range(9)]
+        TechnicianBooking.objects.filter(id__in=[booking.id for booking in bookings[:7]]) \
+            .update(created_time=timezone.now() - timedelta(days=2))
+
+        self.assertEqual(clean_older_technician_bookings(), 6)
+        self.assertEqual(clean_older_technician_bookings(), 1)
+        self.assertEqual(clean_older_technician_bookings(), 0)
+        self.assertEqual(TechnicianBooking.objects.count(), 2)
+
+
+class LeaseTests(TestCase):
+
+    def lease(self, owner):
+        lease = Lease('scheduler', 60)
+        lease.owner = owner
+        return lease
+
+    def test_one_holder_at_a_time(self):
+        first, second = self.lease('first'), self.lease('second')
+        self.assertTrue(first.acquire())
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire())
+
+        # not renewed for the ttl
+        JobLease.objects.update(expires=timezone.now() - timedelta(seconds=1))
+        self.assertTrue(second.acquire())
+        self.assertFalse(first.acquire())
+        self.assertEqual(JobLease.objects.get().owner, 'second')
+
+        second.release()
+        self.assertFalse(JobLease.objects.exists())
+        self.assertTrue(first.acquire())
+
+    def test_once_releases_the_lease_after_a_failing_job(self):
+        def fail():
+            raise RuntimeError('broken job')
+
+        # only the failing job, the jobs modules aren't loaded
+        with mock.patch.dict(jobs, {'broken': Job('broken', fail, 60)}, clear=True), \
+                mock.patch('marketplace.management.commands.scheduler.autodiscover_modules'):
+            with self.assertRaises(RuntimeError):
+                call_command('scheduler', once=True, stdout=io.StringIO())
+        self.assertFalse(JobLease.objects.exists())
+
+
+class ConcurrentPaymentTests(TransactionTestCase):
+
+    def test_concurrent_checkouts_do_not_oversell(self, shards=0):
+        stock, buyers = 5, 12
+        item = create_items(1, quantity=stock)[0]
+        if shards:
+            inventory.set_stock_shards(item.id, shards)
+        clients = []
+        for i in range(buyers):
+            customer, client = create_customer(f"buyer{i}")
+            fill_cart(customer, {item: 1})
+            clients.append(client)
+
+        barrier = threading.Barrier(buyers)
+        statuses = []
+
+        def checkout(client):
+            try:
+                barrier.wait()
+                statuses.append(client.post('/cart/payment/').status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(client,)) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        item.refresh_from_db()
+        self.assertEqual(statuses.count(200), stock)
+        self.assertEqual(statuses.count(400), buyers - stock)
+        self.assertEqual(inventory.on_hand(item, cached=False), 0)
+        self.assertEqual(OrderItem.objects.filter(item=item).count(), stock)
+
+    def test_concurrent_checkouts_of_a_sharded_item_do_not_oversell(self):
+        self.test_concurrent_checkouts_do_not_oversell(shards=3)
+
+
+class ConcurrentDispatchTests(TransactionTestCase):
+
+    def test_every_order_is_claimed_by_one_delivery_guy(self):
+        orders, drivers = 6, 10
+        customer, _ = create_customer('customer')
+        order_ids = [Order.objects.create(customer=customer, total=10, delivery_fee=1).id for _ in range(orders)]
+        clients = [create_user(DeliveryGuy, f"driver{i}", nic_no=str(i), vehicle_type='bike', is_approved=True)[1]
+                   for i in range(drivers)]
+
+        barrier = threading.Barrier(drivers)
+        responses = []
+
+        def claim(client):
+            try:
+                barrier.wait()
+                responses.append(client.post('/delivery_guy/claim/'))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=claim, args=(client,)) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        claimed = [response.data['id'] for response in responses if response.status_code == 200]
+        self.assertEqual(sorted(claimed), order_ids)
+        self.assertEqual([response.status_code for response in responses].count(404), drivers - orders)
+        self.assertEqual(sorted(DeliveryGuy.objects.exclude(current_delivery=None)
+                                .values_list('current_delivery_id', flat=True)), order_ids)
+        self.assertFalse(Order.objects.filter(status=OrderStates.PAID).exists())
+
+    def test_claims_oldest_order_first(self):
+        customer, _ = create_customer('customer')
+        first, second = [Order.objects.create(customer=customer, total=10, delivery_fee=1) for _ in range(2)]
+        _, client = create_user(DeliveryGuy, 'driver', nic_no='1', vehicle_type='bike', is_approved=True)
+
+        self.assertEqual(client.post('/delivery_guy/claim/').data['id'], first.id)
+        # one delivery at a time
+        self.assertEqual(client.post('/delivery_guy/claim/').status_code, 400)
+        self.assertEqual(Order.objects.get(id=second.id).status, OrderStates.PAID)
+
+
+class EventStreamTests(TransactionTestCase):
+
+    async def test_order_status_changes_are_pushed_to_the_customer(self):
+        customer, token = await sync_to_async(create_user_token)(Customer, 'customer')
+        response = await self.async_client.get('/events/', {'token': token})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = response.streaming_content
+        self.assertTrue((await anext(events)).startswith(b'retry:'))
+
+        order = await Order.objects.acreate(customer=customer, total=10, delivery_fee=1)
+        self.assertIn(f'"id": {order.id}, "status": "PAID"'.encode(), await anext(events))
+        order.status = OrderStates.DELIVERED
+        await order.asave()
+        self.assertIn(b'"status": "DELIVERED"', await anext(events))
+        await events.aclose()
+
+    async def test_requires_token(self):
+        response = await self.async_client.get('/events/')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_paid_orders_are_pushed_to_every_delivery_guy(self):
+        customer, _ = await sync_to_async(create_user_token)(Customer, 'customer')
+        _, other_token = await sync_to_async(create_user_token)(Customer, 'other')
+        driver, driver_token = await sync_to_async(create_user_token)(DeliveryGuy, 'driver', nic_no='1',
+                                                                      nic_image='nic.png', vehicle_type='bike',
+                                                                      is_approved=True)
+        driver_events = (await self.async_client.get('/events/', {'token': driver_token})).streaming_content
+        other_events = (await self.async_client.get('/events/', {'token': other_token})).streaming_content
+        await anext(driver_events)
+        await anext(other_events)
+
+        order = await Order.objects.acreate(customer=customer, total=10, delivery_fee=1)
+        self.assertIn(f'"id": {order.id}, "status": "PAID"'.encode(), await anext(driver_events))
+        await sync_to_async(dispatch.take_order)(driver.id, order.id)
+        self.assertIn(b'"status": "AWAITING_DELIVERY"', await anext(driver_events))
+        order = await Order.objects.aget(id=order.id)
+        order.status = OrderStates.DELIVERED
+        await order.asave()
+        self.assertIn(b'"status": "DELIVERED"', await anext(driver_events))
+        # other customers only get heartbeats
+        with override_settings(EVENTS_HEARTBEAT=0.01):
+            self.assertEqual(await anext(other_events), b': heartbeat\n\n')
+        await driver_events.aclose()
+        await other_events.aclose()
+
+    async def test_slow_subscribers_are_told_to_reload(self):
+        with override_settings(EVENTS_MAX_QUEUED=1):
+            subscription = events.broker.subscribe(['test'])
+        events.broker.publish(['test'], 'order', {'id': 1})
+        events.broker.publish(['test'], 'order', {'id': 2})
+        # published events are handed to the subscriber's loop
+        await asyncio.sleep(0)
+        self.assertTrue(subscription.overflowed)
+        self.assertEqual((await subscription.get(1))['data'], {'id': 1})
+
+        subscription.close()
+        events.broker.publish(['test'], 'order', {'id': 3})
+        self.assertIsNone(await subscription.get(0.01))
+
+    def test_needs_the_asgi_application(self):
+        self.assertEqual(self.client.get('/events/').status_code, 501)
+
+
+class AsyncReadTests(TransactionTestCase):
+
+    async def test_pages_items_both_ways(self):
+        await sync_to_async(create_items)(5)
+        response = await self.async_client.get('/async/items/', {'page_size': 2})
+        first = json.loads(response.content)
+        self.assertEqual(len(first['results']), 2)
+        self.assertIsNone(first['previous'])
+
+        second = json.loads((await self.async_client.get(first['next'])).content)
+        self.assertTrue(second['results'][0]['id'] > first['results'][-1]['id'])
+        back = json.loads((await self.async_client.get(second['previous'])).content)
+        self.assertEqual(back['results'], first['results'])
+
+    async def test_cart_requires_customer(self):
+        self.assertEqual((await self.async_client.get('/async/cart/')).status_code, 401)
+        customer, token = await sync_to_async(create_user_token)(Customer, 'customer')
+        response = await self.async_client.get('/async/cart/', headers={'Authorization': f"Token {token}"})
+        self.assertEqual(json.loads(response.content)['items'], [])
+        item, = await sync_to_async(create_items)(1)
+        await sync_to_async(inventory.set_stock_shards)(item.id, 4)
+        await sync_to_async(fill_cart)(customer, {item: 2})
+        await sync_to_async(cart_cache.invalidate_customers)([customer.id])
+        response = await self.async_client.get('/async/cart/', headers={'Authorization': f"Token {token}"})
+        self.assertEqual(json.loads(response.content)['subtotal'], '20.00')
+        _, cashier_token = await sync_to_async(create_user_token)(Cashier, 'cashier')
+        response = await self.async_client.get('/async/cart/', headers={'Authorization': f"Token {cashier_token}"})
+        self.assertEqual(response.status_code, 403)
+
+    async def test_item_detail(self):
+        item, sharded = await sync_to_async(create_items)(2)
+        await sync_to_async(inventory.set_stock_shards)(sharded.id, 4)
+        response = await self.async_client.get(f'/async/items/{item.id}')
+        self.assertEqual(json.loads(response.content)['name'], item.name)
+        # the stock of a sharded item is the sum of its shards
+        response = await self.async_client.get(f'/async/items/{sharded.id}')
+        self.assertEqual(json.loads(response.content)['quantity'], 10)
+        self.assertEqual((await self.async_client.get('/async/items/0')).status_code, 404)
+        self.assertEqual((await self.async_client.post('/async/items/')).status_code, 405)
+
+    async def test_search(self):
+        wire = await Item.objects.acreate(name='Copper wire', description='test', price=Decimal('25.00'))
+        await Item.objects.acreate(name='Hammer', description='test', price=Decimal('12.00'))
+        response = await self.async_client.get('/async/items/search/cop wi')
+        self.assertEqual([item['id'] for item in json.loads(response.content)['results']], [wire.id])
+        response = await self.async_client.get('/async/items/search/*')
+        self.assertEqual(len(json.loads(response.content)['results']), 2)
+        response = await self.async_client.get('/async/items/search/"')
+        self.assertEqual(json.loads(response.content)['results'], [])
+
+    async def test_technicians_require_customer(self):
+        approved, _ = await sync_to_async(create_user_token)(Technician, 'approved', nic_no='1', nic_image='nic.png',
+                                                             rate_per_hour=10, skill_category='mason',
+                                                             is_approved=True)
+        _, technician_token = await sync_to_async(create_user_token)(Technician, 'pending', nic_no='2',
+                                                                     nic_image='nic.png', rate_per_hour=10,
+                                                                     skill_category='mason')
+        _, token = await sync_to_async(create_user_token)(Customer, 'customer')
+
+        self.assertEqual((await self.async_client.get('/async/technicians/')).status_code, 401)
+        response = await self.async_client.get('/async/technicians/', headers={'Authorization': 'Token wrong'})
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get('/async/technicians/',
+                                               headers={'Authorization': f"Token {technician_token}"})
+        self.assertEqual(response.status_code, 403)
+        # tokens in the URL are only taken by the event stream
+        self.assertEqual((await self.async_client.get('/async/technicians/', {'token': token})).status_code, 401)
+        headers = {'Authorization': f"Token {token}"}
+        response = await self.async_client.get('/async/technicians/', headers=headers)
+        self.assertEqual([technician['id'] for technician in json.loads(response.content)], [approved.id])
+        response = await self.async_client.get(f'/async/technicians/{approved.id}', headers=headers)
+        self.assertEqual(json.loads(response.content)['id'], approved.id)
+        self.assertEqual((await self.async_client.get('/async/technicians/999', headers=headers)).status_code, 400)
+
+    async def test_purchased_orders_are_the_users_own(self):
+        customer, token = await sync_to_async(create_user_token)(Customer, 'customer')
+        other, _ = await sync_to_async(create_user_token)(Customer, 'other')
+        order = await Order.objects.acreate(customer=customer, total=10, delivery_fee=1)
+        await Order.objects.acreate(customer=other, total=10, delivery_fee=1)
+
+        self.assertEqual((await self.async_client.get('/async/account/purchased/')).status_code, 401)
+        response = await self.async_client.get('/async/account/purchased/', headers={'Authorization': f"Token {token}"})
+        self.assertEqual([order['id'] for order in json.loads(response.content)], [order.id])
+
+
+class SeedTests(TestCase):
+
+    def test_generates_related_rows_and_truncates_all_but_staff(self):
+        staff = RbacUser.objects.create_user('staff', 'staff@shop.aa', None, is_staff=True, role=UserRoles.ADMIN)
+        generated = dataset.Generator(seed=1).run(items=50, customers=20, technicians=3, delivery_guys=4,
+                                                  cashiers=2, orders=100, pos_orders=20, bookings=10, feedback=10)
+        self.assertEqual(Order.objects.count(), 100)
+        self.assertEqual(Customer.objects.filter(address__isnull=False).count(), 20)
+        self.assertTrue(OrderItem.objects.filter(order_id__in=generated['orders']).exists())
+        # history is spread over the past instead of the time of the insert
+        self.assertTrue(Order.objects.filter(time__lt=timezone.now() - timedelta(days=30)).exists())
+        self.assertEqual(DeliveryGuy.objects.exclude(current_delivery=None).count(),
+                         Order.objects.filter(status=OrderStates.AWAITING_DELIVERY).count())
+        self.assertTrue(self.client.login(username=f"customer{generated['customers'][0]}", password='pass'))
+        self.assertEqual(list(ledger.mismatches()), [])
+
+        dataset.truncate()
+        self.assertEqual(list(RbacUser.objects.all()), [staff])
+        self.assertFalse(Item.objects.exists() or Order.objects.exists() or OrderItem.objects.exists())
+
+
+class InstrumentationTests(TestCase):
+
+    def test_reports_queries_and_timings(self):
+        customer, client = create_customer('buyer')
+        response = client.get('/account/purchased/')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="1 queries", view;dur=[\d.]+, '
+                                                    r'serialize;dur=[\d.]+, total;dur=[\d.]+$')
+
+        with self.assertLogs('helpers.instrumentation', 'INFO') as logs:
+            client.get('/account/purchased/')
+        line = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((line['view'], line['status'], line['queries']), ('marketplace.views.orders_view', 200, 1))
+        self.assertLessEqual(line['sql_ms'] + line['serialize_ms'], line['total_ms'])
+        self.assertLessEqual(line['view_ms'], line['total_ms'])
+
+    @override_settings(SLOW_QUERY_MS=0)
+    def test_keeps_slow_queries_for_admins(self):
+        _, admin = create_user(RbacUser, 'admin', role=UserRoles.ADMIN)
+        admin.delete('/admin_area/slow_queries/')
+        customer, client = create_customer('buyer')
+        client.get('/account/purchased/')
+
+        queries = admin.get('/admin_area/slow_queries/').data['queries']
+        self.assertEqual(queries[-1]['view'], 'marketplace.views.orders_view')
+        self.assertIn('WHERE "marketplace_order"."customer_id" = ?', queries[-1]['sql'])
+        self.assertEqual(client.get('/admin_area/slow_queries/').status_code, 403)
@@ -1,6 +1,6 @@
 from django.urls import path
 
-from . import views
+from . import async_views, views
 
 
 urlpatterns = [
@@ -8,6 +8,7 @@ urlpatterns = [
     path("items/", views.items_view, name="items"),
     path("items/search/", views.search, name='search'),
     path("items/search/<str:value>", views.search, name='search'),
+    path("items/suggest/<str:value>", views.suggest, name='suggest'),
 
     path("cart/", views.my_cart, name="cart"),
     path("cart/item/<int:key>", views.cart_item_view, name="cart_item"),
@@ -28,6 +29,8 @@ urlpatterns = [
     path("admin_area/items/", views.items_admin_view, name="items_admin"),
     path("admin_area/outofstock/", views.out_of_stock_items),
     path("admin_area/instock/", views.in_stock_items),
+    path("admin_area/catalog_cache/", views.catalog_cache_view),
+    path("admin_area/slow_queries/", views.slow_queries_view),
     path("admin_area/cashiers/", views.cashiers_view),
     path("admin_area/cashiers/<int:key>", views.cashiers_view),
     path("admin_area/technicians/", views.admin_technicians_view),
@@ -44,6 +47,7 @@ urlpatterns = [
     path("admin_area/orders/<int:key>", views.admin_orders_view, name="feedbacks_admin"),
 
     path("cashier/pos_orders/", views.billing_view),
+    path("cashier/pos_orders/sync/", views.pos_orders_sync_view),
     path("cashier/change_password/", views.cashier_change_password),
 
     path("technician/booking/", views.technician_request_view),
@@ -56,8 +60,21 @@ urlpatterns = [
 
     path("delivery_guy/deliveries/", views.delivery_guy_orders),
     path("delivery_guy/deliveries/<int:key>", views.delivery_guy_orders),
+    path("delivery_guy/claim/", views.delivery_guy_claim_order),
     path("delivery_guy/accept/order/<int:key>", views.delivery_guy_accept_order),
     path("delivery_guy/delivered/order/<int:key>", views.delivery_guy_delivered_order),
     path("delivery_guy/current/", views.current_delivery_view),
+
+    path("events/", async_views.events_view),
+
+    # async variants of the read heavy endpoints, for the ASGI application
+    path("async/items/<int:key>", async_views.items_view),
+    path("async/items/", async_views.items_view),
+    path("async/items/search/", async_views.search),
+    path("async/items/search/<str:value>", async_views.search),
+    path("async/cart/", async_views.my_cart),
+    path("async/technicians/", async_views.technicians_view),
+    path("async/technicians/<int:key>", async_views.technicians_view),
+    path("async/account/purchased/", async_views.orders_view),
 ]
 
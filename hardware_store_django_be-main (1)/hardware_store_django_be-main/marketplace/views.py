@@ -1,31 +1,42 @@
 import math
+from collections import Counter
 from decimal import Decimal
 
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from django.db.models import Q
 from django.utils import timezone
+from django.views.decorators.http import condition
 from rest_framework import status
-from rest_framework.authentication import TokenAuthentication
-from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, parser_classes
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from authentication.backends import CachedTokenAuthentication
 from authentication.serializers import CashierSerializer, TechnicianSerializer, DeliveryGuySerializer
 from helpers.common_messages import not_exist_msg
+from helpers import instrumentation
 from helpers.functions import process_payment
-from .models import Item, Cart, CartItem, Order, Customer, Cashier, PosOrder, TechnicianBooking, Feedback, Technician, \
-    DeliveryGuy, BookingStates, OrderStates
+from . import cart_cache, carts, catalog_cache, dispatch, etags, inventory, ledger, pos, querysets, reservations, \
+    search as item_search
+from .models import Item, Cart, CartItem, Order, OrderItem, Cashier, PosOrder, TechnicianBooking, Feedback, \
+    Technician, DeliveryGuy, BookingStates, OrderStates, MovementKinds
+from .pagination import paginate, RankedItemCursorPagination
+from .parsers import NDJSONParser
 from .permission_classes import IsAdmin, IsCustomer, IsTechnician, IsDeliveryGuy, IsCashier, IsDeliveryGuyApproved, \
     IsTechnicianApproved
 from .serializers import ItemSerializer, CartSerializer, PosOrderSerializer, TechnicianBookingSerializer, \
-    FeedbackSerializer, OrderSerializer, PosOrderItemSerializer, ChangePasswordSerializer
+    FeedbackSerializer, OrderSerializer, ChangePasswordSerializer
+from .suggest import name_index
 
 
 @api_view(['GET'])
+@condition(etag_func=etags.items_etag)
 def items_view(request, key=None):
     if key is None:
-        item_list = Item.objects.all()
-        serializer = ItemSerializer(item_list, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return catalog_cache.cached_response(request, lambda: paginate(request, Item.objects.all(), ItemSerializer))
     else:
         try:
             item = Item.objects.get(id=key)
@@ -36,18 +47,18 @@ def items_view(request, key=None):
 
 
 @api_view(['GET', 'POST', 'PUT', 'DELETE'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated, IsAdmin])
 def items_admin_view(request, key=None):
     if key is None:
         if request.method == 'GET':
-            item_list = Item.objects.all()
-            serializer = ItemSerializer(item_list, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return paginate(request, Item.objects.all(), ItemSerializer)
         elif request.method == 'POST':
             serializer = ItemSerializer(data=request.data)
             if serializer.is_valid():
-                item = serializer.save()
+                with transaction.atomic():
+                    item = serializer.save()
+                    ledger.record(MovementKinds.RESTOCK, {item.id: item.quantity})
                 return Response(ItemSerializer(item).data, status=status.HTTP_201_CREATED)
             else:
                 return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -63,8 +74,17 @@ def items_admin_view(request, key=None):
         elif request.method == 'PUT':
             serializer = ItemSerializer(item, data=request.data)
             if serializer.is_valid():
-                serializer.save()
-                return Response(serializer.data)
+                # the stock changes by the difference to the quantity read, sales made meanwhile are kept
+                stock = inventory.on_hand(item, cached=False)
+                change = serializer.validated_data.pop('quantity', stock) - stock
+                try:
+                    with transaction.atomic():
+                        serializer.save()
+                        inventory.adjust_stock(item.id, change)
+                except inventory.OutOfStock as error:
+                    return Response({'errors': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+                item.refresh_from_db(fields=['quantity', 'reserved'])
+                return Response(ItemSerializer(item).data)
 
             print(serializer.errors)
             return Response({'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
@@ -76,73 +96,108 @@ def items_admin_view(request, key=None):
 @api_view(['GET'])
 def search(request, value=""):
     if request.method == 'GET':
-        if value == '*':
-            all_items = Item.objects.all()
-            serializer = ItemSerializer(all_items, many=True)
-            return Response(serializer.data, status=200)
+        if value == '*' or not value.strip():
+            return catalog_cache.cached_response(
+                request, lambda: paginate(request, Item.objects.all(), ItemSerializer))
 
-        searched_items = Item.objects.filter(name__icontains=value)
-        serializer = ItemSerializer(searched_items, many=True)
-        return Response(serializer.data, status=200)
+        # name and description matches, answered from the FTS5 index when the database has it
+        if item_search.index_available():
+            return paginate(request, item_search.ranked_items(value), ItemSerializer, RankedItemCursorPagination)
+        return paginate(request, item_search.matching_items(value), ItemSerializer)
 
 
-# Create your views here.
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
+def suggest(request, value):
+    try:
+        limit = min(int(request.query_params.get('limit', settings.SUGGEST_LIMIT)), settings.SUGGEST_MAX_LIMIT)
+    except ValueError:
+        return Response({'errors': 'limit should be a number'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(name_index.suggest(value, max(limit, 1)), status=status.HTTP_200_OK)
+
+
+def cart_changed():
+    # the holds of the cart kept changing under the last of reservations.hold_attempts, nothing was changed
+    return Response({'errors': 'The cart was changed by another request, try again'}, status=status.HTTP_409_CONFLICT)
+
+
+# Create your views here.
+@api_view(['GET', 'PATCH'])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsCustomer])
 def my_cart(request):
-    cart = None
-    try:
-        cart = Cart.objects.get(customer__username=request.user.username)
-    except Cart.DoesNotExist as err:
-        # create cart if not exist
-        cart = Cart(customer=Customer.objects.get(username=request.user))
-        cart.save()
-    except Exception as err:
-        Response(data={'error': err.__str__()}, status=status.HTTP_400_BAD_REQUEST)
-    serializer = CartSerializer(instance=cart)
-    return Response(data=serializer.data, status=status.HTTP_200_OK)
+    if request.method == 'PATCH':
+        # sets the quantities of many lines at once: {"items": [{"item": <id>, "quantity": <n>}, ...]}, 0 removes
+        try:
+            changes = carts.cart_changes(request.data.get('items') if isinstance(request.data, dict) else None)
+            cart, _ = Cart.objects.get_or_create(customer_id=request.user.id)
+            carts.apply_changes(cart, changes)
+        except (carts.InvalidCartChange, inventory.OutOfStock) as error:
+            return Response({'errors': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+        except (reservations.HoldChanged, IntegrityError):
+            return cart_changed()
+        cart = Cart.objects.prefetch_related('items__item').get(id=cart.id)
+        return Response(data=CartSerializer(instance=cart).data, status=status.HTTP_200_OK)
+
+    def build_cart():
+        try:
+            cart = Cart.objects.prefetch_related('items__item').get(customer_id=request.user.id)
+        except Cart.DoesNotExist:
+            # create cart if not exist
+            cart = Cart(customer=request.user)
+            cart.save()
+        return CartSerializer(instance=cart).data
+
+    # rendered once per change of the cart or of its items, reads don't query
+    return cart_cache.cached_response(request.user.id, build_cart)
 
 
 @api_view(['POST', 'DELETE'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsCustomer])
 def cart_item_view(request, key):
     if request.method == 'POST':
         cart = None
         try:
             # get the cart
-            cart = Cart.objects.get(customer__username=request.user.username)
+            cart = Cart.objects.get(customer_id=request.user.id)
         except Cart.DoesNotExist as err:
             # create cart if not exist
-            cart = Cart(customer=Customer.objects.get(username=request.user.username))
+            cart = Cart(customer=request.user)
             cart.save()
 
         # add item
         item = None
         try:
             item = Item.objects.get(id=key)
-            if item.quantity <= 0:
+            if inventory.on_hand(item) <= 0:
                 raise Exception("Item out of stock.")
         except Exception as err:
             return Response(data={'error': err.__str__()}, status=status.HTTP_404_NOT_FOUND)
 
         cart_item = cart.items.filter(item=item).first()
-        if cart_item is None:
-            cart.items.create(cart=cart, item=item, quantity=1)
-            cart.save()
-        else:
-            # if in cart increase qty
-            if cart_item.quantity >= item.quantity:
-                return Response({'errors': 'Item out of stock'}, status=status.HTTP_400_BAD_REQUEST)
-            cart_item.quantity = cart_item.quantity + 1
-            cart_item.save()
+        try:
+            with transaction.atomic():
+                if cart_item is None:
+                    cart.items.create(cart=cart, item=item, quantity=1)
+                else:
+                    # if in cart increase qty
+                    cart_item.quantity = cart_item.quantity + 1
+                    cart_item.save()
+                # the stock is held for the cart until STOCK_HOLD_TTL after its last change, after the line is
+                # written so the transaction starts with a write. Sharded items are first come first served
+                if not item.stock_shards:
+                    reservations.hold(cart.id, item.id, cart_item.quantity if cart_item else 1)
+                cart_cache.invalidate_customers([request.user.id])
+        except inventory.OutOfStock:
+            return Response({'errors': 'Item out of stock'}, status=status.HTTP_400_BAD_REQUEST)
+        except (reservations.HoldChanged, IntegrityError):
+            return cart_changed()
         return Response(status=status.HTTP_200_OK)
 
     elif request.method == 'DELETE':
         item, cart = None, None
         try:
-            cart = Cart.objects.get(customer__username=request.user.username)
+            cart = Cart.objects.get(customer_id=request.user.id)
             item = Item.objects.get(id=key)
         except Cart.DoesNotExist or Item.DoesNotExist:
             return Response(data=not_exist_msg, status=status.HTTP_404_NOT_FOUND)
@@ -150,54 +205,62 @@ def cart_item_view(request, key):
         cart_item = cart.items.filter(item=item).first()
         if cart_item is None:
             return Response(status=status.HTTP_404_NOT_FOUND)
-        elif cart_item.quantity > 1:
-            cartItem = CartItem.objects.get(item=item)
-            cartItem.quantity = cartItem.quantity - 1
-            cartItem.save()
-        else:
-            cartItem = CartItem.objects.get(item=item)
-            cartItem.delete()
+        try:
+            with transaction.atomic():
+                if cart_item.quantity > 1:
+                    # the line of this cart, other carts may hold the same item
+                    cart_item.quantity = cart_item.quantity - 1
+                    cart_item.save()
+                else:
+                    cart_item.quantity = 0
+                    cart_item.delete()
+                if not item.stock_shards:
+                    reservations.hold(cart.id, item.id, cart_item.quantity)
+                cart_cache.invalidate_customers([request.user.id])
+        except (reservations.HoldChanged, IntegrityError):
+            return cart_changed()
         return Response(status=status.HTTP_200_OK)
 
 
 @api_view(['POST'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsCustomer])
 def payment(request):
-    cart = Cart.objects.get(customer__username=request.user.username)
+    cart_items = list(CartItem.objects.filter(cart__customer_id=request.user.id).select_related('item'))
 
     # validating cart
-    if cart.items.count() == 0:
+    if len(cart_items) == 0:
         return Response({'errors': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
 
-    cart_items = cart.items.all()
+    # stock held for this cart is available to it
+    held = reservations.held_quantities(cart_items[0].cart_id)
     for cart_item in cart_items:
-        item = Item.objects.get(id=cart_item.item.id)
-        if cart_item.quantity > item.quantity:
+        if cart_item.quantity > inventory.available(cart_item.item) + held.get(cart_item.item_id, 0):
             # Item is out of stock
-            return Response({'errors': f'Requested quantity is not available in item: {item} '},
+            return Response({'errors': f'Requested quantity is not available in item: {cart_item.item} '},
                             status=status.HTTP_400_BAD_REQUEST)
 
     # process payment
-    total = sum(item.item.price * item.quantity for item in cart.items.all())
+    total = sum(cart_item.item.price * cart_item.quantity for cart_item in cart_items)
     delivery_fee = total * Decimal(0.1)
     if process_payment(total):
-        # change items to SOLD
-        for cart_item in cart.items.all():
-            stock_item = Item.objects.get(id=cart_item.item.id)
-            stock_item.quantity = stock_item.quantity - cart_item.quantity
-            stock_item.save()
-
-        # placing an order for the payment
-        new_order = Order.objects.create(customer_id=request.user.id, total=total, delivery_fee=delivery_fee)
-        for cart_item in cart.items.all():
-            new_order.items.create(
-                item=cart_item.item,
-                quantity=cart_item.quantity
-            )
-
-        # clear cart
-        cart.delete()
+        try:
+            with transaction.atomic():
+                # change items to SOLD, fails as a whole if a concurrent checkout took the stock meanwhile. The
+                # cart's holds turn into the sale
+                quantities = {cart_item.item_id: cart_item.quantity for cart_item in cart_items}
+                held = reservations.take_holds(cart_items[0].cart_id, quantities)
+                inventory.decrement_stock(quantities, held=held)
+
+                # placing an order for the payment
+                new_order = Order.objects.create(customer_id=request.user.id, total=total, delivery_fee=delivery_fee)
+                OrderItem.objects.bulk_create([OrderItem(order=new_order, item_id=cart_item.item_id,
+                                                         quantity=cart_item.quantity) for cart_item in cart_items])
+
+                # clear cart
+                Cart.objects.filter(customer_id=request.user.id).delete()
+        except inventory.OutOfStock as err:
+            return Response({'errors': str(err)}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response(status=status.HTTP_200_OK)
     # failed payment
@@ -220,11 +283,11 @@ def validate_item_price(item_id, price):
 
 
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAuthenticated])
 def orders_view(request):
     try:
-        orders = Order.objects.filter(customer_id=request.user.id)
+        orders = querysets.order_list().filter(customer_id=request.user.id)
         serializer = OrderSerializer(orders, many=True)
         return Response(data=serializer.data, status=status.HTTP_200_OK)
     except Exception as error:
@@ -232,25 +295,40 @@ def orders_view(request):
 
 
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdmin])
 def out_of_stock_items(request):
-    items = Item.objects.filter(quantity=0)
-    serializer = ItemSerializer(items, many=True)
-    return Response(data=serializer.data, status=status.HTTP_200_OK)
+    return paginate(request, querysets.with_stock(Item.objects.all()).filter(stock=0), ItemSerializer)
 
 
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdmin])
 def in_stock_items(request):
-    items = Item.objects.exclude(quantity=0)
-    serializer = ItemSerializer(items, many=True)
-    return Response(data=serializer.data, status=status.HTTP_200_OK)
+    return paginate(request, querysets.with_stock(Item.objects.all()).exclude(stock=0), ItemSerializer)
+
+
+@api_view(['GET'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAdmin])
+def catalog_cache_view(request):
+    return Response(catalog_cache.stats(), status=status.HTTP_200_OK)
+
+
+@api_view(['GET', 'DELETE'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsAdmin])
+def slow_queries_view(request):
+    """Latest queries slower than SLOW_QUERY_MS of this process, newest first. DELETE empties the log"""
+    if request.method == 'DELETE':
+        instrumentation.slow_queries.clear()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    return Response({'threshold_ms': settings.SLOW_QUERY_MS, 'queries': instrumentation.slow_queries.entries()},
+                    status=status.HTTP_200_OK)
 
 
 @api_view(['GET', 'POST', 'PUT', 'DELETE'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdmin])
 def cashiers_view(request, key=None):
     try:
@@ -293,7 +371,7 @@ def cashiers_view(request, key=None):
 
 
 @api_view(['GET', 'DELETE'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdmin])
 def admin_technicians_view(request, key=None):
     try:
@@ -317,7 +395,7 @@ def admin_technicians_view(request, key=None):
 
 
 @api_view(['GET', 'DELETE'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdmin])
 def admin_delivery_guy_view(request, key=None):
     try:
@@ -341,41 +419,49 @@ def admin_delivery_guy_view(request, key=None):
 
 
 @api_view(['POST'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsCashier])
 def billing_view(request):
     try:
         # validate items
-        for item in request.data['items']:
-            if Item.objects.get(id=item['item']).quantity < item['quantity']:
-                return Response({'errors': f'Item: {item["item"]} out of stock'}, status=status.HTTP_400_BAD_REQUEST)
-
-        total = sum([Item.objects.get(id=item['item']).price * item['quantity'] for item in request.data['items']])
+        lines = pos.receipt_lines(request.data.get('items'))
         serializer = PosOrderSerializer(data=request.data, partial=True)
 
         if serializer.is_valid():
-            order = serializer.save(cashier=Cashier.objects.get(id=request.user.id), total=total)
-            for item in request.data['items']:
-                item['pos_order'] = order.id
-                item_serializer = PosOrderItemSerializer(data=item)
-                if item_serializer.is_valid():
-                    item_serializer.save()
-
-                    # change stocks
-                    current_item = Item.objects.get(id=item['item'])
-                    current_item.quantity -= item['quantity']
-                    current_item.save()
-                else:
-                    return Response(item_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
+            pos.place_pos_order(lines, lambda total: serializer.save(cashier_id=request.user.id, total=total))
             return Response(serializer.data)
         return Response({'error': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+    except inventory.OutOfStock as error:
+        return Response({'errors': f'Item: {", ".join(str(item) for item in error.items)} out of stock'},
+                        status=status.HTTP_400_BAD_REQUEST)
     except Exception as error:
         return Response({'errors': str(error)}, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['POST'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsCashier])
+@parser_classes([JSONParser, NDJSONParser])
+def pos_orders_sync_view(request):
+    """
+    Bulk upload of receipts queued by an offline terminal, as a JSON list or NDJSON (one receipt per line). Every
+    receipt carries a client generated `key` so replays after a reconnect are reported as duplicates instead of being
+    charged again.
+    """
+    try:
+        receipts = request.data
+        if isinstance(receipts, dict):
+            return Response({'errors': 'Expected a list of receipts'}, status=status.HTTP_400_BAD_REQUEST)
+        results = pos.sync_receipts(receipts, request.user.id, settings.POS_SYNC_BATCH_SIZE)
+        summary = Counter(result['status'] for result in results)
+        return Response({'created': summary['created'], 'duplicate': summary['duplicate'],
+                         'rejected': summary['rejected'], 'results': results})
+    except ParseError as error:
+        return Response({'errors': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+
 @api_view(['PUT'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsCashier])
 def cashier_change_password(request):
     try:
@@ -383,19 +469,19 @@ def cashier_change_password(request):
         if not serializer.is_valid():
             return Response({'errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
-        cashier = Cashier.objects.get(id=request.user.id)
+        cashier = request.user
         if not cashier.check_password(serializer.data.get('old_password')):
             return Response({"detail": "Old password is incorrect."}, status=status.HTTP_400_BAD_REQUEST)
 
         cashier.set_password(serializer.data.get("new_password"))
-        cashier.save()
+        cashier.save(update_fields=['password'])
         return Response({'detail': 'Password changes successfully'})
     except Exception as error:
         return Response({'errors': str(error)}, status=status.HTTP_400_BAD_REQUEST)
 
 
 @api_view(['DELETE', 'GET'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdmin])
 def bill_manage_view(request, key=None):
     try:
@@ -418,7 +504,7 @@ def bill_manage_view(request, key=None):
 
 
 @api_view(['POST'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdmin])
 def approve_technician_view(request, key):
     try:
@@ -432,7 +518,7 @@ def approve_technician_view(request, key):
 
 
 @api_view(['POST'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdmin])
 def approve_delivery_guy_view(request, key):
     try:
@@ -446,12 +532,12 @@ def approve_delivery_guy_view(request, key):
 
 
 @api_view(['POST', 'PUT', 'DELETE', 'GET'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsCustomer])
 def booking_view(request, key=None):
     try:
         if request.method == 'POST':
-            customer = Customer.objects.get(id=request.user.id)
+            customer = request.user
             technician = Technician.objects.get(id=int(request.data['technician']))
             serializer = TechnicianBookingSerializer(data=request.data, partial=True)
             if serializer.is_valid():
@@ -462,11 +548,11 @@ def booking_view(request, key=None):
 
         if request.method == 'GET':
             if not key:
-                bookings = TechnicianBooking.objects.filter(customer_id=request.user.id).all()
+                bookings = querysets.booking_list().filter(customer_id=request.user.id)
                 serializer = TechnicianBookingSerializer(bookings, many=True)
                 return Response(serializer.data)
             else:
-                booking = TechnicianBooking.objects.filter(customer_id=request.user.id).get(id=key)
+                booking = querysets.booking_list().filter(customer_id=request.user.id).get(id=key)
                 serializer = TechnicianBookingSerializer(booking)
                 return Response(serializer.data)
 
@@ -493,7 +579,7 @@ def booking_view(request, key=None):
 
 
 @api_view(['GET', 'DELETE'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdmin])
 def feedbacks_admin_view(request, key=None):
     try:
@@ -517,7 +603,7 @@ def feedbacks_admin_view(request, key=None):
 
 
 @api_view(['GET', 'POST', 'DELETE'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsCustomer])
 def item_feedbacks_view(request, item_id, feedback_id=None):
     try:
@@ -547,16 +633,16 @@ def item_feedbacks_view(request, item_id, feedback_id=None):
 
 
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsTechnician])
 def technician_request_view(request, key=None):
     try:
         if not key:
-            booking_requests = TechnicianBooking.objects.filter(technician_id=request.user.id).all()
+            booking_requests = querysets.booking_list().filter(technician_id=request.user.id)
             serializer = TechnicianBookingSerializer(booking_requests, many=True)
             return Response(serializer.data)
         else:
-            booking_request = TechnicianBooking.objects.get(id=key)
+            booking_request = querysets.booking_list().get(id=key)
             serializer = TechnicianBookingSerializer(booking_request)
             return Response(serializer.data)
 
@@ -565,7 +651,7 @@ def technician_request_view(request, key=None):
 
 
 @api_view(['PUT'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsTechnicianApproved])
 def technician_accept_view(request, key):
     try:
@@ -593,7 +679,7 @@ def technician_accept_view(request, key):
 
 
 @api_view(['PUT'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsTechnicianApproved])
 def technician_started_view(request, key):
     try:
@@ -618,7 +704,7 @@ def technician_started_view(request, key):
 
 
 @api_view(['PUT'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsTechnicianApproved])
 def technician_ended_view(request, key):
     try:
@@ -642,7 +728,7 @@ def technician_ended_view(request, key):
 
 
 @api_view(['PUT'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsTechnicianApproved])
 def technician_decline_view(request, key):
     try:
@@ -656,7 +742,7 @@ def technician_decline_view(request, key):
 
 
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsTechnicianApproved])
 def technician_work_summary_view(request, key):
     try:
@@ -678,16 +764,17 @@ def technician_work_summary_view(request, key):
 
 
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsDeliveryGuy])
 def delivery_guy_orders(request, key=None):
     try:
         if not key:
-            available_orders = Order.objects.filter(Q(status=OrderStates.PAID) | Q(status=OrderStates.DELIVERED))
+            available_orders = querysets.order_list() \
+                .filter(Q(status=OrderStates.PAID) | Q(status=OrderStates.DELIVERED))
             serializer = OrderSerializer(available_orders, many=True)
             return Response(serializer.data)
         else:
-            order = Order.objects.get(id=key)
+            order = querysets.order_list().get(id=key)
             serializer = OrderSerializer(order)
             return Response(serializer.data)
 
@@ -696,35 +783,40 @@ def delivery_guy_orders(request, key=None):
 
 
 @api_view(['PUT'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsDeliveryGuyApproved])
 def delivery_guy_accept_order(request, key):
     try:
-        current_user = DeliveryGuy.objects.get(id=request.user.id)
-
-        if current_user.current_delivery is not None:
-            return Response({'errors': 'Please completed the current delivery before accepting new'},
-                            status=status.HTTP_400_BAD_REQUEST)
-
         order = Order.objects.get(id=key)
         if order.status == OrderStates.DELIVERED:
             return Response({'errors': 'Cannot accept a delivered order'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # update order status
-        order.status = OrderStates.AWAITING_DELIVERY
-        order.save()
-
-        # add order to delivery_guy's delivery
-        current_user.current_delivery = order
-        current_user.save()
+        # the order becomes the delivery guy's delivery only if nobody took it meanwhile
+        if not dispatch.take_order(request.user.id, order.id):
+            return Response({'errors': 'Order is already accepted by another delivery guy'},
+                            status=status.HTTP_400_BAD_REQUEST)
         return Response()
 
     except Exception as error:
         return Response({'errors': str(error)}, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['POST'])
+@authentication_classes([CachedTokenAuthentication])
+@permission_classes([IsDeliveryGuyApproved])
+def delivery_guy_claim_order(request):
+    try:
+        order = dispatch.claim_next_order(request.user.id)
+        if order is None:
+            return Response({'errors': 'No order is waiting for delivery'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(OrderSerializer(order).data)
+
+    except Exception as error:
+        return Response({'errors': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+
 @api_view(['PUT'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsDeliveryGuyApproved])
 def delivery_guy_delivered_order(request, key):
     try:
@@ -733,9 +825,9 @@ def delivery_guy_delivered_order(request, key):
         order.status = OrderStates.DELIVERED
         order.save()
         # remove order to delivery_guy's delivery
-        current_user = DeliveryGuy.objects.get(id=request.user.id)
+        current_user = request.user
         current_user.current_delivery = None
-        current_user.save()
+        current_user.save(update_fields=['current_delivery'])
         return Response()
 
     except Exception as error:
@@ -743,11 +835,11 @@ def delivery_guy_delivered_order(request, key):
 
 
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsDeliveryGuy])
 def current_delivery_view(request):
     try:
-        current_delivery = DeliveryGuy.objects.get(id=request.user.id).current_delivery
+        current_delivery = request.user.current_delivery
         if current_delivery is None:
             return Response({'errors': 'No current delivery'}, status=status.HTTP_404_NOT_FOUND)
         serializer = OrderSerializer(current_delivery)
@@ -758,8 +850,10 @@ def current_delivery_view(request):
 
 
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsCustomer])
+# innermost, so the ETag is only computed (and 304 only returned) once DRF has authenticated the request
+@condition(etag_func=etags.technicians_etag)
 def technicians_view(request, key=None):
     try:
         if not key:
@@ -776,17 +870,17 @@ def technicians_view(request, key=None):
 
 
 @api_view(['GET'])
-@authentication_classes([TokenAuthentication])
+@authentication_classes([CachedTokenAuthentication])
 @permission_classes([IsAdmin])
 def admin_orders_view(request, key=None):
     try:
         if not key:
-            cashiers = Order.objects.all()
-            serializer = OrderSerializer(cashiers, many=True)
+            orders = querysets.order_list()
+            serializer = OrderSerializer(orders, many=True)
             return Response(serializer.data)
         else:
-            cashier = Order.objects.get(id=key)
-            serializer = OrderSerializer(cashier)
+            order = querysets.order_list().get(id=key)
+            serializer = OrderSerializer(order)
             return Response(serializer.data)
 
     except Exception as error: